@@ -1,47 +1,284 @@
 
-from app.tools.overpass import search
-from app.agent.planner import enrich_lead
-from app.memory.vector_store import is_duplicate
-from app.services.sheets import append_row
-from app.tools.scraper import fetch_text
-from app.tools.email import extract as extract_email
+from app.tools.overpass import iter_search
+from app.tools.harvest import harvest as harvest_area
+from app.tools.osm_extract import iter_extract, resolve_extract
+from app.agent.jobs import CANCELLED, DONE, ERROR, RUNNING, Job, new_stats, resource
+from app.agent.planner import ENRICH_BATCH_SIZE, enrich_leads, osm_key
+from app.agent.pipeline import Pipeline
+from app.memory.vector_store import dedupe_batch, index_stats, save_index
+from app.models.lead import Lead
+from app.services.checkpoints import JobCheckpoint, get_checkpoints
+from app.services.metrics import Histogram, set_job
+from app.services.lead_store import INSERTED, UNCHANGED, get_replicator, get_store, save_lead
+from app.services.uuid_service import lead_id
+from app.tools.scraper import find_emails
+import os
+import threading
 import time
-import uuid
-
-AGENT_STATS = {
-    "status": "idle",
-    "last_query": None,
-    "started_at": None,
-    "finished_at": None,
-    "pages_processed": 0,
-    "leads_written": 0,
-    "skipped_duplicates": 0,
-    "errors": 0,
-}
-
-def run_agent(query: str):
-    global AGENT_STATS
-    AGENT_STATS.update({
-        "status": "running",
-        "last_query": query,
-        "started_at": time.time(),
-        "finished_at": None,
-        "pages_processed": 0,
-        "leads_written": 0,
-        "skipped_duplicates": 0,
-        "errors": 0,
-    })
+from typing import Optional
 
+# Worker counts per pipeline stage and the size of the queues between them
+ENRICH_WORKERS = int(os.getenv("AGENT_ENRICH_WORKERS", "4"))
+SCRAPE_WORKERS = int(os.getenv("AGENT_SCRAPE_WORKERS", "2"))
+# Websites each scrape worker fetches concurrently
+SCRAPE_BATCH_SIZE = int(os.getenv("AGENT_SCRAPE_BATCH_SIZE", "16"))
+WRITE_WORKERS = int(os.getenv("AGENT_WRITE_WORKERS", "2"))
+QUEUE_SIZE = int(os.getenv("AGENT_QUEUE_SIZE", "50"))
+# Leads deduped (and embedded) together in one call
+DEDUP_BATCH_SIZE = int(os.getenv("DEDUP_BATCH_SIZE", "32"))
+
+_stats_lock = threading.Lock()
+
+STAGE_SECONDS = Histogram(
+    "agent_stage_seconds", "Time a pipeline stage spends per call (per batch when batched)", ["job", "stage"]
+)
+
+EMPTY_EMAILS = {"N/A", "na", "none", "null", ""}
+
+
+def _check_location(raw, location_filter=None, counters=None):
+    # Light location check (backup - most filtering done in Overpass)
+    if location_filter:
+        tags = raw.get("tags", {})
+        # Check if location appears anywhere in tags (loose match)
+        all_tags_text = " ".join(str(v).lower() for v in tags.values())
+        if location_filter.lower() not in all_tags_text and counters is not None:
+            # Don't skip - Overpass area search should have filtered already
+            # This is just a safety check
+            with _stats_lock:
+                counters["filtered"] += 1
+
+
+def _settle(job: Job, outcome: str, osm: Optional[str], **data) -> None:
+    # A lead's final outcome: streamed to followers and checkpointed. Leads
+    # drained after a cancel may have skipped scraping, so they stay open.
+    job.emit("lead", outcome=outcome, osm=osm, **data)
+    if job.checkpoint is not None and osm:
+        if job.cancelled:
+            job.checkpoint.forget(osm)
+        else:
+            job.checkpoint.settle(osm, outcome)
+
+
+def _accept(raw, enriched, job: Job):
+    if not enriched:
+        print(f"⏭️ Skipped OSM {raw.get('type', '?')}/{raw.get('id', '?')}: No name or invalid")
+        _settle(job, "skipped", osm_key(raw), reason="no name or invalid")
+        return None
+
+    # Only require name - email, phone, address are optional
+    if not enriched.get("name") or not enriched.get("name").strip():
+        print(f"⏭️ Skipped OSM {raw.get('type', '?')}/{raw.get('id', '?')}: Missing business name")
+        _settle(job, "skipped", osm_key(raw), reason="missing business name")
+        return None
+
+    print(f"📝 Processing: {enriched.get('name', 'Unknown')}")
+    # OSM identity travels with the lead so its id is deterministic, and its
+    # location (node position or way center) lets dedup compare only nearby leads
+    enriched["osm"] = osm_key(raw)
+    point = raw.get("center") or raw
+    enriched["lat"], enriched["lon"] = point.get("lat"), point.get("lon")
+    return enriched
+
+
+def _enrich(raws, job: Job, location_filter=None, counters=None):
+    if job.cancelled:
+        if job.checkpoint is not None:
+            for raw in raws:
+                job.checkpoint.forget(osm_key(raw))
+        return [None] * len(raws)
+    for raw in raws:
+        _check_location(raw, location_filter, counters)
+    # Rules first, then one LLM prompt per batch for whatever they could not
+    # settle; the LLM is shared fairly with the other running jobs
+    with resource("llm").slot(job.id):
+        enriched = enrich_leads(
+            raws,
+            batch_size=ENRICH_BATCH_SIZE,
+            count_avoided=lambda n: job.bump("llm_calls_avoided", n),
+        )
+    return [_accept(raw, lead, job) for raw, lead in zip(raws, enriched)]
+
+
+def _scrape(batch, job: Job):
+    # Try to scrape email from website if missing (optional - won't skip if fails).
+    # The whole batch is fetched concurrently; a failed fetch just leaves it empty.
+    todo = [] if job.cancelled else [
+        lead for lead in batch
+        if ((not lead.get("email")) or lead.get("email") in EMPTY_EMAILS)
+        and (lead.get("website") or "").startswith("http")
+    ]
+    if todo:
+        for lead, scraped_email in zip(todo, find_emails([lead["website"] for lead in todo])):
+            if scraped_email:
+                lead["email"] = scraped_email
+                print(f"  ✉️ Scraped email: {scraped_email}")
+    return batch
+
+
+def _dedup(batch, job: Job):
+    # A lead we already stored is the same business by identity; the upsert
+    # in persist decides whether anything changed
+    store = get_store()
+    fresh = [lead for lead in batch if not store.exists(lead_id(lead))]
+    duplicates = dict(zip(map(id, fresh), dedupe_batch(fresh))) if fresh else {}
+    kept = []
+    for enriched in batch:
+        if duplicates.get(id(enriched)):
+            job.bump("skipped_duplicates")
+            _settle(job, "duplicate", enriched.get("osm"), name=enriched.get("name"))
+            print(f"  🔄 Duplicate detected, skipping: {enriched.get('name', 'Unknown')}")
+            kept.append(None)
+        else:
+            kept.append(enriched)
+    return kept
+
+
+def _persist(enriched, job: Job):
+    lead = Lead.from_enriched(enriched)
+    row = lead.to_row()
+
+    # Upsert into the local lead store - will write even if email/phone/address are empty.
+    # Replication to Google Sheets happens in the background.
     try:
-        print(f"🔍 Starting search for: {query}")
-        results = search(query, limit=200)  # Get more results, filter by location in Python
-        print(f"📊 Overpass returned {len(results)} results")
-        
-        if not results:
-            print("⚠️ No results from Overpass")
-            AGENT_STATS["status"] = "done"
+        outcome = save_lead(row, enriched.get("lat"), enriched.get("lon"))
+    except Exception as write_err:
+        print(f"  ❌ Failed to store lead: {write_err}")
+        job.bump("errors")
+        _settle(job, "error", enriched.get("osm"), name=lead.name, error=str(write_err))
+        # Don't re-raise - continue with next lead
+        return None
+    _settle(job, outcome, enriched.get("osm"), name=lead.name, email=lead.email)
+    if outcome == UNCHANGED:
+        job.bump("leads_unchanged")
+        print(f"  ⏸️ Lead unchanged: {lead.name}")
+        return row
+    if outcome == INSERTED:
+        written = job.bump("leads_written")
+        print(f"  ✅ Lead stored (#{written})")
+    else:
+        job.bump("leads_updated")
+        print(f"  ♻️ Lead updated: {lead.name}")
+    print(f"     Name: {lead.name}, Address: {lead.address or 'N/A'}, Phone: {lead.phone or 'N/A'}, Email: {lead.email or 'N/A'}")
+    return row
+
+
+def _on_stage_error(job: Job, stage: str, idx: int, err: Exception, payload) -> None:
+    print(f"❌ Error processing lead {idx+1} in {stage} stage: {err}")
+    job.bump("errors")
+    # Enrich gets the raw element, later stages the enriched lead
+    osm = (payload.get("osm") or osm_key(payload)) if isinstance(payload, dict) else None
+    _settle(job, "error", osm, stage=stage, index=idx, error=str(err))
+
+
+def _instrumented(job: Job, stage: str, fn):
+    # Tools called inside the stage label their metrics with this job
+    def run(payload):
+        set_job(job.id)
+        with STAGE_SECONDS.time(job=job.id, stage=stage):
+            return fn(payload)
+    return run
+
+
+def build_pipeline(job: Job, location_filter=None, counters=None) -> Pipeline:
+    """
+    Wire the per-lead stages: enrich → scrape → dedup → persist.
+
+    Enrichment, scraping and persistence are I/O bound and run on their own
+    worker pools; enrichment takes ENRICH_BATCH_SIZE elements per LLM call,
+    scraping fetches SCRAPE_BATCH_SIZE websites at once on the async
+    scraper. Dedup is an ordered stage: it sees leads in Overpass result
+    order no matter which worker finished first, so the set of leads kept is
+    the same as with the old serial loop. It takes DEDUP_BATCH_SIZE leads
+    at a time so their embeddings are computed in one encode call.
+
+    Counters go to ``job``; once it is cancelled, enrichment and scraping
+    are skipped and only leads already enriched are still stored.
+    """
+    pipeline = Pipeline(
+        maxsize=QUEUE_SIZE,
+        on_error=lambda stage, idx, err, payload: _on_stage_error(job, stage, idx, err, payload),
+    )
+    if ENRICH_BATCH_SIZE > 1:
+        pipeline.add_stage(
+            "enrich",
+            _instrumented(job, "enrich", lambda raws: _enrich(raws, job, location_filter, counters)),
+            workers=ENRICH_WORKERS,
+            batch_size=ENRICH_BATCH_SIZE,
+        )
+    else:
+        pipeline.add_stage(
+            "enrich",
+            _instrumented(job, "enrich", lambda raw: _enrich([raw], job, location_filter, counters)[0]),
+            workers=ENRICH_WORKERS,
+        )
+    if SCRAPE_BATCH_SIZE > 1:
+        pipeline.add_stage("scrape", _instrumented(job, "scrape", lambda batch: _scrape(batch, job)),
+                           workers=SCRAPE_WORKERS, batch_size=SCRAPE_BATCH_SIZE)
+    else:
+        pipeline.add_stage("scrape", _instrumented(job, "scrape", lambda lead: _scrape([lead], job)[0]),
+                           workers=SCRAPE_WORKERS)
+    if DEDUP_BATCH_SIZE > 1:
+        pipeline.add_stage("dedup", _instrumented(job, "dedup", lambda batch: _dedup(batch, job)),
+                           ordered=True, batch_size=DEDUP_BATCH_SIZE)
+    else:
+        pipeline.add_stage("dedup", _instrumented(job, "dedup", lambda lead: _dedup([lead], job)[0]),
+                           ordered=True)
+    pipeline.add_stage("persist", _instrumented(job, "persist", lambda enriched: _persist(enriched, job)),
+                       workers=WRITE_WORKERS)
+    return pipeline
+
+
+def _source(job: Job):
+    """The job's OSM elements; stops early once the job is cancelled."""
+    if job.extract:
+        # Offline source: a local OSM extract, no Overpass calls at all
+        yield from _counted(job, iter_extract(resolve_extract(job.extract), job.query))
+        return
+    # Overpass slots are shared by all jobs; the tools take one per request
+    # (on the job set for this thread) and give it back once the body is read
+    if job.harvest:
+        # Tile-split harvest: every match in the area, not just the first 200;
+        # a cancel stops it sending further tiles
+        results = harvest_area(job.query, cancelled=lambda: job.cancelled)
+    else:
+        # Streamed: enrichment starts on the first element, not the last byte
+        results = iter_search(job.query, limit=200)  # Get more results, filter by location in Python
+    yield from _counted(job, results)
+
+
+def _counted(job: Job, results):
+    # Elements read so far; once the source is exhausted it is the job's total.
+    # Elements settled before (by an earlier run, or by this job before a
+    # restart) are counted but skip enrichment and scraping altogether.
+    checkpoint = job.checkpoint
+    for raw in results:
+        if job.cancelled:
             return
-        
+        job.bump("elements")
+        if checkpoint is not None and checkpoint.seen(osm_key(raw), raw):
+            job.bump("skipped_processed")
+            job.emit("lead", outcome="already_processed", osm=osm_key(raw))
+            continue
+        yield raw
+    job.update(source_done=True)
+
+
+def run_job(job: Job) -> None:
+    """Run one agent job to completion, recording its progress in ``job.stats``."""
+    job.update(**{**new_stats(RUNNING), "last_query": job.query, "started_at": time.time()})
+    query = job.query
+    # Overpass calls made while reading the source run on this thread
+    set_job(job.id)
+
+    replicator = get_replicator()
+    if replicator is not None:
+        # Rows may have been edited or removed in the sheet since the last run
+        replicator.reset_index()
+
+    try:
+        print(f"🔍 Starting search for: {query} (job {job.id})")
+
         # Note: Location filtering is now done in Overpass query via area search
         # We still do a light Python-side filter as backup
         location_filter = None
@@ -50,90 +287,50 @@ def run_agent(query: str):
             location_filter = location
             print(f"📍 Location filter: {location} (applied in Overpass query)")
         
-        filtered_count = 0
-        for idx, raw in enumerate(results):
-            try:
-                # Light location check (backup - most filtering done in Overpass)
-                if location_filter:
-                    tags = raw.get("tags", {})
-                    location_lower = location_filter.lower()
-                    
-                    # Check if location appears anywhere in tags (loose match)
-                    all_tags_text = " ".join(str(v).lower() for v in tags.values())
-                    if location_lower not in all_tags_text:
-                        filtered_count += 1
-                        # Don't skip - Overpass area search should have filtered already
-                        # This is just a safety check
-                
-                enriched = enrich_lead(raw)
-                if not enriched:
-                    print(f"⏭️ Skipped result {idx+1}: No name or invalid")
-                    continue
-                
-                # Only require name - email, phone, address are optional
-                if not enriched.get("name") or not enriched.get("name").strip():
-                    print(f"⏭️ Skipped result {idx+1}: Missing business name")
-                    continue
-                
-                print(f"📝 Processing: {enriched.get('name', 'Unknown')}")
-                
-                # Try to scrape email from website if missing (optional - won't skip if fails)
-                if (not enriched.get("email")) or enriched.get("email") in {"N/A", "na", "none", "null", ""}:
-                    website = enriched.get("website") or ""
-                    if website.startswith("http"):
-                        try:
-                            html_text = fetch_text(website)
-                            scraped_email = extract_email(html_text)
-                            if scraped_email and scraped_email != "N/A":
-                                enriched["email"] = scraped_email
-                                print(f"  ✉️ Scraped email: {scraped_email}")
-                        except Exception as scrape_err:
-                            # Email scraping failed - that's OK, we'll still write the lead
-                            pass
-                
-                # Check for duplicates
-                if is_duplicate(enriched):
-                    AGENT_STATS["skipped_duplicates"] += 1
-                    print(f"  🔄 Duplicate detected, skipping")
-                    continue
-                
-                # Prepare row for Google Sheets - empty strings are fine for optional fields
-                row = [
-                    str(uuid.uuid4()),
-                    enriched.get("name", "").strip(),
-                    enriched.get("address", "").strip() or "",  # Empty string if missing
-                    enriched.get("phone", "").strip() or "",    # Empty string if missing
-                    enriched.get("website", "").strip() or "",  # Empty string if missing
-                    enriched.get("email", "").strip() or "",    # Empty string if missing
-                ]
-                
-                # Write to Google Sheets - will write even if email/phone/address are empty
-                try:
-                    append_row(row)
-                    AGENT_STATS["leads_written"] += 1
-                    print(f"  ✅ Lead written to Sheets (#{AGENT_STATS['leads_written']})")
-                    print(f"     Name: {row[1]}, Address: {row[2] or 'N/A'}, Phone: {row[3] or 'N/A'}, Email: {row[5] or 'N/A'}")
-                except Exception as write_err:
-                    print(f"  ❌ Failed to write to Sheets: {write_err}")
-                    AGENT_STATS["errors"] += 1
-                    # Don't re-raise - continue with next lead
-                
-            except Exception as lead_err:
-                print(f"❌ Error processing lead {idx+1}: {lead_err}")
-                AGENT_STATS["errors"] += 1
-                continue
+        counters = {"filtered": 0}
+        checkpoints = get_checkpoints()
+        if checkpoints is not None:
+            job.checkpoint = JobCheckpoint(checkpoints, job.id, own_only=job.reprocess)
+        job.pipeline = build_pipeline(job, location_filter, counters)
+        total = job.pipeline.run(_source(job))
+        # Persist what dedup learned this run so a restart does not forget it
+        save_index()
+        dedup = index_stats()
+        if dedup and dedup["texts_encoded"]:
+            print(f"🧠 Dedup encoded {dedup['texts_encoded']} texts at {dedup['encode_texts_per_s']} texts/s")
+        if replicator is not None:
+            # Push the tail of this run to Sheets now rather than on the next tick
+            replicator.wake()
+        print(f"📊 Overpass returned {total} results")
+        
+        if not total:
+            print("⚠️ No results from Overpass")
         
-        AGENT_STATS["pages_processed"] = 1
-        AGENT_STATS["status"] = "done"
+        job.update(pages_processed=1, status=CANCELLED if job.cancelled else DONE)
         if location_filter:
-            print(f"📍 Filtered out {filtered_count} results not matching location")
-        print(f"✅ Agent finished: {AGENT_STATS['leads_written']} leads written, {AGENT_STATS['skipped_duplicates']} duplicates skipped")
+            print(f"📍 Filtered out {counters['filtered']} results not matching location")
+        stats = job.stats
+        print(f"⚡ Rule fast path avoided {stats['llm_calls_avoided']} LLM calls")
+        if stats["skipped_processed"]:
+            print(f"⏭️ Skipped {stats['skipped_processed']} elements processed before")
+        print(f"{'⏹️ Agent cancelled' if job.cancelled else '✅ Agent finished'}: "
+              f"{stats['leads_written']} leads written, {stats['leads_updated']} updated, "
+              f"{stats['leads_unchanged']} unchanged, {stats['skipped_duplicates']} duplicates skipped")
         
     except Exception as e:
         import traceback
         print(f"❌ AGENT ERROR: {e}")
         print(traceback.format_exc())
-        AGENT_STATS["errors"] += 1
-        AGENT_STATS["status"] = "error"
+        job.bump("errors")
+        job.update(status=ERROR)
     finally:
-        AGENT_STATS["finished_at"] = time.time()
+        set_job(None)
+        job.update(finished_at=time.time())
+
+
+def run_agent(query: str, harvest: bool = False, extract: Optional[str] = None,
+              reprocess: bool = False) -> Job:
+    """Run the agent synchronously outside the job manager (scripts, tests)."""
+    job = Job(query, harvest, extract, reprocess=reprocess)
+    run_job(job)
+    return job
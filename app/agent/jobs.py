@@ -0,0 +1,437 @@
+# Job manager - queued, prioritized agent runs with their own stats
+
+import heapq
+import itertools
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+from app.services.checkpoints import CheckpointStore, get_checkpoints
+from app.services.metrics import forget_job
+
+# Agent runs executing at once; further jobs wait in the priority queue
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# Finished jobs kept for GET /jobs
+JOB_HISTORY = int(os.getenv("JOB_HISTORY", "100"))
+# Concurrent uses of each shared service across all running jobs
+JOB_LLM_SLOTS = int(os.getenv("JOB_LLM_SLOTS", "4"))
+JOB_OVERPASS_SLOTS = int(os.getenv("JOB_OVERPASS_SLOTS", "2"))
+# Per-lead events kept per job for /jobs/{id}/events (late or reconnecting clients)
+JOB_EVENT_BACKLOG = int(os.getenv("JOB_EVENT_BACKLOG", "1000"))
+# Seconds between progress snapshots on the event stream
+JOB_PROGRESS_INTERVAL = float(os.getenv("JOB_PROGRESS_INTERVAL", "1"))
+# Re-queue jobs a restart interrupted, giving up after this many attempts
+JOB_RESUME = os.getenv("JOB_RESUME", "true").lower() in ("1", "true", "yes")
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+ERROR = "error"
+CANCELLED = "cancelled"
+FINISHED = (DONE, ERROR, CANCELLED)
+
+
+def new_stats(status: str = "idle") -> Dict:
+    """Counters of one agent run (the shape /stats has always returned)."""
+    return {
+        "status": status,
+        "last_query": None,
+        "started_at": None,
+        "finished_at": None,
+        "pages_processed": 0,
+        "elements": 0,
+        "source_done": False,
+        "leads_written": 0,
+        "leads_updated": 0,
+        "leads_unchanged": 0,
+        "skipped_duplicates": 0,
+        "skipped_processed": 0,
+        "llm_calls_avoided": 0,
+        "errors": 0,
+    }
+
+
+class Job:
+    """
+    One agent run: its parameters, its own counters, a cancel flag and a
+    bounded log of per-lead events that progress streams read from.
+    """
+
+    def __init__(self, query: str, harvest: bool = False, extract: Optional[str] = None,
+                 priority: int = 0, job_id: Optional[str] = None, reprocess: bool = False):
+        self.id = job_id or uuid.uuid4().hex[:12]
+        self.query = query
+        self.harvest = harvest
+        self.extract = extract
+        self.priority = priority
+        # Redo elements earlier runs settled (its own settled ones are still skipped)
+        self.reprocess = reprocess
+        # Re-queued after a restart interrupted it
+        self.resumed = False
+        self.created_at = time.time()
+        self.stats = new_stats(QUEUED)
+        self.stats["last_query"] = query
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+        self._events_changed = threading.Condition(self._lock)
+        self._events: deque = deque(maxlen=max(1, JOB_EVENT_BACKLOG))
+        self._event_seq = 0
+        # Set by the runner so progress can report per-stage counters
+        self.pipeline = None
+        # Set by the runner: skips settled elements and records outcomes
+        self.checkpoint = None
+
+    @property
+    def status(self) -> str:
+        return self.stats["status"]
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def cancel(self) -> None:
+        self._cancel.set()
+
+    def bump(self, key: str, n: int = 1) -> int:
+        """Increment a counter from any pipeline worker."""
+        with self._lock:
+            self.stats[key] += n
+            return self.stats[key]
+
+    def update(self, **values) -> None:
+        with self._lock:
+            status = values.get("status")
+            changed = status is not None and status != self.stats["status"]
+            self.stats.update(values)
+            if changed:
+                self._append("status", {"status": status})
+
+    def emit(self, kind: str, **data) -> None:
+        """Record an event (e.g. one lead's outcome) for progress streams."""
+        with self._lock:
+            self._append(kind, data)
+
+    def _append(self, kind: str, data: Dict) -> None:
+        self._event_seq += 1
+        self._events.append((self._event_seq, kind, {**data, "ts": time.time()}))
+        self._events_changed.notify_all()
+
+    def events_since(self, seq: int, timeout: float = 0.0) -> List[tuple]:
+        """Events after ``seq``, waiting up to ``timeout`` for one to arrive."""
+        with self._lock:
+            if self._event_seq <= seq and timeout > 0:
+                self._events_changed.wait(timeout)
+            return [e for e in self._events if e[0] > seq]
+
+    def progress(self) -> Dict:
+        """Counters plus completion percentage and per-stage counters."""
+        with self._lock:
+            stats = dict(self.stats)
+        pipeline = self.pipeline
+        # Elements skipped as already processed never enter the pipeline
+        stats["processed"] = (pipeline.completed if pipeline else 0) + stats["skipped_processed"]
+        stats["stages"] = pipeline.stats() if pipeline else []
+        # The total is only known once the source is exhausted (results stream in)
+        stats["percent"] = (
+            round(100.0 * stats["processed"] / stats["elements"], 1)
+            if stats["source_done"] and stats["elements"] else None
+        )
+        return stats
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                "id": self.id,
+                "query": self.query,
+                "harvest": self.harvest,
+                "extract": self.extract,
+                "priority": self.priority,
+                "reprocess": self.reprocess,
+                "resumed": self.resumed,
+                "created_at": self.created_at,
+                **self.stats,
+            }
+
+
+class FairLimiter:
+    """
+    Counting semaphore shared by all jobs that hands free slots to waiting
+    jobs in turn, so a job with many workers cannot starve the others: with
+    two busy jobs each gets about half of the slots.
+    """
+
+    def __init__(self, name: str, slots: int):
+        self.name = name
+        self.slots = max(1, slots)
+        self.in_use = 0
+        self.grants = 0
+        self.wait_seconds = 0.0
+        self._cond = threading.Condition()
+        # Waiting owners in turn order, and each owner's waiting tickets
+        self._turns: deque = deque()
+        self._waiting: Dict[str, deque] = {}
+        self._granted = set()
+        self._tickets = itertools.count()
+
+    def acquire(self, owner: str) -> None:
+        started = time.perf_counter()
+        with self._cond:
+            ticket = next(self._tickets)
+            if owner not in self._waiting:
+                self._waiting[owner] = deque()
+                self._turns.append(owner)
+            self._waiting[owner].append(ticket)
+            self._grant()
+            while ticket not in self._granted:
+                self._cond.wait()
+            self._granted.discard(ticket)
+            self.wait_seconds += time.perf_counter() - started
+
+    def release(self) -> None:
+        with self._cond:
+            self.in_use -= 1
+            self._grant()
+
+    def _grant(self) -> None:
+        # Round robin over owners: the next owner in turn gets its oldest ticket
+        granted = False
+        while self.in_use < self.slots and self._turns:
+            owner = self._turns.popleft()
+            tickets = self._waiting[owner]
+            self._granted.add(tickets.popleft())
+            if tickets:
+                self._turns.append(owner)
+            else:
+                del self._waiting[owner]
+            self.in_use += 1
+            self.grants += 1
+            granted = True
+        if granted:
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, owner: str):
+        self.acquire(owner)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                "slots": self.slots,
+                "in_use": self.in_use,
+                "waiting": sum(len(t) for t in self._waiting.values()),
+                "grants": self.grants,
+                "wait_seconds": round(self.wait_seconds, 3),
+            }
+
+
+# Sheets needs no limiter: every job's leads reach it through the one
+# background replicator, which already serializes and batches the writes
+RESOURCES = {
+    "llm": FairLimiter("llm", JOB_LLM_SLOTS),
+    "overpass": FairLimiter("overpass", JOB_OVERPASS_SLOTS),
+}
+
+
+def resource(name: str) -> FairLimiter:
+    return RESOURCES[name]
+
+
+class JobManager:
+    """
+    Runs submitted jobs on a bounded pool of worker threads, highest
+    ``priority`` first (FIFO within a priority). Queued jobs can be
+    cancelled outright; running ones are asked to stop and finish as
+    ``cancelled`` once the leads already in flight are stored.
+    """
+
+    def __init__(self, runner: Callable[[Job], None], workers: int = JOB_WORKERS,
+                 history: int = JOB_HISTORY, checkpoints: Optional[CheckpointStore] = None):
+        self.runner = runner
+        self.workers = max(1, workers)
+        self.history = max(1, history)
+        # Jobs are recorded here so a restart can resume the unfinished ones
+        self.checkpoints = checkpoints
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._queue: list = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._latest: Optional[Job] = None
+
+    def submit(self, query: str, harvest: bool = False, extract: Optional[str] = None,
+               priority: int = 0, reprocess: bool = False, job_id: Optional[str] = None) -> Job:
+        job = Job(query, harvest, extract, priority, job_id=job_id, reprocess=reprocess)
+        self._save(job)
+        with self._cond:
+            self._jobs[job.id] = job
+            heapq.heappush(self._queue, (-priority, next(self._seq), job))
+            self._start_workers()
+            self._prune()
+            self._cond.notify()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def list(self) -> List[Job]:
+        """Known jobs, newest first."""
+        with self._cond:
+            return list(reversed(self._jobs.values()))
+
+    def latest(self) -> Optional[Job]:
+        """The job that started most recently."""
+        return self._latest
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job.status in FINISHED:
+                return job
+            job.cancel()
+            if job.status == QUEUED:
+                # Left in the heap; the worker that pops it skips it
+                job.update(status=CANCELLED, finished_at=time.time())
+                self._save(job)
+        return job
+
+    def resume(self, saved: List[Dict]) -> List[Job]:
+        """
+        Re-queue jobs a previous process left unfinished (rows from
+        ``CheckpointStore.interrupted``) under their original ids. Their
+        settled elements are skipped, so work picks up where it stopped; a
+        job that already failed to finish JOB_MAX_ATTEMPTS times is marked
+        as an error instead.
+        """
+        resumed = []
+        for row in saved:
+            if row["attempts"] >= JOB_MAX_ATTEMPTS:
+                print(f"❌ Not resuming job {row['id']}: interrupted {row['attempts']} times")
+                if self.checkpoints is not None:
+                    self.checkpoints.set_status(row["id"], ERROR)
+                continue
+            job = self.submit(row["query"], bool(row["harvest"]), row["extract"], row["priority"],
+                              reprocess=bool(row["reprocess"]), job_id=row["id"])
+            job.resumed = True
+            resumed.append(job)
+            print(f"♻️ Resuming job {job.id}: {job.query}")
+        return resumed
+
+    def _save(self, job: Job) -> None:
+        if self.checkpoints is not None:
+            self.checkpoints.save_job(job)
+
+    def queue_position(self, job: Job) -> Optional[int]:
+        with self._cond:
+            if job.status != QUEUED:
+                return None
+            ahead = [j for _, _, j in sorted(self._queue) if j.status == QUEUED]
+            return ahead.index(job) + 1 if job in ahead else None
+
+    def _start_workers(self) -> None:
+        while len(self._threads) < self.workers:
+            t = threading.Thread(target=self._work, name=f"job-{len(self._threads)}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def _prune(self) -> None:
+        finished = [j for j in self._jobs.values() if j.status in FINISHED]
+        for job in finished[:max(0, len(finished) - self.history)]:
+            del self._jobs[job.id]
+            forget_job(job.id)
+
+    def _work(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                _, _, job = heapq.heappop(self._queue)
+                if job.cancelled:
+                    continue
+                job.update(status=RUNNING)
+                self._latest = job
+            if self.checkpoints is not None:
+                self.checkpoints.started(job.id)
+            try:
+                self.runner(job)
+            except Exception as e:
+                # run_agent reports its own errors; this only guards the worker
+                print(f"❌ Job {job.id} crashed: {e}")
+                job.update(status=ERROR, finished_at=time.time())
+            self._save(job)
+
+    def stats(self) -> Dict:
+        with self._cond:
+            counts: Dict[str, int] = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return {
+                "workers": self.workers,
+                "queued": counts.get(QUEUED, 0),
+                "running": counts.get(RUNNING, 0),
+                "by_status": counts,
+                "resources": {name: r.stats() for name, r in RESOURCES.items()},
+            }
+
+
+def event_stream(job: Job, after: int = 0, interval: float = JOB_PROGRESS_INTERVAL):
+    """
+    Yield ``(id, kind, data)`` for a job: its recorded events after ``after``
+    as they happen, a ``progress`` snapshot every ``interval`` seconds (with
+    the recent throughput of each stage), and a final ``end`` once the job
+    has finished.
+    """
+    last = after
+    prev_time, prev_counts = time.time(), {}
+    next_progress = 0.0
+    while True:
+        finished = job.status in FINISHED
+        for seq, kind, data in job.events_since(last, timeout=0 if finished else interval):
+            last = seq
+            yield seq, kind, data
+        now = time.time()
+        if now >= next_progress or finished:
+            snapshot = job.progress()
+            elapsed = max(now - prev_time, 1e-6)
+            for stage in snapshot["stages"]:
+                done = stage["processed"] + stage["errors"]
+                stage["per_s"] = round((done - prev_counts.get(stage["name"], 0)) / elapsed, 2)
+                prev_counts[stage["name"]] = done
+            prev_time, next_progress = now, now + interval
+            yield last, "progress", snapshot
+        if finished:
+            yield last, "end", {"id": job.id, **job.progress()}
+            return
+
+
+_manager: Optional[JobManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_jobs() -> JobManager:
+    """The process-wide job manager, running agent jobs."""
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                from app.agent.agent import run_job
+
+                _manager = JobManager(run_job, checkpoints=get_checkpoints())
+    return _manager
+
+
+def resume_interrupted() -> List[Job]:
+    """Re-queue the jobs a restart interrupted (see ``JobManager.resume``)."""
+    store = get_checkpoints()
+    saved = store.interrupted() if store is not None else []
+    # The agent (and its imports) only load when there is something to resume
+    return get_jobs().resume(saved) if saved else []
@@ -0,0 +1,155 @@
+# Rule-based normalization of OSM tags - the fast path before the LLM
+
+import re
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit
+
+# Tag values that mark an element as clearly not a business lead
+NON_BUSINESS = {
+    "amenity": {
+        "bench", "bicycle_parking", "bus_station", "clock", "drinking_water",
+        "fountain", "grave_yard", "hunting_stand", "motorcycle_parking",
+        "parking", "parking_entrance", "parking_space", "post_box",
+        "recycling", "shelter", "telephone", "toilets", "waste_basket",
+        "waste_disposal", "water_point",
+    },
+    "leisure": {"park", "playground", "garden", "nature_reserve", "pitch", "dog_park"},
+    "highway": {"bus_stop", "street_lamp", "crossing", "traffic_signals"},
+    "public_transport": {"platform", "stop_position", "station"},
+    "natural": None,
+    "landuse": None,
+    "place": None,
+    "boundary": None,
+}
+
+# Tags whose presence marks an element as a business (any value but "no")
+BUSINESS_KEYS = ("shop", "office", "craft", "healthcare", "amenity", "tourism")
+
+# Calling codes for turning national numbers into E.164, by addr:country
+CALLING_CODES = {
+    "AT": "43", "AU": "61", "BE": "32", "CA": "1", "CH": "41", "DE": "49",
+    "DK": "45", "ES": "34", "FI": "358", "FR": "33", "GB": "44", "IE": "353",
+    "IN": "91", "IT": "39", "NL": "31", "NO": "47", "NZ": "64", "PL": "48",
+    "PT": "351", "SE": "46", "US": "1",
+}
+
+EMAIL_RE = re.compile(r"^[A-Za-z0-9._%+-]+@[A-Za-z0-9-]+(\.[A-Za-z0-9-]+)*\.[A-Za-z]{2,}$")
+HOST_RE = re.compile(r"^[a-z0-9-]+(\.[a-z0-9-]+)*\.[a-z]{2,}$")
+
+
+def _first(value: str) -> str:
+    # OSM allows several values separated by ";" - keep the first
+    return str(value or "").split(";")[0].strip()
+
+
+def classify(tags: Dict) -> Optional[bool]:
+    """True for a business, False for clearly not one, None when unsure."""
+    for key, values in NON_BUSINESS.items():
+        value = tags.get(key)
+        if value and (values is None or value in values):
+            # A shop inside a park polygon is still a shop
+            if not any(tags.get(k) for k in ("shop", "office", "craft")):
+                return False
+    for key in BUSINESS_KEYS:
+        value = tags.get(key)
+        if value and value != "no":
+            return True
+    return None
+
+
+def format_address(tags: Dict) -> str:
+    # Same "housenumber street city postcode" line leads have always been
+    # stored with, so re-harvested leads still compare as unchanged
+    address = " ".join(filter(None, [
+        str(tags.get(key, "")).strip()
+        for key in ("addr:housenumber", "addr:street", "addr:city", "addr:postcode")
+    ]))
+    return address or str(tags.get("addr:full", "")).strip()
+
+
+def normalize_phone(value: str, country: str = "") -> Tuple[str, bool]:
+    """Best-effort E.164; the flag says whether the result is trustworthy."""
+    raw = _first(value)
+    if not raw:
+        return "", True
+    digits = re.sub(r"[^\d+]", "", raw)
+    if digits.startswith("00"):
+        digits = "+" + digits[2:]
+    if not digits.startswith("+"):
+        code = CALLING_CODES.get(str(country).strip().upper())
+        if not code:
+            return raw, False
+        digits = "+" + code + digits.lstrip("0")
+    number = digits[1:]
+    if "+" in number or not 8 <= len(number) <= 15:
+        return raw, False
+    return "+" + number, True
+
+
+def canonicalize_url(value: str) -> Tuple[str, bool]:
+    raw = _first(value)
+    if not raw:
+        return "", True
+    if "://" not in raw:
+        raw = "https://" + raw.lstrip("/")
+    try:
+        parts = urlsplit(raw)
+    except ValueError:
+        return raw, False
+    host = (parts.hostname or "").lower()
+    if parts.scheme not in ("http", "https") or not HOST_RE.match(host):
+        return raw, False
+    netloc = host if not parts.port else f"{host}:{parts.port}"
+    path = "" if parts.path == "/" else parts.path
+    return urlunsplit((parts.scheme, netloc, path, parts.query, "")), True
+
+
+def validate_email(value: str) -> Tuple[str, bool]:
+    raw = _first(value)
+    if raw.lower().startswith("mailto:"):
+        raw = raw[7:]
+    if not raw:
+        return "", True
+    if not EMAIL_RE.match(raw):
+        return raw, False
+    local, domain = raw.rsplit("@", 1)
+    return f"{local}@{domain.lower()}", True
+
+
+def normalize_element(raw: Dict) -> Tuple[Optional[Dict], bool]:
+    """
+    Build a lead from tags alone.
+
+    Returns ``(lead, confident)``. ``lead`` is None when the element has no
+    name or is clearly not a business. When ``confident`` is False the lead
+    is a best-effort draft and the LLM should still look at the element.
+    """
+    tags = raw.get("tags", {})
+    name = str(tags.get("name", "")).strip()
+    if not name:
+        return None, True
+
+    kind = classify(tags)
+    if kind is False:
+        return None, True
+
+    phone, phone_ok = normalize_phone(
+        tags.get("phone", "") or tags.get("contact:phone", ""),
+        tags.get("addr:country", ""),
+    )
+    website, website_ok = canonicalize_url(
+        tags.get("website", "") or tags.get("contact:website", "") or tags.get("url", "")
+    )
+    email, email_ok = validate_email(tags.get("email", "") or tags.get("contact:email", ""))
+    address = format_address(tags)
+
+    lead = {
+        "name": name,
+        "address": address,
+        "phone": phone,
+        "website": website,
+        "email": email,
+    }
+    has_street = bool(tags.get("addr:full") or tags.get("addr:street"))
+    confident = kind is True and has_street and phone_ok and website_ok and email_ok
+    return lead, confident
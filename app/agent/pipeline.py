@@ -0,0 +1,247 @@
+# Staged pipeline - worker pools connected by bounded queues
+
+import heapq
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+_DONE = object()
+
+# How long a batching worker waits for more items before running a short batch
+BATCH_WAIT = 0.05
+
+
+class Stage:
+    """
+    One pipeline stage: a pool of worker threads draining a bounded inbox.
+
+    Items travel as ``(idx, payload)`` pairs. A stage function receives the
+    payload and returns the payload for the next stage, or ``None`` to drop
+    it. Dropped items still travel downstream as ``(idx, None)`` so that an
+    ordered stage never waits on an index that will not arrive.
+
+    With ``batch_size > 1`` a worker collects up to that many payloads and the
+    stage function receives a list, returning a list of the same length. An
+    ordered stage batches consecutive indices only, so it still sees the
+    serial sequence, just in chunks.
+    """
+
+    def __init__(self, name: str, fn: Callable[[Any], Any], workers: int,
+                 maxsize: int, ordered: bool = False, batch_size: int = 1):
+        self.name = name
+        self.fn = fn
+        # An ordered stage releases items strictly by index, so one worker
+        self.workers = 1 if ordered else max(1, int(workers))
+        self.ordered = ordered
+        self.batch_size = max(1, int(batch_size))
+        self.inbox: "queue.Queue" = queue.Queue(maxsize=max(1, int(maxsize)))
+        self.processed = 0
+        self.errors = 0
+        self._alive = self.workers
+        self._lock = threading.Lock()
+
+    def _finish_worker(self) -> bool:
+        with self._lock:
+            self._alive -= 1
+            return self._alive == 0
+
+
+class Pipeline:
+    """
+    Run items through a chain of stages, each with its own worker count.
+
+    ``on_error(stage_name, idx, exc, payload)`` is called when a stage
+    function raises, with the payload that stage was given; the failing item
+    is dropped and the other items keep flowing.
+    """
+
+    def __init__(self, maxsize: int = 50,
+                 on_error: Optional[Callable[[str, int, Exception, Any], None]] = None):
+        self.maxsize = maxsize
+        self.on_error = on_error
+        self.stages: List[Stage] = []
+        # Items that left the last stage, stored or dropped
+        self.completed = 0
+        self.started_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def add_stage(self, name: str, fn: Callable[[Any], Any], workers: int = 1,
+                  ordered: bool = False, batch_size: int = 1) -> "Pipeline":
+        self.stages.append(
+            Stage(name, fn, workers, self.maxsize, ordered=ordered, batch_size=batch_size)
+        )
+        return self
+
+    def run(self, items: Iterable[Any]) -> int:
+        """Feed ``items`` through every stage and block until all are done."""
+        if not self.stages:
+            return 0
+
+        self.started_at = time.time()
+        threads = []
+        for pos, stage in enumerate(self.stages):
+            downstream = self.stages[pos + 1] if pos + 1 < len(self.stages) else None
+            if stage.ordered:
+                target = self._ordered_worker
+            elif stage.batch_size > 1:
+                target = self._batch_worker
+            else:
+                target = self._worker
+            for n in range(stage.workers):
+                t = threading.Thread(
+                    target=target,
+                    args=(stage, downstream),
+                    name=f"{stage.name}-{n}",
+                    daemon=True,
+                )
+                t.start()
+                threads.append(t)
+
+        head = self.stages[0]
+        count = 0
+        try:
+            for idx, item in enumerate(items):
+                head.inbox.put((idx, item))
+                count += 1
+        finally:
+            for _ in range(head.workers):
+                head.inbox.put(_DONE)
+            for t in threads:
+                t.join()
+        return count
+
+    def _process(self, stage: Stage, idx: int, payload: Any) -> Any:
+        if payload is None:
+            return None
+        try:
+            result = stage.fn(payload)
+        except Exception as e:
+            with stage._lock:
+                stage.errors += 1
+            if self.on_error:
+                self.on_error(stage.name, idx, e, payload)
+            return None
+        with stage._lock:
+            stage.processed += 1
+        return result
+
+    def _process_batch(self, stage: Stage, batch: list) -> list:
+        live = [(idx, payload) for idx, payload in batch if payload is not None]
+        results = {}
+        if live:
+            try:
+                out = stage.fn([payload for _, payload in live])
+                results = {idx: result for (idx, _), result in zip(live, out)}
+            except Exception as e:
+                with stage._lock:
+                    stage.errors += len(live)
+                if self.on_error:
+                    for idx, payload in live:
+                        self.on_error(stage.name, idx, e, payload)
+            else:
+                with stage._lock:
+                    stage.processed += len(live)
+        return [(idx, results.get(idx)) for idx, _ in batch]
+
+    def _forward(self, downstream: Optional[Stage], item) -> None:
+        if downstream is not None:
+            downstream.inbox.put(item)
+        else:
+            with self._lock:
+                self.completed += 1
+
+    def stats(self) -> List[Dict]:
+        """Per-stage counters and queue depth."""
+        return [
+            {
+                "name": stage.name,
+                "workers": stage.workers,
+                "processed": stage.processed,
+                "errors": stage.errors,
+                "queued": stage.inbox.qsize(),
+            }
+            for stage in self.stages
+        ]
+
+    @staticmethod
+    def _close(stage: Stage, downstream: Optional[Stage]) -> None:
+        if stage._finish_worker() and downstream is not None:
+            for _ in range(downstream.workers):
+                downstream.inbox.put(_DONE)
+
+    def _worker(self, stage: Stage, downstream: Optional[Stage]) -> None:
+        # Always release downstream, even if a worker dies unexpectedly
+        try:
+            while True:
+                item = stage.inbox.get()
+                if item is _DONE:
+                    return
+                idx, payload = item
+                result = self._process(stage, idx, payload)
+                self._forward(downstream, (idx, result))
+        finally:
+            self._close(stage, downstream)
+
+    def _batch_worker(self, stage: Stage, downstream: Optional[Stage]) -> None:
+        done = False
+        try:
+            while not done:
+                item = stage.inbox.get()
+                if item is _DONE:
+                    return
+                batch = [item]
+                # Take whatever else is already queued, up to the batch size
+                while len(batch) < stage.batch_size:
+                    try:
+                        item = stage.inbox.get(timeout=BATCH_WAIT)
+                    except queue.Empty:
+                        break
+                    if item is _DONE:
+                        done = True
+                        break
+                    batch.append(item)
+                for result in self._process_batch(stage, batch):
+                    self._forward(downstream, result)
+        finally:
+            self._close(stage, downstream)
+
+    def _release(self, stage: Stage, downstream: Optional[Stage], ready: list) -> None:
+        if stage.batch_size > 1:
+            results = self._process_batch(stage, ready)
+        else:
+            results = [(idx, self._process(stage, idx, payload)) for idx, payload in ready]
+        for result in results:
+            self._forward(downstream, result)
+
+    def _ordered_worker(self, stage: Stage, downstream: Optional[Stage]) -> None:
+        # Reorder buffer: hold items until every lower index has been handled,
+        # so the stage sees exactly the sequence a serial loop would. Released
+        # items are run in batches; a short batch goes once the inbox idles.
+        pending: list = []
+        ready: list = []
+        next_idx = 0
+        try:
+            while True:
+                try:
+                    item = stage.inbox.get(timeout=BATCH_WAIT) if ready else stage.inbox.get()
+                except queue.Empty:
+                    self._release(stage, downstream, ready)
+                    ready = []
+                    continue
+                if item is _DONE:
+                    # Upstream is drained; flush whatever is left in index order
+                    while pending:
+                        ready.append(heapq.heappop(pending))
+                    for start in range(0, len(ready), stage.batch_size):
+                        self._release(stage, downstream, ready[start:start + stage.batch_size])
+                    return
+                heapq.heappush(pending, item)
+                while pending and pending[0][0] == next_idx:
+                    ready.append(heapq.heappop(pending))
+                    next_idx += 1
+                    if len(ready) >= stage.batch_size:
+                        self._release(stage, downstream, ready)
+                        ready = []
+        finally:
+            self._close(stage, downstream)
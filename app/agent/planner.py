@@ -2,15 +2,31 @@
 
 
 import json
-from typing import Dict, Optional
+import os
+from typing import Callable, Dict, List, Optional, Tuple
 
-from app.llm.ollama_client import call_llm
-from app.agent.prompt import SYSTEM_PROMPT
+from app.agent.normalizer import normalize_element
+from app.llm.cache import cache_key, get_cache
+from app.llm.ollama_client import OLLAMA_MODEL, OLLAMA_NUM_PREDICT, call_llm
+from app.agent.prompt import PROMPT_STYLE, PROMPT_VERSION, build_batch_prompt, build_prompt
 
-def enrich_lead(raw: Dict) -> Optional[Dict]:
+# How many raw elements are packed into one batch enrichment prompt
+ENRICH_BATCH_SIZE = int(os.getenv("ENRICH_BATCH_SIZE", "8"))
+
+LEAD_FIELDS = ("name", "address", "phone", "website", "email")
+
+# Cached enrichments are only reused for the same prompt text and style
+_PROMPT_ID = f"{PROMPT_VERSION}-{PROMPT_STYLE}"
+
+
+def osm_key(raw: Dict) -> str:
+    """Stable "type/id" key for an Overpass element (ids are unique per type)."""
+    return f"{raw.get('type', 'node')}/{raw.get('id', '')}"
+
+
+def _base_lead(raw: Dict) -> Dict:
     tags = raw.get("tags", {})
-    
-    base_lead = {
+    return {
         "name": str(tags.get("name", "")).strip(),
         "address": " ".join(filter(None, [
             tags.get("addr:housenumber", ""),
@@ -22,21 +38,146 @@ def enrich_lead(raw: Dict) -> Optional[Dict]:
         "website": str(tags.get("website", "") or tags.get("contact:website", "")).strip(),
         "email": str(tags.get("email", "") or tags.get("contact:email", "")).strip(),
     }
-    
-    if not base_lead["name"]:
+
+
+def _merge(base_lead: Dict, parsed: Dict) -> Dict:
+    for key in base_lead:
+        value = parsed.get(key)
+        if isinstance(value, str) and value.strip():
+            base_lead[key] = value.strip()
+    return base_lead
+
+
+def _cached(raw: Dict) -> Optional[Dict]:
+    cache = get_cache()
+    if cache is None:
         return None
-    
+    return cache.get(cache_key(raw.get("tags", {}), OLLAMA_MODEL, _PROMPT_ID))
+
+
+def _remember(raw: Dict, lead: Dict) -> Dict:
+    cache = get_cache()
+    if cache is not None:
+        cache.put(cache_key(raw.get("tags", {}), OLLAMA_MODEL, _PROMPT_ID), lead)
+    return lead
+
+
+def _fast_path(raw: Dict, count_avoided: Optional[Callable[[int], None]] = None
+               ) -> Tuple[Optional[Dict], bool]:
+    """Try the rule-based normalizer; count the LLM calls it makes unnecessary."""
+    lead, confident = normalize_element(raw)
+    # Nameless elements never reached the LLM, so they are not an avoided call
+    if confident and count_avoided and str(raw.get("tags", {}).get("name", "")).strip():
+        count_avoided(1)
+    return lead, confident
+
+
+def enrich_lead(raw: Dict, count_avoided: Optional[Callable[[int], None]] = None) -> Optional[Dict]:
+    lead, confident = _fast_path(raw, count_avoided)
+    if confident:
+        return lead
+
+    # Rules were unsure: start from their draft and let the LLM fill the gaps
+    base_lead = lead or _base_lead(raw)
+
+    cached = _cached(raw)
+    if cached is not None:
+        return cached
+
     # LLM enrichment (optional)
-    prompt = SYSTEM_PROMPT + "\nRAW DATA:\n" + json.dumps(raw, indent=2)
+    prompt = build_prompt(raw)
     try:
         llm_response = call_llm(prompt)
         if llm_response:
             parsed = json.loads(llm_response)
-            for key in base_lead:
-                value = parsed.get(key)
-                if isinstance(value, str) and value.strip():
-                    base_lead[key] = value.strip()
+            _remember(raw, _merge(base_lead, parsed))
     except Exception as e:
         print("⚠️ LLM enrichment failed:", e)
-    
+
     return base_lead
+
+
+def _parse_batch_response(text: str) -> Dict:
+    """
+    Pull the JSON object out of a batch response, tolerating stray prose.
+
+    The prompt asks for entries keyed by OSM id. Ollama's JSON mode only
+    produces an object at the root, so a root array is never asked for.
+    """
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end <= start:
+        raise ValueError("no JSON object in batch response")
+    items = json.loads(text[start:end + 1])
+    if not isinstance(items, dict):
+        raise ValueError("batch response is not a JSON object")
+    return items
+
+
+def _valid_item(item) -> bool:
+    if not isinstance(item, dict):
+        return False
+    return all(isinstance(item.get(key, ""), str) for key in LEAD_FIELDS)
+
+
+def _enrich_batch(raws: List[Dict], count_avoided: Optional[Callable[[int], None]] = None
+                  ) -> List[Optional[Dict]]:
+    bases: List[Optional[Dict]] = [None] * len(raws)
+    results: List[Optional[Dict]] = [None] * len(raws)
+
+    # Rule-resolved elements (including nameless ones) never reach the LLM
+    pending: Dict[str, int] = {}
+    repeats: List[int] = []
+    for i, raw in enumerate(raws):
+        lead, confident = _fast_path(raw, count_avoided)
+        if confident:
+            results[i] = lead
+            continue
+        bases[i] = lead or _base_lead(raw)
+        cached = _cached(raw)
+        if cached is not None:
+            results[i] = cached
+        elif osm_key(raw) in pending:
+            repeats.append(i)
+        else:
+            pending[osm_key(raw)] = i
+    if not pending:
+        return results
+
+    prompt = build_batch_prompt([(key, raws[i]) for key, i in pending.items()])
+    try:
+        # The generation cap scales with the number of leads in the batch
+        llm_response = call_llm(prompt, num_predict=OLLAMA_NUM_PREDICT * len(pending))
+        for key, item in _parse_batch_response(llm_response or "").items():
+            if key not in pending or not _valid_item(item):
+                continue
+            i = pending.pop(key)
+            results[i] = _remember(raws[i], _merge(bases[i], item))
+    except Exception as e:
+        print(f"⚠️ Batch LLM enrichment failed for {len(pending)} leads:", e)
+
+    # Fall back to one call per lead only for items the batch did not cover
+    fallback = list(pending.values()) + repeats
+    if fallback:
+        print(f"↩️ Falling back to per-lead enrichment for {len(fallback)} leads")
+    for i in fallback:
+        results[i] = enrich_lead(raws[i])
+    return results
+
+
+def enrich_leads(raws: List[Dict], batch_size: Optional[int] = None,
+                 count_avoided: Optional[Callable[[int], None]] = None) -> List[Optional[Dict]]:
+    """
+    Enrich many raw Overpass elements with one LLM prompt per batch.
+
+    Returns one entry per input, in input order; ``None`` marks elements that
+    are not usable leads (same contract as ``enrich_lead``).
+    ``count_avoided(n)`` is called for LLM calls skipped by the rule fast path.
+    """
+    size = max(1, batch_size or ENRICH_BATCH_SIZE)
+    if size == 1:
+        return [enrich_lead(raw, count_avoided) for raw in raws]
+
+    results: List[Optional[Dict]] = []
+    for start in range(0, len(raws), size):
+        results.extend(_enrich_batch(raws[start:start + size], count_avoided))
+    return results
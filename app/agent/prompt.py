@@ -1,5 +1,17 @@
 # Prompt templates and utilities
 
+import json
+import os
+import threading
+from typing import Dict, List, Tuple
+
+# Bump whenever a prompt below changes so cached enrichments are not reused
+PROMPT_VERSION = "3"
+
+# "compact" sends only relevant tags as key=value lines; "full" is the
+# original prompt with the whole element as indented JSON
+PROMPT_STYLE = os.getenv("PROMPT_STYLE", "compact")
+
 SYSTEM_PROMPT = """
 You are an AI agent that cleans and normalizes OPENSTREETMAP business data
 coming from the Overpass API. The raw object may include tags such as:
@@ -29,3 +41,130 @@ Return ONLY valid JSON (no prose, no comments):
 }
 """
 
+
+BATCH_SYSTEM_PROMPT = """
+You are an AI agent that cleans and normalizes OPENSTREETMAP business data
+coming from the Overpass API. You will receive a JSON array of raw objects.
+Each object has an "id" (e.g. "node/123") and may include tags such as:
+- name, brand
+- addr:full, addr:street, addr:housenumber, addr:city, addr:postcode, addr:country
+- contact:phone, phone
+- contact:website, website, url
+- contact:email, email
+
+For EACH object, decide if it is a real, useful business lead and, if yes,
+produce a CLEAN, NORMALIZED JSON object for it.
+
+RULES:
+- ONLY return leads that look like actual businesses or clinics/shops/etc.
+- If an object is clearly not a business (e.g. a park, bus stop, street),
+  return its entry with all fields set to empty strings.
+- Prefer human-friendly formatting (e.g. full address line).
+- If a field is missing, try to infer it from other tags when reasonable.
+- Return exactly one entry per input object, keyed by its "id" copied unchanged.
+
+Return ONLY a valid JSON object (no prose, no comments):
+{
+  "<id of the input object>": {
+    "name": "<clean business name or empty string>",
+    "address": "<single-line formatted address>",
+    "phone": "<E.164 or best-effort phone, or empty string>",
+    "website": "<https URL if present, else empty string>",
+    "email": "<email if present, else empty string>"
+  }
+}
+"""
+
+# Tags the prompts actually use, plus the ones that tell a business apart
+PROMPT_TAGS = (
+    "name", "brand",
+    "addr:full", "addr:street", "addr:housenumber", "addr:city",
+    "addr:postcode", "addr:country",
+    "contact:phone", "phone",
+    "contact:website", "website", "url",
+    "contact:email", "email",
+    "amenity", "shop", "office", "craft", "healthcare", "tourism",
+    "leisure", "highway",
+)
+
+COMPACT_SYSTEM_PROMPT = """Clean this OpenStreetMap record as a business lead.
+Not a business (park, bus stop, street)? Return all fields empty.
+Infer missing fields from other tags if reasonable. One-line address, E.164 phone, https website.
+Return ONLY JSON: {"name":"","address":"","phone":"","website":"","email":""}
+"""
+
+COMPACT_BATCH_SYSTEM_PROMPT = """Clean each OpenStreetMap record below as a business lead.
+Not a business (park, bus stop, street)? Return its fields empty.
+Infer missing fields from other tags if reasonable. One-line address, E.164 phone, https website.
+Return ONLY a JSON object with one entry per record, keyed by its id:
+{"<id>":{"name":"","address":"","phone":"","website":"","email":""}}
+"""
+
+_sent_lock = threading.Lock()
+_sent = {"prompts": 0, "sent_chars": 0}
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token for English/JSON text)."""
+    return (len(text) + 3) // 4
+
+
+def compact_tags(raw: Dict) -> str:
+    """Project an element onto PROMPT_TAGS as dense key=value lines."""
+    tags = raw.get("tags", {})
+    lines = []
+    for key in PROMPT_TAGS:
+        value = str(tags.get(key, "")).strip()
+        if value:
+            lines.append(f"{key}={' '.join(value.split())}")
+    return "\n".join(lines)
+
+
+def _track(sent: str) -> None:
+    with _sent_lock:
+        _sent["prompts"] += 1
+        _sent["sent_chars"] += len(sent)
+
+
+def _full_prompt(raw: Dict) -> str:
+    return SYSTEM_PROMPT + "\nRAW DATA:\n" + json.dumps(raw, indent=2)
+
+
+def _full_batch_prompt(items: List[Tuple[str, Dict]]) -> str:
+    payload = [{"id": key, "tags": raw.get("tags", {})} for key, raw in items]
+    return BATCH_SYSTEM_PROMPT + "\nRAW DATA:\n" + json.dumps(payload, ensure_ascii=False)
+
+
+def build_prompt(raw: Dict, style: str = None) -> str:
+    if (style or PROMPT_STYLE) != "compact":
+        prompt = _full_prompt(raw)
+    else:
+        prompt = COMPACT_SYSTEM_PROMPT + "\n" + compact_tags(raw)
+    _track(prompt)
+    return prompt
+
+
+def build_batch_prompt(items: List[Tuple[str, Dict]], style: str = None) -> str:
+    """``items`` are ``(id, raw)`` pairs; the model must echo each id back."""
+    if (style or PROMPT_STYLE) != "compact":
+        prompt = _full_batch_prompt(items)
+    else:
+        records = "\n\n".join(f"id={key}\n{compact_tags(raw)}" for key, raw in items)
+        prompt = COMPACT_BATCH_SYSTEM_PROMPT + "\n" + records
+    _track(prompt)
+    return prompt
+
+
+def prompt_stats() -> Dict:
+    """
+    Size of the prompts built since process start. Only the style in use is
+    built; ``python -m benchmarks.prompt_compare`` measures what the compact
+    style saves over the full one.
+    """
+    with _sent_lock:
+        stats = dict(_sent)
+    stats.update({
+        "style": PROMPT_STYLE,
+        "est_sent_tokens": (stats["sent_chars"] + 3) // 4,
+    })
+    return stats
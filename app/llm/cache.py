@@ -0,0 +1,142 @@
+# Persistent cache for LLM enrichment results
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+DATA_DIR = os.getenv("DATA_DIR", "data")
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(DATA_DIR, "llm_cache.sqlite3"))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "100000"))
+
+
+def normalize_tags(tags: Dict) -> Dict:
+    """Strip whitespace and drop empty values so cosmetic edits hash the same."""
+    out = {}
+    for key, value in (tags or {}).items():
+        value = str(value).strip()
+        if value:
+            out[str(key).strip()] = value
+    return dict(sorted(out.items()))
+
+
+def cache_key(tags: Dict, model: str, prompt_version: str) -> str:
+    """Content address of an enrichment: normalized tags + model + prompt."""
+    blob = json.dumps(
+        {"tags": normalize_tags(tags), "model": model or "", "prompt": prompt_version},
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class EnrichmentCache:
+    """
+    SQLite-backed, size-bounded LRU of enriched leads.
+
+    Entries are keyed by ``cache_key`` so the same element (same tags) hits
+    the cache across runs and queries, while a model or prompt change misses.
+    """
+
+    def __init__(self, path: str, max_entries: int = LLM_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max(1, max_entries)
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS enrichment ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS enrichment_last_used ON enrichment(last_used)"
+        )
+        self._conn.commit()
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM enrichment").fetchone()[0]
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM enrichment WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute(
+                "UPDATE enrichment SET last_used = ? WHERE key = ?", (time.time(), key)
+            )
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def put(self, key: str, lead: Dict) -> None:
+        value = json.dumps(lead, ensure_ascii=False)
+        with self._lock:
+            existed = self._conn.execute(
+                "SELECT 1 FROM enrichment WHERE key = ?", (key,)
+            ).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO enrichment (key, value, last_used) VALUES (?, ?, ?)",
+                (key, value, time.time()),
+            )
+            self.writes += 1
+            if not existed:
+                self._entries += 1
+            if self._entries > self.max_entries:
+                excess = self._entries - self.max_entries
+                self._conn.execute(
+                    "DELETE FROM enrichment WHERE key IN ("
+                    " SELECT key FROM enrichment ORDER BY last_used ASC LIMIT ?)",
+                    (excess,),
+                )
+                self._entries -= excess
+                self.evictions += excess
+            self._conn.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM enrichment")
+            self._conn.commit()
+            self._entries = 0
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "path": self.path,
+            "entries": self._entries,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "writes": self.writes,
+            "evictions": self.evictions,
+        }
+
+
+_cache: Optional[EnrichmentCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> Optional[EnrichmentCache]:
+    """Shared cache instance, opened on first use; None if disabled (empty path)."""
+    global _cache
+    if not LLM_CACHE_PATH:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = EnrichmentCache(LLM_CACHE_PATH, LLM_CACHE_MAX_ENTRIES)
+    return _cache
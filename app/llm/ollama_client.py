@@ -1,18 +1,231 @@
 # Ollama LLM client
 
-import requests
+import json
 import os
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 
+from app.services.metrics import Counter, Gauge, Histogram
+
 load_dotenv()
 
-def call_llm(prompt):
-    response = requests.post(
-        "http://localhost:11434/api/generate",
-        json={
-            "model": os.getenv("OLLAMA_MODEL"),
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL")
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5"))
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "120"))
+# Keep the model resident between leads instead of reloading it
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+# Upper bound on generated tokens per lead
+OLLAMA_NUM_PREDICT = int(os.getenv("OLLAMA_NUM_PREDICT", "256"))
+OLLAMA_STREAM = os.getenv("OLLAMA_STREAM", "true").lower() in ("1", "true", "yes")
+OLLAMA_POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", "8"))
+
+LLM_SECONDS = Histogram("llm_request_seconds", "Ollama generate call time", ["job"])
+LLM_IN_FLIGHT = Gauge("llm_in_flight", "Ollama generate calls in progress")
+LLM_ERRORS = Counter("llm_errors_total", "Ollama generate calls that failed", ["job"])
+LLM_TOKENS = Counter("llm_tokens_total", "Tokens processed by Ollama", ["job", "kind"])
+
+
+class _JsonScanner:
+    """
+    Incrementally track whether the root JSON value in a stream is complete.
+
+    Only brackets outside of strings count, so it works on partial chunks
+    without re-parsing the whole buffer each time. The output must open with
+    the root object or array: if anything else comes first (prose, a stray
+    value) the scanner gives up and the stream runs to the end, so a reply
+    is never cut at a value that is not its root.
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.started = False
+        self.gave_up = False
+        self.in_string = False
+        self.escaped = False
+        self.end = -1
+        self._pos = 0
+
+    def feed(self, text: str) -> bool:
+        if self.gave_up:
+            return False
+        for ch in text:
+            self._pos += 1
+            if not self.started:
+                if ch.isspace():
+                    continue
+                if ch not in "{[":
+                    self.gave_up = True
+                    return False
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+                continue
+            if ch == '"':
+                self.in_string = True
+            elif ch in "{[":
+                self.depth += 1
+                self.started = True
+            elif ch in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    self.end = self._pos
+                    return True
+        return False
+
+
+class OllamaClient:
+    """
+    Thin client for Ollama's /api/generate with a pooled HTTP session.
+
+    Every call records latency and token counts; ``stats()`` aggregates them.
+    With streaming enabled the response is cut off as soon as the root JSON
+    value has closed, so trailing whitespace or chatter costs nothing.
+    """
+
+    def __init__(self, base_url: str = OLLAMA_BASE_URL, model: Optional[str] = OLLAMA_MODEL,
+                 connect_timeout: float = OLLAMA_CONNECT_TIMEOUT,
+                 read_timeout: float = OLLAMA_READ_TIMEOUT,
+                 keep_alive: str = OLLAMA_KEEP_ALIVE,
+                 num_predict: int = OLLAMA_NUM_PREDICT,
+                 stream: bool = OLLAMA_STREAM,
+                 pool_size: int = OLLAMA_POOL_SIZE):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.timeout = (connect_timeout, read_timeout)
+        self.keep_alive = keep_alive
+        self.num_predict = num_predict
+        self.stream = stream
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._lock = threading.Lock()
+        self._totals = {
+            "calls": 0,
+            "errors": 0,
+            "early_stops": 0,
+            "latency_s": 0.0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+        }
+        self.recent = deque(maxlen=100)
+
+    def generate(self, prompt: str, json_mode: bool = True,
+                 num_predict: Optional[int] = None, stream: Optional[bool] = None) -> str:
+        stream = self.stream if stream is None else stream
+        body = {
+            "model": self.model,
             "prompt": prompt,
-            "stream": False
+            "stream": stream,
+            "keep_alive": self.keep_alive,
+            "options": {"num_predict": num_predict or self.num_predict},
         }
-    )
-    return response.json()["response"]
+        if json_mode:
+            body["format"] = "json"
+
+        started = time.perf_counter()
+        record = {"prompt_tokens": None, "completion_tokens": None, "early_stop": False}
+        LLM_IN_FLIGHT.inc()
+        try:
+            if stream:
+                text = self._generate_stream(body, record, json_mode)
+            else:
+                resp = self.session.post(f"{self.base_url}/api/generate", json=body, timeout=self.timeout)
+                resp.raise_for_status()
+                data = resp.json()
+                text = data["response"]
+                record["prompt_tokens"] = data.get("prompt_eval_count")
+                record["completion_tokens"] = data.get("eval_count")
+        except Exception:
+            self._record(started, record, error=True)
+            raise
+        self._record(started, record)
+        return text
+
+    def _generate_stream(self, body: Dict, record: Dict, json_mode: bool) -> str:
+        parts = []
+        scanner = _JsonScanner() if json_mode else None
+        chunks = 0
+        with self.session.post(f"{self.base_url}/api/generate", json=body,
+                               timeout=self.timeout, stream=True) as resp:
+            resp.raise_for_status()
+            for line in resp.iter_lines():
+                if not line:
+                    continue
+                data = json.loads(line)
+                if "error" in data:
+                    raise RuntimeError(f"Ollama error: {data['error']}")
+                piece = data.get("response", "")
+                chunks += 1
+                parts.append(piece)
+                if data.get("done"):
+                    record["prompt_tokens"] = data.get("prompt_eval_count")
+                    record["completion_tokens"] = data.get("eval_count", chunks)
+                    break
+                if scanner is not None and scanner.feed(piece):
+                    # Complete JSON value received - stop generation early.
+                    # Closing the response aborts the request on Ollama's side.
+                    record["early_stop"] = True
+                    record["completion_tokens"] = chunks
+                    break
+        text = "".join(parts)
+        if scanner is not None and scanner.end > 0:
+            text = text[:scanner.end]
+        return text
+
+    def _record(self, started: float, record: Dict, error: bool = False) -> None:
+        record["latency_s"] = round(time.perf_counter() - started, 4)
+        record["error"] = error
+        LLM_IN_FLIGHT.dec()
+        LLM_SECONDS.observe(record["latency_s"])
+        if error:
+            LLM_ERRORS.inc()
+        LLM_TOKENS.inc(record["prompt_tokens"] or 0, kind="prompt")
+        LLM_TOKENS.inc(record["completion_tokens"] or 0, kind="completion")
+        with self._lock:
+            self._totals["calls"] += 1
+            self._totals["latency_s"] += record["latency_s"]
+            if error:
+                self._totals["errors"] += 1
+            if record["early_stop"]:
+                self._totals["early_stops"] += 1
+            self._totals["prompt_tokens"] += record["prompt_tokens"] or 0
+            self._totals["completion_tokens"] += record["completion_tokens"] or 0
+            self.recent.append(record)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            totals = dict(self._totals)
+        calls = totals["calls"]
+        totals["latency_s"] = round(totals["latency_s"], 4)
+        totals["avg_latency_s"] = round(totals["latency_s"] / calls, 4) if calls else 0.0
+        return totals
+
+
+_client: Optional[OllamaClient] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> OllamaClient:
+    """Shared client so all callers reuse one connection pool."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = OllamaClient()
+    return _client
+
+
+def call_llm(prompt, json_mode=True, num_predict=None):
+    return get_client().generate(prompt, json_mode=json_mode, num_predict=num_predict)
@@ -1,29 +1,331 @@
-from fastapi import BackgroundTasks, FastAPI
+import importlib.util
+import json
+from typing import Dict, List, Optional, Tuple
 
-from app.agent.agent import AGENT_STATS, run_agent
-from app.services.sheets import read_all
+from fastapi import FastAPI, Header, HTTPException, Query, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+
+from app.agent.jobs import (
+    FINISHED,
+    JOB_RESUME,
+    RESOURCES,
+    event_stream,
+    get_jobs,
+    new_stats,
+    resume_interrupted,
+)
+from app.agent.prompt import prompt_stats
+from app.llm.cache import get_cache
+from app.llm.ollama_client import get_client
+from app.memory.vector_store import index_stats, save_index
+from app.models.lead import COLUMNS
+from app.services.checkpoints import checkpoint_stats, get_checkpoints
+from app.services.export import FORMATS, WRITERS
+from app.services.lead_store import (
+    FILTER_FIELDS,
+    lead_summary,
+    leads_etag,
+    query_leads,
+    shutdown as stop_replication,
+    store_stats,
+)
+from app.services.metrics import CONTENT_TYPE, REGISTRY, render as render_metrics
+from app.services.warmup import WARMUP_ON_STARTUP, readiness, start_warmup
+from app.tools.osm_extract import resolve_extract
+from app.tools.scraper import close_scraper, scraper_stats
+from app.tools.overpass_cache import area_cache, cache_stats, response_cache
 
 
 app = FastAPI()
 
+# Job counters as lead outcomes on /metrics
+LEAD_OUTCOMES = {
+    "leads_written": "inserted",
+    "leads_updated": "updated",
+    "leads_unchanged": "unchanged",
+    "skipped_duplicates": "duplicate",
+    "skipped_processed": "already_processed",
+    "errors": "error",
+}
+
+
+def _cache_families(caches: Dict[str, Optional[Dict]]):
+    hits, misses, ratios = [], [], []
+    for name, stats in caches.items():
+        if not stats:
+            continue
+        labels = {"cache": name}
+        lookups = stats["hits"] + stats["misses"]
+        hits.append((labels, stats["hits"]))
+        misses.append((labels, stats["misses"]))
+        ratios.append((labels, round(stats["hits"] / lookups, 4) if lookups else 0.0))
+    return [
+        ("cache_hits_total", "counter", "Cache lookups that hit", hits),
+        ("cache_misses_total", "counter", "Cache lookups that missed", misses),
+        ("cache_hit_ratio", "gauge", "Share of cache lookups that hit", ratios),
+    ]
+
+
+def _service_metrics():
+    """Families read from the stats the services already keep, computed per scrape."""
+    llm_cache, overpass = get_cache(), cache_stats()
+    dedup, scraper = index_stats(), scraper_stats()
+    yield from _cache_families({
+        "llm": llm_cache.stats() if llm_cache else None,
+        "overpass_responses": overpass["responses"] if overpass else None,
+        "overpass_areas": overpass["areas"] if overpass else None,
+        "embeddings": dedup["embed_cache"] if dedup else None,
+        "scraper": scraper and {"hits": scraper["cache_hits"],
+                                "misses": scraper["requests"] - scraper["cache_hits"]},
+    })
+
+    jobs = get_jobs()
+    by_status, leads, elements, queued = {}, [], [], []
+    for job in jobs.list():
+        by_status[job.status] = by_status.get(job.status, 0) + 1
+        stats = job.to_dict()
+        elements.append(({"job": job.id}, stats["elements"]))
+        leads.extend(({"job": job.id, "outcome": outcome}, stats[key]) for key, outcome in LEAD_OUTCOMES.items())
+        if job.pipeline is not None and job.status not in FINISHED:
+            queued.extend(({"job": job.id, "stage": stage["name"]}, stage["queued"])
+                          for stage in job.pipeline.stats())
+    yield "agent_jobs", "gauge", "Known jobs by status", [({"status": k}, v) for k, v in by_status.items()]
+    yield "agent_job_elements_total", "counter", "OSM elements read by a job", elements
+    yield "agent_job_leads_total", "counter", "Leads handled by a job, by outcome", leads
+    yield "agent_stage_queued", "gauge", "Items waiting in a running job's stage inbox", queued
+
+    limits = {name: r.stats() for name, r in RESOURCES.items()}
+    yield "resource_slots_in_use", "gauge", "Shared service slots held by jobs", [
+        ({"resource": name}, s["in_use"]) for name, s in limits.items()]
+    yield "resource_waiting", "gauge", "Jobs' requests waiting for a shared service slot", [
+        ({"resource": name}, s["waiting"]) for name, s in limits.items()]
+
+
+REGISTRY.add_collector(_service_metrics)
+
+
+@app.on_event("startup")
+def warm_up():
+    """Load the embedding model and dedup index in the background, not on the first run."""
+    if WARMUP_ON_STARTUP:
+        start_warmup()
+
+
+@app.on_event("startup")
+def resume_jobs():
+    """Re-queue jobs a restart interrupted; they skip the elements they had already settled."""
+    if JOB_RESUME:
+        resume_interrupted()
+
+
+@app.on_event("shutdown")
+def flush_pending_writes():
+    """Give pending leads one last chance to reach Sheets and save the dedup index."""
+    stop_replication()
+    save_index()
+    close_scraper()
+
 
 @app.post("/run")
-async def run(query: str, bg: BackgroundTasks):
-    bg.add_task(run_agent, query)
-    return {"status": "Agent started"}
+def run(query: str, harvest: bool = False, extract: Optional[str] = None,
+        priority: int = 0, reprocess: bool = False):
+    """
+    Queue an agent job and return its id. ``harvest=true`` tiles the area to
+    fetch every match; ``extract=<file>`` reads a local OSM extract from
+    OSM_EXTRACT_DIR instead of calling Overpass. Jobs with a higher
+    ``priority`` start first once a worker is free. Elements an earlier run
+    already processed (same OSM id and version) are skipped unless
+    ``reprocess=true``.
+    """
+    if extract:
+        try:
+            resolve_extract(extract)
+        except FileNotFoundError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+    jobs = get_jobs()
+    job = jobs.submit(query, harvest, extract, priority, reprocess=reprocess)
+    return {"status": "Agent started", "job_id": job.id, "queue_position": jobs.queue_position(job)}
+
+
+def _job_or_404(job_id: str):
+    job = get_jobs().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return job
+
+
+@app.get("/jobs")
+async def list_jobs():
+    """Queued, running and recently finished jobs, newest first."""
+    return [job.to_dict() for job in get_jobs().list()]
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    """Status and counters of one job, and its checkpointed outcomes per element."""
+    jobs = get_jobs()
+    job = _job_or_404(job_id)
+    checkpoints = get_checkpoints()
+    return {
+        **job.to_dict(),
+        "queue_position": jobs.queue_position(job),
+        "checkpoint": checkpoints.outcomes(job.id) if checkpoints else None,
+    }
+
+
+def _sse(events):
+    for seq, kind, data in events:
+        yield f"id: {seq}\nevent: {kind}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+@app.get("/jobs/{job_id}/events")
+def job_events(job_id: str, last_event_id: Optional[str] = Header(None)):
+    """
+    Server-sent events for one job: ``lead`` (one per element: inserted,
+    updated, unchanged, duplicate, skipped or error), ``status`` changes,
+    a ``progress`` snapshot every JOB_PROGRESS_INTERVAL seconds (counters,
+    percent done, per-stage throughput) and a final ``end``. Reconnecting
+    with ``Last-Event-ID`` resumes after the last event received.
+    """
+    job = _job_or_404(job_id)
+    after = int(last_event_id) if last_event_id and last_event_id.isdigit() else 0
+    return StreamingResponse(
+        _sse(event_stream(job, after)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/jobs/{job_id}/cancel")
+def cancel_job(job_id: str):
+    """
+    Cancel a job. A queued job never starts; a running one stops fetching
+    and enriching, stores the leads already in flight, and ends ``cancelled``.
+    """
+    _job_or_404(job_id)
+    return get_jobs().cancel(job_id).to_dict()
+
+
+def _lead_query(fields: Optional[str], name: Optional[str], address: Optional[str],
+                email: Optional[str]) -> Tuple[Optional[List[str]], Dict[str, str]]:
+    """Parse the projection and filter parameters shared by /leads and exports."""
+    projection = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+    unknown = [f for f in projection or [] if f not in COLUMNS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    filters = {k: v for k, v in zip(FILTER_FIELDS, (name, address, email)) if v}
+    return projection, filters
 
 
 @app.get("/leads")
-async def get_leads():
+def get_leads(response: Response,
+              offset: int = Query(0, ge=0),
+              limit: Optional[int] = Query(None, ge=1),
+              fields: Optional[str] = None,
+              name: Optional[str] = None,
+              address: Optional[str] = None,
+              email: Optional[str] = None,
+              if_none_match: Optional[str] = Header(None)):
     """
-    Return all leads currently stored in Google Sheets.
+    Return leads from the local lead store (Google Sheets is only a replica).
     Each record is a dict with keys matching the sheet headers.
+
+    ``offset``/``limit`` page through the leads, ``fields=name,email``
+    projects the records, and ``name``/``address``/``email`` keep leads
+    containing that text. The total match count is in ``X-Total-Count``;
+    send the returned ``ETag`` as ``If-None-Match`` to get a 304 while
+    nothing changed.
+    """
+    projection, filters = _lead_query(fields, name, address, email)
+
+    etag = leads_etag(offset=offset, limit=limit, fields=projection, filters=filters)
+    if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    total, leads = query_leads(offset, limit, projection, filters)
+    response.headers["ETag"] = etag
+    response.headers["X-Total-Count"] = str(total)
+    return leads
+
+
+@app.get("/leads/summary")
+def get_lead_summary():
     """
-    return read_all()
+    Lead totals for the dashboard: leads, distinct names and emails, and
+    the emails shared by more than one lead.
+    """
+    return lead_summary()
+
+
+@app.get("/leads/export.{fmt}")
+def export_leads(fmt: str,
+                 fields: Optional[str] = None,
+                 name: Optional[str] = None,
+                 address: Optional[str] = None,
+                 email: Optional[str] = None):
+    """
+    Stream every matching lead as ``csv``, ``jsonl`` or ``parquet``, read
+    from the lead store in chunks. Takes the same ``fields`` and filter
+    parameters as /leads.
+    """
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=404, detail=f"Unknown export format: {fmt}")
+    if fmt == "parquet" and importlib.util.find_spec("pyarrow") is None:
+        raise HTTPException(status_code=501, detail="Parquet export needs pyarrow installed")
+    projection, filters = _lead_query(fields, name, address, email)
+    return StreamingResponse(
+        WRITERS[fmt](projection or COLUMNS, filters),
+        media_type=FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="osm_agentic_leads.{fmt}"'},
+    )
 
 
 @app.get("/stats")
-async def get_stats():
-    """Return in-memory agent statistics for progress tracking."""
-    return AGENT_STATS
+def get_stats():
+    """
+    Counters of the most recently started job (per-job counters are at
+    /jobs/{id}), plus service-wide statistics.
+    """
+    cache = get_cache()
+    jobs = get_jobs()
+    latest = jobs.latest()
+    return {
+        **(latest.to_dict() if latest else new_stats()),
+        "jobs": jobs.stats(),
+        "llm": get_client().stats(),
+        "llm_cache": cache.stats() if cache else None,
+        "prompt": prompt_stats(),
+        "overpass_cache": cache_stats(),
+        "scraper": scraper_stats(),
+        "lead_store": store_stats(),
+        "dedup_index": index_stats(),
+        "checkpoints": checkpoint_stats(),
+    }
+
+
+@app.get("/metrics")
+def metrics():
+    """
+    Prometheus metrics: latency histograms, in-flight gauges and error and
+    retry counters for Overpass, Ollama, the scraper, dedup and Sheets
+    (labelled by job where one is running), plus cache hit ratios and job
+    counters.
+    """
+    return PlainTextResponse(render_metrics(), media_type=CONTENT_TYPE)
+
+
+@app.get("/ready")
+async def ready():
+    """Readiness probe: 503 until the warm-up is done; lists the loaded components."""
+    state = readiness()
+    return JSONResponse(state, status_code=200 if state["ready"] else 503)
+
 
+@app.delete("/cache/overpass")
+def clear_overpass_cache(areas: bool = False):
+    """Drop cached Overpass responses (and resolved areas if ``areas=true``)."""
+    responses = response_cache()
+    cleared = {"responses": responses.clear() if responses else 0}
+    if areas and area_cache() is not None:
+        cleared["areas"] = area_cache().clear()
+    return cleared
@@ -0,0 +1,135 @@
+# Exact-key and spatial blocking in front of embedding dedup
+
+import math
+import os
+import re
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+from app.agent.normalizer import validate_email
+
+# Grid cell edge in degrees (0.005° ≈ 550 m of latitude); candidates come from the 3x3 block around a lead
+DEDUP_CELL_DEG = float(os.getenv("DEDUP_CELL_DEG", "0.005"))
+
+# Hosts shared by unrelated businesses (profile pages, link hubs): never a dedup key
+SHARED_HOSTS = (
+    "facebook.com", "instagram.com", "twitter.com", "x.com", "linkedin.com",
+    "tiktok.com", "youtube.com", "google.com", "goo.gl", "linktr.ee",
+    "tripadvisor.com", "yelp.com", "booking.com", "wa.me",
+)
+
+Cell = Tuple[int, int]
+
+
+def cell_of(lat, lon, size: float = DEDUP_CELL_DEG) -> Optional[Cell]:
+    try:
+        lat, lon = float(lat), float(lon)
+    except (TypeError, ValueError):
+        return None
+    if math.isnan(lat) or math.isnan(lon):
+        return None
+    return int(math.floor(lat / size)), int(math.floor(lon / size))
+
+
+def neighbours(cell: Cell) -> List[Cell]:
+    return [(cell[0] + dr, cell[1] + dc) for dr in (-1, 0, 1) for dc in (-1, 0, 1)]
+
+
+def _phone_key(value: str) -> str:
+    digits = re.sub(r"\D", "", value or "")
+    # Last 9 digits: the same number with or without country/trunk prefix
+    return digits[-9:] if len(digits) >= 7 else ""
+
+
+def _domain_key(value: str) -> str:
+    value = (value or "").strip()
+    if not value:
+        return ""
+    if "://" not in value:
+        value = "https://" + value
+    try:
+        host = (urlsplit(value).hostname or "").lower()
+    except ValueError:
+        return ""
+    host = host[4:] if host.startswith("www.") else host
+    if not host or "." not in host or any(host == h or host.endswith("." + h) for h in SHARED_HOSTS):
+        return ""
+    return host
+
+
+def _email_key(value: str) -> str:
+    email, ok = validate_email(value or "")
+    return email.lower() if ok else ""
+
+
+def lead_keys(lead: Dict, uuid: str) -> List[str]:
+    """Exact identity keys of a lead: its id plus normalized phone, website host and email."""
+    keys = [f"id:{uuid}"]
+    for prefix, fn, field in (("tel", _phone_key, "phone"), ("web", _domain_key, "website"),
+                              ("mail", _email_key, "email")):
+        value = fn(str(lead.get(field) or ""))
+        if value:
+            keys.append(f"{prefix}:{value}")
+    return keys
+
+
+class Blocker:
+    """
+    Cheap candidate filter for dedup.
+
+    ``match`` finds leads sharing an exact key. The id key always matches.
+    Phone, website and email keys only match within the neighbouring grid
+    cells, because chains share a domain or hotline across cities; leads
+    without coordinates match on keys alone. ``nearby`` lists the leads in
+    the 3x3 cells around a point, the only ones worth an embedding
+    comparison.
+    """
+
+    def __init__(self, cell_deg: float = DEDUP_CELL_DEG):
+        self.cell_deg = cell_deg
+        self._keys: Dict[str, Set[Optional[Cell]]] = defaultdict(set)
+        self._cells: Dict[Cell, List[Tuple[int, str]]] = defaultdict(list)
+        self._vids: Set[int] = set()
+        self._lock = threading.Lock()
+        self.leads = 0
+
+    def __contains__(self, vid: int) -> bool:
+        with self._lock:
+            return vid in self._vids
+
+    def cell(self, lat, lon) -> Optional[Cell]:
+        return cell_of(lat, lon, self.cell_deg)
+
+    def match(self, keys: Iterable[str], cell: Optional[Cell]) -> Optional[str]:
+        """The first key this lead shares with a known lead, if any."""
+        near = set(neighbours(cell)) if cell else None
+        with self._lock:
+            for key in keys:
+                seen = self._keys.get(key)
+                if not seen:
+                    continue
+                if key.startswith("id:") or near is None or None in seen or seen & near:
+                    return key
+        return None
+
+    def nearby(self, cell: Cell) -> List[Tuple[int, str]]:
+        """(vector id, text) of every known lead in the 3x3 block around ``cell``."""
+        with self._lock:
+            return [entry for c in neighbours(cell) for entry in self._cells.get(c, ())]
+
+    def add(self, keys: Iterable[str], cell: Optional[Cell], vid: int, text: str) -> None:
+        with self._lock:
+            if vid in self._vids:
+                return
+            self._vids.add(vid)
+            for key in keys:
+                self._keys[key].add(cell)
+            if cell is not None:
+                self._cells[cell].append((vid, text))
+            self.leads += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"leads": self.leads, "keys": len(self._keys), "cells": len(self._cells)}
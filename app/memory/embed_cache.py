@@ -0,0 +1,136 @@
+# Persistent cache for dedup embeddings
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+DATA_DIR = os.getenv("DATA_DIR", "data")
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", os.path.join(DATA_DIR, "embed_cache.sqlite3"))
+EMBED_CACHE_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "200000"))
+
+# SQLite's default limit on bound parameters is 999
+_LOOKUP_CHUNK = 500
+
+
+class EmbeddingCache:
+    """
+    SQLite-backed, size-bounded LRU of embeddings keyed by normalized text.
+
+    Vectors are stored per model as raw float32 bytes, so a repeat of the
+    same name and address is never encoded twice, across runs and restarts,
+    while a model change simply misses.
+    """
+
+    def __init__(self, path: str, model: str, max_entries: int = EMBED_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.model = model
+        self.max_entries = max(1, max_entries)
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL,"
+            " text TEXT NOT NULL,"
+            " vec BLOB NOT NULL,"
+            " last_used REAL NOT NULL,"
+            " PRIMARY KEY (model, text))"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)"
+        )
+        self._conn.commit()
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def get_many(self, texts: Sequence[str]) -> Dict[str, np.ndarray]:
+        """Cached vectors for whichever of ``texts`` are known."""
+        unique = list(dict.fromkeys(texts))
+        found: Dict[str, np.ndarray] = {}
+        with self._lock:
+            for start in range(0, len(unique), _LOOKUP_CHUNK):
+                chunk = unique[start:start + _LOOKUP_CHUNK]
+                rows = self._conn.execute(
+                    f"SELECT text, vec FROM embeddings WHERE model = ? AND text IN ({','.join('?' * len(chunk))})",
+                    [self.model, *chunk],
+                ).fetchall()
+                for text, blob in rows:
+                    found[text] = np.frombuffer(blob, dtype="float32")
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND text = ?",
+                    [(now, self.model, text) for text in found],
+                )
+                self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(unique) - len(found)
+        return found
+
+    def put_many(self, vectors: Dict[str, np.ndarray]) -> None:
+        if not vectors:
+            return
+        now = time.time()
+        with self._lock:
+            cur = self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (model, text, vec, last_used) VALUES (?, ?, ?, ?)",
+                [(self.model, text, np.asarray(vec, dtype="float32").tobytes(), now)
+                 for text, vec in vectors.items()],
+            )
+            self.writes += len(vectors)
+            self._entries += max(0, cur.rowcount)
+            if self._entries > self.max_entries:
+                excess = self._entries - self.max_entries
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE rowid IN ("
+                    " SELECT rowid FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                    (excess,),
+                )
+                self._entries -= excess
+                self.evictions += excess
+            self._conn.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self._entries = 0
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "path": self.path,
+            "entries": self._entries,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "writes": self.writes,
+            "evictions": self.evictions,
+        }
+
+
+_cache: Optional[EmbeddingCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_embed_cache(model: str) -> Optional[EmbeddingCache]:
+    """Shared cache instance, opened on first use; None if disabled (empty path)."""
+    global _cache
+    if not EMBED_CACHE_PATH:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = EmbeddingCache(EMBED_CACHE_PATH, model, EMBED_CACHE_MAX_ENTRIES)
+    return _cache
@@ -1,23 +1,539 @@
 # Vector store for memory
 
-import faiss
+import json
+import math
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
 import numpy as np
-from sentence_transformers import SentenceTransformer
 
-model = SentenceTransformer("all-MiniLM-L6-v2")
-index = faiss.IndexFlatL2(384)
+from app.memory.blocking import Blocker, lead_keys, neighbours
+from app.memory.embed_cache import get_embed_cache
+from app.services.metrics import Counter, Histogram
+from app.services.uuid_service import lead_id
 
-def is_duplicate(lead, threshold=0.85):
-    vec = model.encode([lead["name"] + lead["address"]]).astype("float32")
-    if index.ntotal == 0:
-        index.add(vec)
-        return False
+DATA_DIR = os.getenv("DATA_DIR", "data")
+EMBED_MODEL = os.getenv("EMBED_MODEL", "all-MiniLM-L6-v2")
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "256"))
+# Torch intra-op threads used for encoding (0 = torch default, one per core)
+EMBED_THREADS = int(os.getenv("EMBED_THREADS", "0"))
+DEDUP_INDEX_PATH = os.getenv("DEDUP_INDEX_PATH", os.path.join(DATA_DIR, "dedup.faiss"))
+# Cosine similarity above which two leads are the same business
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.85"))
+# auto picks by size: flat up to DEDUP_FLAT_MAX, HNSW up to DEDUP_IVF_MIN, IVF beyond
+DEDUP_INDEX_TYPE = os.getenv("DEDUP_INDEX_TYPE", "auto").lower()
+DEDUP_FLAT_MAX = int(os.getenv("DEDUP_FLAT_MAX", "20000"))
+DEDUP_IVF_MIN = int(os.getenv("DEDUP_IVF_MIN", "2000000"))
+# Index is written to disk after this many additions (and at the end of a run)
+DEDUP_SAVE_EVERY = int(os.getenv("DEDUP_SAVE_EVERY", "1000"))
+
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+HNSW_EF_SEARCH = 64
+IVF_NPROBE = 16
+# IVF needs ~40 training points per list; more buys little
+IVF_TRAIN_MAX = 200000
+
+EMBED_SECONDS = Histogram("embed_encode_seconds", "Embedding model encode call time", ["job"])
+DEDUP_SECONDS = Histogram("dedup_batch_seconds", "Time to dedupe one batch of leads, embedding included", ["job"])
+DEDUP_LEADS = Counter("dedup_leads_total", "Leads checked for duplicates, by result", ["job", "result"])
+
+# Bump when lead_text changes so stored vectors are rebuilt
+TEXT_VERSION = "2"
+
+# The model (and torch) and faiss are imported on first use, so importing
+# this module stays cheap and the API can answer before they are loaded
+_model = None
+_model_lock = threading.Lock()
+
+_stats = {
+    "checked": 0,
+    "exact_matches": 0,
+    "no_candidates": 0,
+    "semantic_checks": 0,
+    "semantic_matches": 0,
+    "encode_calls": 0,
+    "texts_encoded": 0,
+    "encode_seconds": 0.0,
+}
+
+
+def get_model():
+    """The embedding model, loaded on first use."""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                from sentence_transformers import SentenceTransformer
+
+                if EMBED_THREADS > 0:
+                    import torch
+
+                    torch.set_num_threads(EMBED_THREADS)
+                started = time.time()
+                _model = SentenceTransformer(EMBED_MODEL)
+                print(f"🧠 Loaded embedding model {EMBED_MODEL} in {time.time() - started:.1f}s")
+    return _model
+
+
+def model_loaded() -> bool:
+    return _model is not None
+
+
+def lead_text(lead: Dict) -> str:
+    """Normalized "name, address" text that gets embedded."""
+    parts = (" ".join(str(lead.get(f) or "").lower().split()) for f in ("name", "address"))
+    return ", ".join(p for p in parts if p)
+
+
+def encode(texts: Sequence[str]) -> np.ndarray:
+    """Unit-length float32 embeddings, so inner product is cosine similarity."""
+    started = time.perf_counter()
+    vecs = get_model().encode(
+        list(texts), batch_size=EMBED_BATCH_SIZE, convert_to_numpy=True, normalize_embeddings=True
+    )
+    _stats["encode_calls"] += 1
+    _stats["texts_encoded"] += len(texts)
+    elapsed = time.perf_counter() - started
+    _stats["encode_seconds"] += elapsed
+    EMBED_SECONDS.observe(elapsed)
+    return np.ascontiguousarray(vecs, dtype="float32")
+
+
+def vector_id(uuid: str) -> int:
+    """Lead uuid → non-negative int64 faiss id."""
+    return int(uuid.replace("-", "")[:15], 16)
+
+
+def choose_kind(n: int, preferred: str = DEDUP_INDEX_TYPE) -> str:
+    if preferred in ("flat", "hnsw", "ivf"):
+        return preferred
+    if n <= DEDUP_FLAT_MAX:
+        return "flat"
+    return "hnsw" if n < DEDUP_IVF_MIN else "ivf"
+
+
+class DedupIndex:
+    """
+    Cosine-similarity index over lead embeddings, keyed by lead id.
+
+    Flat search is exact and fine for small sets; HNSW keeps lookups well
+    under a millisecond at millions of leads and accepts inserts; IVF is
+    the most compact at very large sizes but must be trained, so it is only
+    chosen for bulk builds. With ``kind="auto"`` a flat index that outgrows
+    DEDUP_FLAT_MAX is rebuilt as HNSW in place.
+
+    The index is saved to ``path`` with a small JSON sidecar (model, text
+    version). Flat and HNSW indexes are memory-mapped on load; IVF is read
+    into memory, since faiss maps its inverted lists read-only.
+    """
+
+    def __init__(self, dim: int, path: Optional[str] = None, kind: str = DEDUP_INDEX_TYPE):
+        self.dim = dim
+        self.path = path
+        self.preferred = kind
+        self.kind = None
+        self._index = None
+        self._ids = set()
+        self._unsaved = 0
+        self._lock = threading.RLock()
+        self.lookups = 0
+        self.lookup_seconds = 0.0
+        self.added = 0
+        self.rebuilds = 0
+        if not (path and self.load()):
+            # IVF cannot be trained without data; it starts flat and is built by _grow
+            self.reset("flat" if kind == "ivf" else choose_kind(0, kind))
+
+    # ── construction ────────────────────────────────────────────────────
+
+    def _create(self, kind: str, train: Optional[np.ndarray] = None):
+        import faiss
+
+        if kind == "hnsw":
+            inner = faiss.IndexHNSWFlat(self.dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+            inner.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+            inner.hnsw.efSearch = HNSW_EF_SEARCH
+        elif kind == "ivf":
+            if train is None or not len(train):
+                raise ValueError("IVF index needs training vectors")
+            nlist = max(1, min(int(4 * math.sqrt(len(train))), len(train) // 39 or 1))
+            quantizer = faiss.IndexFlatIP(self.dim)
+            inner = faiss.IndexIVFFlat(quantizer, self.dim, nlist, faiss.METRIC_INNER_PRODUCT)
+            inner.train(train[:IVF_TRAIN_MAX])
+            inner.nprobe = min(IVF_NPROBE, nlist)
+            # Lets blocking candidates be fetched by id
+            inner.make_direct_map()
+        else:
+            inner = faiss.IndexFlatIP(self.dim)
+        # The Python wrappers keep the inner index (and quantizer) alive
+        return faiss.IndexIDMap2(inner)
+
+    def reset(self, kind: str, train: Optional[np.ndarray] = None) -> None:
+        with self._lock:
+            self._index = self._create(kind, train)
+            self.kind = kind
+            self._ids = set()
+
+    def _grow(self) -> None:
+        # A flat index past its sweet spot is rebuilt as HNSW (or the requested IVF)
+        if self.preferred not in ("auto", "ivf") or self.kind != "flat" \
+                or self._index.ntotal <= DEDUP_FLAT_MAX:
+            return
+        import faiss
+
+        target = "ivf" if self.preferred == "ivf" else "hnsw"
+        n = self._index.ntotal
+        vectors = faiss.downcast_index(self._index.index).reconstruct_n(0, n)
+        ids = faiss.vector_to_array(self._index.id_map)
+        print(f"🧠 Dedup index reached {n} leads; rebuilding flat → {target}")
+        self.reset(target, vectors if target == "ivf" else None)
+        self._add(vectors, ids)
+        self.rebuilds += 1
+
+    # ── queries and updates ─────────────────────────────────────────────
+
+    def __len__(self) -> int:
+        return self._index.ntotal
+
+    def __contains__(self, vid: int) -> bool:
+        return vid in self._ids
+
+    def search(self, vectors: np.ndarray, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-``k`` cosine similarities and ids per query row (-1 ids when empty)."""
+        started = time.perf_counter()
+        with self._lock:
+            if self._index.ntotal == 0:
+                sims = np.full((len(vectors), k), -1.0, dtype="float32")
+                ids = np.full((len(vectors), k), -1, dtype="int64")
+            else:
+                sims, ids = self._index.search(vectors, k)
+            self.lookups += len(vectors)
+            self.lookup_seconds += time.perf_counter() - started
+        return sims, ids
+
+    def vectors(self, ids: Sequence[int]) -> np.ndarray:
+        """Stored vectors for known ids, one row per id."""
+        with self._lock:
+            return np.vstack([self._index.reconstruct(int(i)) for i in ids])
+
+    def _add(self, vectors: np.ndarray, ids: Sequence[int]) -> None:
+        self._index.add_with_ids(vectors, np.asarray(ids, dtype="int64"))
+        self._ids.update(int(i) for i in ids)
+
+    def add(self, vectors: np.ndarray, ids: Sequence[int]) -> None:
+        with self._lock:
+            self._add(vectors, ids)
+            self.added += len(ids)
+            self._unsaved += len(ids)
+            self._grow()
+            if self.path and self._unsaved >= DEDUP_SAVE_EVERY:
+                self.save()
+
+    # ── persistence ─────────────────────────────────────────────────────
+
+    def _meta(self) -> Dict:
+        return {"model": EMBED_MODEL, "text_version": TEXT_VERSION, "dim": self.dim}
 
-    D, _ = index.search(vec, 1)
-    similarity = 1 / (1 + D[0][0])
+    def load(self) -> bool:
+        import faiss
 
-    if similarity > threshold:
+        meta_path = f"{self.path}.json"
+        if not (os.path.exists(self.path) and os.path.exists(meta_path)):
+            return False
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            if {k: meta.get(k) for k in self._meta()} != self._meta():
+                print("🧠 Dedup index was built with another model or text format; starting fresh")
+                return False
+            index = faiss.read_index(self.path, faiss.IO_FLAG_MMAP)
+            inner = faiss.downcast_index(index.index)
+            if isinstance(inner, faiss.IndexIVF):
+                # Memory-mapped inverted lists are read-only; IVF is read into memory so it accepts adds
+                index = faiss.read_index(self.path)
+                inner = faiss.downcast_index(index.index)
+        except Exception as e:
+            print(f"⚠️ Could not load dedup index from {self.path}: {e}")
+            return False
+        self._index = index
+        self.kind = "hnsw" if isinstance(inner, faiss.IndexHNSW) else (
+            "ivf" if isinstance(inner, faiss.IndexIVF) else "flat")
+        if self.kind == "hnsw":
+            inner.hnsw.efSearch = HNSW_EF_SEARCH
+        elif self.kind == "ivf":
+            inner.nprobe = min(IVF_NPROBE, inner.nlist)
+            inner.make_direct_map()
+        self._ids = set(faiss.vector_to_array(index.id_map).tolist())
+        print(f"🧠 Loaded dedup index ({self.kind}, {index.ntotal} leads) from {self.path}")
         return True
 
-    index.add(vec)
+    def save(self) -> None:
+        if not self.path:
+            return
+        import faiss
+
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp = f"{self.path}.tmp"
+            faiss.write_index(self._index, tmp)
+            os.replace(tmp, self.path)
+            with open(f"{self.path}.json.tmp", "w", encoding="utf-8") as f:
+                json.dump({**self._meta(), "kind": self.kind, "count": self._index.ntotal}, f)
+            os.replace(f"{self.path}.json.tmp", f"{self.path}.json")
+            self._unsaved = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "kind": self.kind,
+                "leads": self._index.ntotal,
+                "added": self.added,
+                "rebuilds": self.rebuilds,
+                "lookups": self.lookups,
+                "avg_lookup_ms": round(1000 * self.lookup_seconds / self.lookups, 4) if self.lookups else 0.0,
+                "unsaved": self._unsaved,
+            }
+
+
+def warm_start(index: DedupIndex, blocker: Blocker, batch_size: int = EMBED_BATCH_SIZE) -> int:
+    """
+    Rebuild the blocking keys and grid from the lead store, and encode (in
+    batches) the stored leads that have no location and are not in the
+    index yet; leads with a location are only encoded when a nearby lead
+    needs comparing. An empty index is first reset to the backend that
+    suits the store's size; for IVF the first vectors are held back to
+    train it. Returns the number of leads encoded.
+    """
+    from app.services.lead_store import get_store
+
+    store = get_store()
+    held_vecs: List[np.ndarray] = []
+    held_ids: List[int] = []
+    kind = None
+    if len(index) == 0:
+        kind = choose_kind(store.query(limit=0)[0], index.preferred)
+        if kind != "ivf":
+            index.reset(kind)
+    added = 0
+    started = time.time()
+    fields = ["uuid", "name", "address", "phone", "website", "email", "lat", "lon"]
+    for chunk in store.iter_chunks(fields, chunk_size=batch_size):
+        fresh = []
+        for values in chunk:
+            lead = dict(zip(fields, values))
+            vid, text = vector_id(lead["uuid"]), lead_text(lead)
+            cell = blocker.cell(lead["lat"], lead["lon"])
+            blocker.add(lead_keys(lead, lead["uuid"]), cell, vid, text)
+            if cell is None and vid not in index:
+                fresh.append((vid, text))
+        if not fresh:
+            continue
+        vecs = encode([text for _, text in fresh])
+        ids = [vid for vid, _ in fresh]
+        added += len(ids)
+        if kind == "ivf":
+            held_vecs.append(vecs)
+            held_ids.extend(ids)
+            if len(held_ids) < IVF_TRAIN_MAX:
+                continue
+            vecs, ids = np.vstack(held_vecs), held_ids
+            index.reset("ivf", train=vecs)
+            held_vecs, held_ids, kind = [], [], None
+        index.add(vecs, ids)
+    if held_ids:
+        vecs = np.vstack(held_vecs)
+        index.reset("ivf", train=vecs)
+        index.add(vecs, held_ids)
+    if added:
+        index.save()
+    print(f"🧠 Dedup warm start: {blocker.leads} stored leads blocked, {added} encoded "
+          f"in {time.time() - started:.1f}s")
+    return added
+
+
+_index: Optional[DedupIndex] = None
+_blocker: Optional[Blocker] = None
+_index_lock = threading.Lock()
+_dedup_lock = threading.Lock()
+
+
+def get_index() -> DedupIndex:
+    """The process-wide dedup index: loaded from disk, then topped up from the lead store."""
+    global _index, _blocker
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                index = DedupIndex(get_model().get_sentence_embedding_dimension(), DEDUP_INDEX_PATH or None)
+                blocker = Blocker()
+                warm_start(index, blocker)
+                _blocker = blocker
+                _index = index
+    return _index
+
+
+def get_blocker() -> Blocker:
+    get_index()
+    return _blocker
+
+
+def index_loaded() -> bool:
+    return _index is not None
+
+
+def save_index() -> None:
+    if _index is not None:
+        _index.save()
+
+
+def index_stats() -> Optional[Dict]:
+    if _index is None:
+        return None
+    cache = get_embed_cache(EMBED_MODEL)
+    seconds = _stats["encode_seconds"]
+    return {
+        **_index.stats(),
+        "blocking": _blocker.stats(),
+        **_stats,
+        "encode_seconds": round(seconds, 3),
+        "encode_texts_per_s": round(_stats["texts_encoded"] / seconds, 1) if seconds else 0.0,
+        "embed_cache": cache.stats() if cache else None,
+    }
+
+
+def _encode(texts: Sequence[str]) -> np.ndarray:
+    """Embeddings for ``texts``: cached ones looked up, the rest encoded in one call."""
+    cache = get_embed_cache(EMBED_MODEL)
+    found = cache.get_many(texts) if cache else {}
+    missing = [t for t in dict.fromkeys(texts) if t not in found]
+    if missing:
+        fresh = dict(zip(missing, encode(missing)))
+        if cache:
+            cache.put_many(fresh)
+        found.update(fresh)
+    return np.vstack([found[t] for t in texts]).astype("float32", copy=False)
+
+
+def _prefetch(prepared) -> Dict[int, np.ndarray]:
+    """
+    Encode, in one call, every text this batch may have to compare: leads
+    without an exact match that have neighbours (stored or in the batch) or
+    no location, plus the never-encoded stored leads near them.
+    """
+    blocker, index = get_blocker(), get_index()
+    in_batch: Dict = {}
+    for _, _, _, cell in prepared:
+        if cell is not None:
+            in_batch[cell] = in_batch.get(cell, 0) + 1
+    wanted: Dict[int, str] = {}
+    for vid, text, keys, cell in prepared:
+        if vid in blocker or blocker.match(keys, cell):
+            continue
+        if cell is None:
+            wanted[vid] = text
+            continue
+        candidates = blocker.nearby(cell)
+        if candidates or sum(in_batch.get(c, 0) for c in neighbours(cell)) > 1:
+            wanted[vid] = text
+            wanted.update((cid, ctext) for cid, ctext in candidates if cid not in index)
+    if not wanted:
+        return {}
+    ids = list(wanted)
+    return dict(zip(ids, _encode([wanted[i] for i in ids])))
+
+
+def _vectors_for(pairs, vecs: Dict[int, np.ndarray]) -> np.ndarray:
+    # Anything the prefetch did not foresee is encoded on the spot
+    fresh = [(vid, text) for vid, text in pairs if vid not in vecs]
+    if fresh:
+        vecs.update(zip((vid for vid, _ in fresh), _encode([text for _, text in fresh])))
+    return np.vstack([vecs[vid] for vid, _ in pairs])
+
+
+def _similar_nearby(text: str, vid: int, candidates, vecs: Dict[int, np.ndarray],
+                    threshold: float) -> bool:
+    """Compare against nearby leads only; never-encoded ones join the index."""
+    index = get_index()
+    missing = list({cid: (cid, ctext) for cid, ctext in candidates if cid not in index}.values())
+    if missing:
+        index.add(_vectors_for(missing, vecs), [cid for cid, _ in missing])
+    vec = _vectors_for([(vid, text)], vecs)
+    sims = index.vectors([cid for cid, _ in candidates]) @ vec[0]
+    if sims.max() > threshold:
+        return True
+    index.add(vec, [vid])
+    return False
+
+
+def _similar_anywhere(text: str, vid: int, vecs: Dict[int, np.ndarray], threshold: float) -> bool:
+    # No location: fall back to a search over every encoded lead
+    index = get_index()
+    vec = _vectors_for([(vid, text)], vecs)
+    sims, _ = index.search(vec, 1)
+    if sims[0][0] > threshold:
+        return True
+    index.add(vec, [vid])
     return False
+
+
+def _decide(lead, vecs: Dict[int, np.ndarray], threshold: float) -> bool:
+    blocker = get_blocker()
+    vid, text, keys, cell = lead
+    _stats["checked"] += 1
+    if vid in blocker:
+        # Accepted before but not stored (its write failed, so it is being
+        # retried): it must not count as a duplicate of itself
+        return False
+    if blocker.match(keys, cell):
+        _stats["exact_matches"] += 1
+        return True
+    if cell is not None:
+        candidates = blocker.nearby(cell)
+        if not candidates:
+            _stats["no_candidates"] += 1
+            blocker.add(keys, cell, vid, text)
+            return False
+        _stats["semantic_checks"] += 1
+        duplicate = _similar_nearby(text, vid, candidates, vecs, threshold)
+    else:
+        _stats["semantic_checks"] += 1
+        duplicate = _similar_anywhere(text, vid, vecs, threshold)
+    if duplicate:
+        _stats["semantic_matches"] += 1
+        return True
+    blocker.add(keys, cell, vid, text)
+    return False
+
+
+def dedupe_batch(leads: Sequence[Dict], threshold: float = DEDUP_THRESHOLD) -> List[bool]:
+    """
+    Duplicate flag per lead. Leads are decided in order, so a lead is
+    checked against the index and against the earlier leads of the same
+    batch; all the embeddings the batch needs are computed in one encode call.
+    """
+    blocker = get_blocker()
+    prepared = []
+    for lead in leads:
+        uuid = lead_id(lead)
+        prepared.append((vector_id(uuid), lead_text(lead), lead_keys(lead, uuid),
+                         blocker.cell(lead.get("lat"), lead.get("lon"))))
+    with DEDUP_SECONDS.time(), _dedup_lock:
+        vecs = _prefetch(prepared)
+        flags = [_decide(lead, vecs, threshold) for lead in prepared]
+    duplicates = sum(flags)
+    DEDUP_LEADS.inc(duplicates, result="duplicate")
+    DEDUP_LEADS.inc(len(flags) - duplicates, result="unique")
+    return flags
+
+
+def is_duplicate(lead, threshold=DEDUP_THRESHOLD):
+    """
+    Exact keys first (id, phone, website host, email), then embedding
+    similarity against leads in the surrounding grid cells only. A lead with
+    nothing nearby is accepted without being encoded at all.
+    """
+    return dedupe_batch([lead], threshold)[0]
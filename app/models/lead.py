@@ -1,2 +1,41 @@
 # Lead model
 
+from dataclasses import astuple, dataclass, fields
+from typing import Dict, List
+
+from app.services.uuid_service import lead_id
+
+
+@dataclass
+class Lead:
+    """One lead as stored locally and in the sheet; field order is the sheet's column order."""
+
+    uuid: str
+    name: str = ""
+    address: str = ""
+    phone: str = ""
+    website: str = ""
+    email: str = ""
+
+    @classmethod
+    def from_enriched(cls, enriched: Dict) -> "Lead":
+        # Empty strings are fine for optional fields
+        return cls(
+            uuid=lead_id(enriched),
+            **{f: str(enriched.get(f) or "").strip() for f in COLUMNS[1:]},
+        )
+
+    @classmethod
+    def from_row(cls, row: List) -> "Lead":
+        values = [str(v) if v is not None else "" for v in row[:len(COLUMNS)]]
+        return cls(*values, *[""] * (len(COLUMNS) - len(values)))
+
+    def to_row(self) -> List[str]:
+        return list(astuple(self))
+
+    def to_dict(self) -> Dict:
+        return dict(zip(COLUMNS, self.to_row()))
+
+
+# Sheet column order; also the keys of records served by /leads
+COLUMNS = [f.name for f in fields(Lead)]
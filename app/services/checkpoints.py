@@ -0,0 +1,222 @@
+# Job checkpoints - processed OSM elements and interrupted jobs, kept across restarts
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+DATA_DIR = os.getenv("DATA_DIR", "data")
+# Empty disables checkpoints (no skipping, no resume)
+CHECKPOINT_PATH = os.getenv("CHECKPOINT_PATH", os.path.join(DATA_DIR, "checkpoints.sqlite3"))
+
+# Outcomes that settle an element; errors are retried on the next run
+SETTLED = ("inserted", "updated", "unchanged", "duplicate", "skipped")
+
+
+def element_version(raw: Dict) -> str:
+    """
+    The element's OSM version when the response carries it, otherwise a
+    fingerprint of its tags and position, so an edited element counts as new.
+    """
+    if raw.get("version") is not None:
+        return str(raw["version"])
+    point = raw.get("center") or raw
+    content = json.dumps([raw.get("tags", {}), point.get("lat"), point.get("lon")], sort_keys=True)
+    return "h" + hashlib.sha1(content.encode("utf-8")).hexdigest()[:16]
+
+
+class CheckpointStore:
+    """
+    SQLite record of which OSM element versions were processed, by which job
+    and with what outcome, plus the parameters and status of every job.
+
+    Outcomes are committed as each lead settles, so after a crash a job
+    resumes right after the last settled element; a later run skips any
+    element whose version it has already settled instead of enriching and
+    scraping it again.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.skipped = 0
+        self.recorded = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS elements ("
+            " osm TEXT PRIMARY KEY,"
+            " version TEXT NOT NULL,"
+            " outcome TEXT NOT NULL,"
+            " job_id TEXT NOT NULL,"
+            " processed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS elements_job ON elements (job_id)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " query TEXT NOT NULL,"
+            " harvest INTEGER NOT NULL DEFAULT 0,"
+            " extract TEXT,"
+            " priority INTEGER NOT NULL DEFAULT 0,"
+            " reprocess INTEGER NOT NULL DEFAULT 0,"
+            " status TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    # ── elements ────────────────────────────────────────────────────────
+
+    def processed(self, osm: str, version: str, job_id: str, own_only: bool = False) -> bool:
+        """
+        Whether this version of the element was already settled; with
+        ``own_only`` only outcomes recorded by ``job_id`` itself count.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT version, outcome, job_id FROM elements WHERE osm = ?", (osm,)
+            ).fetchone()
+        done = (row is not None and row[0] == version and row[1] in SETTLED
+                and (not own_only or row[2] == job_id))
+        if done:
+            self.skipped += 1
+        return done
+
+    def record(self, osm: str, version: str, outcome: str, job_id: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO elements (osm, version, outcome, job_id, processed_at) VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT(osm) DO UPDATE SET version = excluded.version, outcome = excluded.outcome,"
+                " job_id = excluded.job_id, processed_at = excluded.processed_at",
+                (osm, version, outcome, job_id, time.time()),
+            )
+            self._conn.commit()
+            self.recorded += 1
+
+    def outcomes(self, job_id: str) -> Dict[str, int]:
+        """Element count per outcome recorded by one job."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT outcome, COUNT(*) FROM elements WHERE job_id = ? GROUP BY outcome", (job_id,)
+            ).fetchall()
+        return dict(rows)
+
+    # ── jobs ────────────────────────────────────────────────────────────
+
+    def save_job(self, job) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, query, harvest, extract, priority, reprocess, status,"
+                " created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT(id) DO UPDATE SET status = excluded.status, updated_at = excluded.updated_at",
+                (job.id, job.query, int(job.harvest), job.extract, job.priority, int(job.reprocess),
+                 job.status, job.created_at, now),
+            )
+            self._conn.commit()
+
+    def started(self, job_id: str) -> None:
+        """Count one more attempt at running the job."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET attempts = attempts + 1, status = 'running', updated_at = ? WHERE id = ?",
+                (time.time(), job_id),
+            )
+            self._conn.commit()
+
+    def set_status(self, job_id: str, status: str) -> None:
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET status = ?, updated_at = ? WHERE id = ?",
+                               (status, time.time(), job_id))
+            self._conn.commit()
+
+    def interrupted(self, statuses=("queued", "running")) -> List[Dict]:
+        """Jobs the last process left queued or running, oldest first."""
+        with self._lock:
+            cur = self._conn.execute(
+                "SELECT id, query, harvest, extract, priority, reprocess, status, attempts, created_at"
+                f" FROM jobs WHERE status IN ({','.join('?' * len(statuses))}) ORDER BY created_at",
+                statuses,
+            )
+            names = [d[0] for d in cur.description]
+            return [dict(zip(names, row)) for row in cur.fetchall()]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            elements = self._conn.execute("SELECT COUNT(*) FROM elements").fetchone()[0]
+            jobs = self._conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+        return {
+            "path": self.path,
+            "elements": elements,
+            "jobs": jobs,
+            "recorded": self.recorded,
+            "skipped": self.skipped,
+        }
+
+
+class JobCheckpoint:
+    """
+    One run's use of the store: remembers the version of each element it
+    lets through so the outcome can be recorded against it later.
+    """
+
+    def __init__(self, store: CheckpointStore, job_id: str, own_only: bool = False):
+        self.store = store
+        self.job_id = job_id
+        self.own_only = own_only
+        self._versions: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def seen(self, osm: str, raw: Dict) -> bool:
+        """True if the element was settled before and can be skipped."""
+        version = element_version(raw)
+        if self.store.processed(osm, version, self.job_id, self.own_only):
+            return True
+        with self._lock:
+            self._versions[osm] = version
+        return False
+
+    def settle(self, osm: str, outcome: str) -> None:
+        with self._lock:
+            version = self._versions.pop(osm, None)
+        if version is not None:
+            self.store.record(osm, version, outcome, self.job_id)
+
+    def forget(self, osm: str) -> None:
+        """Drop an element left open (not recorded, so the next run does it again)."""
+        with self._lock:
+            self._versions.pop(osm, None)
+
+    def pending(self) -> int:
+        """Elements let through whose outcome is not known yet."""
+        with self._lock:
+            return len(self._versions)
+
+
+_store: Optional[CheckpointStore] = None
+_store_lock = threading.Lock()
+
+
+def get_checkpoints() -> Optional[CheckpointStore]:
+    """Shared checkpoint store, opened on first use; None if disabled (empty path)."""
+    global _store
+    if not CHECKPOINT_PATH:
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = CheckpointStore(CHECKPOINT_PATH)
+    return _store
+
+
+def checkpoint_stats() -> Optional[Dict]:
+    return _store.stats() if _store is not None else None
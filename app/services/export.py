@@ -0,0 +1,83 @@
+# Streaming lead exports (CSV, JSONL, Parquet)
+
+import csv
+import io
+import json
+import os
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from app.services.lead_store import get_store
+
+# Rows read from the lead store (and written as one Parquet row group) per chunk
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "1000"))
+
+FORMATS = {
+    "csv": "text/csv",
+    "jsonl": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def _chunks(fields: List[str], filters: Optional[Dict[str, str]]) -> Iterator[List[Tuple]]:
+    return get_store().iter_chunks(fields, filters, chunk_size=EXPORT_CHUNK_ROWS)
+
+
+def iter_csv(fields: List[str], filters: Optional[Dict[str, str]] = None) -> Iterator[bytes]:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(fields)
+    for chunk in _chunks(fields, filters):
+        writer.writerows(chunk)
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+
+def iter_jsonl(fields: List[str], filters: Optional[Dict[str, str]] = None) -> Iterator[bytes]:
+    for chunk in _chunks(fields, filters):
+        yield "".join(
+            json.dumps(dict(zip(fields, row)), ensure_ascii=False) + "\n" for row in chunk
+        ).encode("utf-8")
+
+
+class _Drain(io.RawIOBase):
+    """Write-only sink whose bytes are taken out after every Parquet row group."""
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+        self._pos = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def take(self) -> bytes:
+        data, self._parts = b"".join(self._parts), []
+        return data
+
+
+def iter_parquet(fields: List[str], filters: Optional[Dict[str, str]] = None) -> Iterator[bytes]:
+    """One Parquet row group per chunk; raises ImportError without pyarrow."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([(f, pa.string()) for f in fields])
+    sink = _Drain()
+    with pq.ParquetWriter(sink, schema, compression="snappy") as writer:
+        for chunk in _chunks(fields, filters):
+            columns = list(zip(*chunk))
+            writer.write_table(pa.Table.from_arrays([pa.array(c, pa.string()) for c in columns], schema=schema))
+            yield sink.take()
+    yield sink.take()
+
+
+WRITERS = {"csv": iter_csv, "jsonl": iter_jsonl, "parquet": iter_parquet}
@@ -0,0 +1,475 @@
+# Local durable lead store, replicated to Google Sheets in the background
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from app.models.lead import COLUMNS
+from app.services import sheets
+
+DATA_DIR = os.getenv("DATA_DIR", "data")
+LEAD_STORE_PATH = os.getenv("LEAD_STORE_PATH", os.path.join(DATA_DIR, "leads.sqlite3"))
+# Set to false to keep leads local only (no Sheets replication)
+SHEETS_SYNC = os.getenv("SHEETS_SYNC", "true").lower() in ("1", "true", "yes")
+# /leads query results are cached this many seconds (and dropped as soon as a lead changes)
+LEADS_CACHE_TTL = float(os.getenv("LEADS_CACHE_TTL", "5"))
+LEADS_CACHE_MAX_ENTRIES = 256
+
+# Columns /leads can filter on (case-insensitive substring match)
+FILTER_FIELDS = ("name", "address", "email")
+
+PENDING, SYNCED = "pending", "synced"
+# Outcomes of LeadStore.upsert
+INSERTED, UPDATED, UNCHANGED = "inserted", "updated", "unchanged"
+
+# Replicator backoff after a failed batch: 5s, 10s, 20s ... capped
+SYNC_BACKOFF_BASE = 5.0
+SYNC_BACKOFF_MAX = 300.0
+
+
+class LeadStore:
+    """
+    The system of record for leads: a SQLite table in WAL mode, written
+    synchronously by the agent. Each row carries its Sheets sync state, so
+    replication can lag or fail without losing or duplicating anything.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # Bumped on every insert/update so readers can tell when leads changed;
+        # the epoch keeps versions from different processes apart
+        self.version = 0
+        self.epoch = f"{time.time():.6f}"
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS leads ("
+            " uuid TEXT PRIMARY KEY,"
+            " name TEXT NOT NULL DEFAULT '',"
+            " address TEXT NOT NULL DEFAULT '',"
+            " phone TEXT NOT NULL DEFAULT '',"
+            " website TEXT NOT NULL DEFAULT '',"
+            " email TEXT NOT NULL DEFAULT '',"
+            " created_at REAL NOT NULL,"
+            " sync_state TEXT NOT NULL DEFAULT 'pending',"
+            " sync_attempts INTEGER NOT NULL DEFAULT 0,"
+            " sync_error TEXT,"
+            " synced_at REAL)"
+        )
+        # Element location, used by dedup blocking; not part of the sheet
+        present = {r[1] for r in self._conn.execute("PRAGMA table_info(leads)")}
+        for column in ("lat", "lon"):
+            if column not in present:
+                self._conn.execute(f"ALTER TABLE leads ADD COLUMN {column} REAL")
+        # Bumped on every change, so a sync only marks the revision it wrote
+        if "revision" not in present:
+            self._conn.execute("ALTER TABLE leads ADD COLUMN revision INTEGER NOT NULL DEFAULT 0")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS leads_sync ON leads (sync_state)")
+        self._conn.commit()
+
+    def upsert(self, row: List[str], lat: Optional[float] = None, lon: Optional[float] = None) -> str:
+        """
+        Store one lead row (in COLUMNS order) keyed by its uuid. New and
+        changed rows become pending replication; identical rows are left
+        alone, so re-harvesting an area costs no Sheets writes. ``lat`` and
+        ``lon`` are kept alongside but do not count as a change.
+        """
+        row = [str(v) for v in row[:len(COLUMNS)]]
+        with self._lock:
+            current = self._conn.execute(
+                f"SELECT {', '.join(COLUMNS[1:])} FROM leads WHERE uuid = ?", (row[0],)
+            ).fetchone()
+            if current is None:
+                self._conn.execute(
+                    f"INSERT INTO leads ({', '.join(COLUMNS)}, created_at, lat, lon) "
+                    f"VALUES ({', '.join('?' * (len(COLUMNS) + 3))})",
+                    [*row, time.time(), lat, lon],
+                )
+                outcome = INSERTED
+            elif list(current) == row[1:]:
+                if lat is not None and lon is not None:
+                    self._conn.execute(
+                        "UPDATE leads SET lat = ?, lon = ? WHERE uuid = ? AND lat IS NULL",
+                        (lat, lon, row[0]),
+                    )
+                    self._conn.commit()
+                return UNCHANGED
+            else:
+                self._conn.execute(
+                    f"UPDATE leads SET {', '.join(f'{c} = ?' for c in COLUMNS[1:])},"
+                    " lat = COALESCE(?, lat), lon = COALESCE(?, lon), revision = revision + 1,"
+                    " sync_state = ?, sync_error = NULL WHERE uuid = ?",
+                    [*row[1:], lat, lon, PENDING, row[0]],
+                )
+                outcome = UPDATED
+            self._conn.commit()
+            self.version += 1
+        return outcome
+
+    def exists(self, uuid: str) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM leads WHERE uuid = ?", (uuid,)).fetchone() is not None
+
+    def pending(self, limit: int) -> List[Tuple[List[str], int]]:
+        """Oldest rows not yet replicated, as ``(sheet row, revision)`` pairs."""
+        with self._lock:
+            return [(list(r[:-1]), r[-1]) for r in self._conn.execute(
+                f"SELECT {', '.join(COLUMNS)}, revision FROM leads WHERE sync_state = ? "
+                "ORDER BY rowid LIMIT ?",
+                (PENDING, limit),
+            )]
+
+    def mark_synced(self, revisions: List[Tuple[str, int]]) -> int:
+        """
+        Mark ``(uuid, revision)`` pairs as replicated. A lead changed since
+        its revision was read stays pending, so the newer values get written
+        too. Returns how many leads were marked.
+        """
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "UPDATE leads SET sync_state = ?, sync_error = NULL, synced_at = ?,"
+                " sync_attempts = sync_attempts + 1 WHERE uuid = ? AND revision = ?",
+                [(SYNCED, time.time(), i, rev) for i, rev in revisions],
+            )
+            self._conn.commit()
+            return self._conn.total_changes - before
+
+    def mark_failed(self, ids: List[str], error: str) -> None:
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE leads SET sync_error = ?, sync_attempts = sync_attempts + 1 WHERE uuid = ?",
+                [(error[:500], i) for i in ids],
+            )
+            self._conn.commit()
+
+    def all(self) -> List[Dict]:
+        """Every lead, oldest first, with keys matching the sheet headers."""
+        return self.query()[1]
+
+    def query(self, offset: int = 0, limit: Optional[int] = None,
+              fields: Optional[List[str]] = None,
+              filters: Optional[Dict[str, str]] = None) -> Tuple[int, List[Dict]]:
+        """
+        One page of leads, oldest first, plus the total number matching
+        ``filters`` (column → substring, case-insensitive). ``fields``
+        projects the returned records onto a subset of COLUMNS.
+        """
+        fields = list(fields or COLUMNS)
+        where, args = self._where(filters)
+        clause = f" WHERE {' AND '.join(where)}" if where else ""
+        with self._lock:
+            total = self._conn.execute(f"SELECT COUNT(*) FROM leads{clause}", args).fetchone()[0]
+            rows = self._conn.execute(
+                f"SELECT {', '.join(fields)} FROM leads{clause} ORDER BY rowid LIMIT ? OFFSET ?",
+                [*args, -1 if limit is None else limit, offset],
+            ).fetchall()
+        return total, [dict(zip(fields, r)) for r in rows]
+
+    def iter_chunks(self, fields: Optional[List[str]] = None,
+                    filters: Optional[Dict[str, str]] = None,
+                    chunk_size: int = 1000) -> Iterator[List[Tuple]]:
+        """
+        Yield matching rows (tuples in ``fields`` order) in chunks, paging by
+        rowid so the lock is only held per chunk and memory stays flat no
+        matter how many leads there are.
+        """
+        fields = list(fields or COLUMNS)
+        where, args = self._where(filters)
+        clause = " AND ".join(["rowid > ?", *where])
+        last = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT rowid, {', '.join(fields)} FROM leads WHERE {clause} ORDER BY rowid LIMIT ?",
+                    [last, *args, chunk_size],
+                ).fetchall()
+            if not rows:
+                return
+            last = rows[-1][0]
+            yield [r[1:] for r in rows]
+
+    @staticmethod
+    def _where(filters: Optional[Dict[str, str]]) -> Tuple[List[str], List[str]]:
+        where, args = [], []
+        for column, needle in (filters or {}).items():
+            if needle:
+                where.append(f"instr(lower({column}), ?) > 0")
+                args.append(needle.lower())
+        return where, args
+
+    def stats(self) -> Dict:
+        with self._lock:
+            counts = dict(self._conn.execute(
+                "SELECT sync_state, COUNT(*) FROM leads GROUP BY sync_state"
+            ).fetchall())
+            oldest = self._conn.execute(
+                "SELECT MIN(created_at) FROM leads WHERE sync_state = ?", (PENDING,)
+            ).fetchone()[0]
+        return {
+            "leads": sum(counts.values()),
+            "pending": counts.get(PENDING, 0),
+            "synced": counts.get(SYNCED, 0),
+            "oldest_pending_s": round(time.time() - oldest, 1) if oldest else 0.0,
+        }
+
+    def summary(self, max_groups: int = 50) -> Dict:
+        """
+        Lead counts for the dashboard, computed in SQL so the UI never pulls
+        the whole table: distinct names and emails, and the emails shared by
+        more than one lead (largest ``max_groups`` groups listed).
+        """
+        with self._lock:
+            total, names, emails = self._conn.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT NULLIF(name, '')),"
+                " COUNT(DISTINCT NULLIF(email, '')) FROM leads"
+            ).fetchone()
+            groups, extra = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(n - 1), 0) FROM ("
+                " SELECT COUNT(*) AS n FROM leads WHERE email != ''"
+                " GROUP BY email HAVING n > 1)"
+            ).fetchone()
+            top = self._conn.execute(
+                "SELECT email, COUNT(*) AS n FROM leads WHERE email != ''"
+                " GROUP BY email HAVING n > 1 ORDER BY n DESC, email LIMIT ?",
+                (max_groups,),
+            ).fetchall()
+        return {
+            "leads": total,
+            "unique_names": names,
+            "unique_emails": emails,
+            "duplicate_groups": groups,
+            "duplicate_rows": extra,
+            "duplicate_emails": [{"email": e, "count": n} for e, n in top],
+        }
+
+
+class SheetsReplicator:
+    """
+    Background thread that drains pending leads to Google Sheets in batches
+    of ``batch_size``. It wakes every ``interval`` seconds, or early once a
+    full batch is waiting. When Sheets is down or over quota it backs off and
+    retries later; the agent never waits on it.
+
+    Rows already in the sheet are overwritten in place and new ones appended,
+    using a uuid → row index read from the sheet once per run.
+    """
+
+    def __init__(self, store: LeadStore, batch_size: int = sheets.SHEETS_BATCH_SIZE,
+                 interval: float = sheets.SHEETS_FLUSH_INTERVAL, sheet=None):
+        self.store = store
+        # None writes to the shared worksheet; benchmarks pass a stand-in
+        self.sheet = sheet
+        self.batch_size = max(1, batch_size)
+        self.interval = max(0.1, interval)
+        self.rows_synced = 0
+        self.rows_appended = 0
+        self.rows_updated = 0
+        self.batches = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        self.last_sync: Optional[float] = None
+        self._new = 0
+        self._failed_in_row = 0
+        self._index: Optional[Dict[str, int]] = None
+        self._used_rows = 0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._sync_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sheets-sync", daemon=True)
+        self._thread.start()
+
+    def notify(self, n: int = 1) -> None:
+        """Tell the replicator ``n`` rows were added; wakes it once a batch is full."""
+        self._new += n
+        if self._new >= self.batch_size and not self._failed_in_row:
+            self.wake()
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def reset_index(self) -> None:
+        """Re-read the sheet's uuid → row index on the next sync."""
+        self._index = None
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Stop the thread after one last drain attempt."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            delay = self.interval
+            if self._failed_in_row:
+                delay = min(SYNC_BACKOFF_MAX, SYNC_BACKOFF_BASE * 2 ** (self._failed_in_row - 1))
+            self._wake.wait(delay)
+            self._wake.clear()
+            self.sync()
+        self.sync()
+
+    def sync(self) -> int:
+        """Replicate every pending row now; returns how many rows were written."""
+        written = 0
+        with self._sync_lock:
+            self._new = 0
+            while True:
+                batch = self.store.pending(self.batch_size)
+                if not batch:
+                    break
+                rows = [row for row, _ in batch]
+                ids = [r[0] for r in rows]
+                try:
+                    if self._index is None:
+                        self._index, self._used_rows = sheets.read_row_index(self.sheet)
+                    updates = {self._index[r[0]]: r for r in rows if r[0] in self._index}
+                    appends = [r for r in rows if r[0] not in self._index]
+                    sheets.update_rows(updates, self.sheet)
+                    sheets.append_rows(appends, self.sheet)
+                except Exception as e:
+                    # The sheet may have partly changed; re-read the index on retry
+                    self._index = None
+                    self.failures += 1
+                    self._failed_in_row += 1
+                    self.last_error = str(e)
+                    self.store.mark_failed(ids, str(e))
+                    print(f"⚠️ Sheets sync failed, {len(rows)}+ leads kept locally: {e}")
+                    break
+                for r in appends:
+                    self._used_rows += 1
+                    self._index[r[0]] = self._used_rows
+                self.store.mark_synced([(row[0], rev) for row, rev in batch])
+                self.rows_updated += len(updates)
+                self.rows_appended += len(appends)
+                self._failed_in_row = 0
+                self.batches += 1
+                self.rows_synced += len(rows)
+                self.last_sync = time.time()
+                written += len(rows)
+        if written:
+            print(f"🔄 Synced {written} leads to Google Sheets")
+        return written
+
+    def stats(self) -> Dict:
+        return {
+            "running": bool(self._thread and self._thread.is_alive()),
+            "batch_size": self.batch_size,
+            "interval_s": self.interval,
+            "rows_synced": self.rows_synced,
+            "rows_appended": self.rows_appended,
+            "rows_updated": self.rows_updated,
+            "batches": self.batches,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "last_sync": self.last_sync,
+        }
+
+
+_store: Optional[LeadStore] = None
+_replicator: Optional[SheetsReplicator] = None
+_init_lock = threading.Lock()
+
+
+def get_store() -> LeadStore:
+    global _store
+    if _store is None:
+        with _init_lock:
+            if _store is None:
+                _store = LeadStore(LEAD_STORE_PATH)
+    return _store
+
+
+def store_opened() -> bool:
+    return _store is not None
+
+
+def get_replicator() -> Optional[SheetsReplicator]:
+    """The running replicator, started on first use; None if SHEETS_SYNC is off."""
+    global _replicator
+    if not SHEETS_SYNC:
+        return None
+    if _replicator is None:
+        store = get_store()
+        with _init_lock:
+            if _replicator is None:
+                _replicator = SheetsReplicator(store)
+                _replicator.start()
+    return _replicator
+
+
+def save_lead(row: List[str], lat: Optional[float] = None, lon: Optional[float] = None) -> str:
+    """Upsert a lead locally and schedule it for replication if it changed."""
+    outcome = get_store().upsert(row, lat, lon)
+    if outcome != UNCHANGED:
+        replicator = get_replicator()
+        if replicator is not None:
+            replicator.notify()
+    return outcome
+
+
+_query_cache: "OrderedDict[str, Tuple]" = OrderedDict()
+_query_cache_lock = threading.Lock()
+
+
+def leads_etag(**params) -> str:
+    """ETag for a /leads query: changes whenever any lead or the query changes."""
+    store = get_store()
+    blob = json.dumps([store.epoch, store.version, params], sort_keys=True)
+    return '"' + hashlib.sha1(blob.encode("utf-8")).hexdigest() + '"'
+
+
+def query_leads(offset: int = 0, limit: Optional[int] = None,
+                fields: Optional[List[str]] = None,
+                filters: Optional[Dict[str, str]] = None) -> Tuple[int, List[Dict]]:
+    """``LeadStore.query`` behind a short-TTL cache that a lead write invalidates."""
+    store = get_store()
+    key = json.dumps([offset, limit, fields, filters], sort_keys=True)
+    now = time.monotonic()
+    with _query_cache_lock:
+        hit = _query_cache.get(key)
+        if hit and hit[0] == store.version and now - hit[1] < LEADS_CACHE_TTL:
+            _query_cache.move_to_end(key)
+            return hit[2]
+    version = store.version
+    result = store.query(offset, limit, fields, filters)
+    with _query_cache_lock:
+        _query_cache[key] = (version, now, result)
+        _query_cache.move_to_end(key)
+        while len(_query_cache) > LEADS_CACHE_MAX_ENTRIES:
+            _query_cache.popitem(last=False)
+    return result
+
+
+def lead_summary() -> Dict:
+    return get_store().summary()
+
+
+def shutdown(timeout: float = 10.0) -> None:
+    """Stop the replicator after a final attempt to push pending leads."""
+    if _replicator is not None:
+        _replicator.stop(timeout)
+
+
+def store_stats() -> Dict:
+    replicator = _replicator
+    return {
+        **get_store().stats(),
+        "replicator": replicator.stats() if replicator else None,
+    }
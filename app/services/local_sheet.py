@@ -0,0 +1,115 @@
+# Local stand-in for a Google Sheets worksheet
+
+import csv
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+
+class QuotaExceeded(Exception):
+    """Raised like a Sheets API 429 when the simulated write quota is used up."""
+
+    status_code = 429
+
+
+class LocalWorksheet:
+    """
+    Offline substitute for ``gspread.Worksheet`` covering the calls this app
+    makes. Rows live in a CSV file (or only in memory with ``path=None``).
+
+    ``latency`` adds a fixed delay per API call and ``quota_per_minute``
+    rejects calls beyond that rate, so throughput and retry behaviour can be
+    measured without a Google account.
+    """
+
+    def __init__(self, path: Optional[str] = None, header: Optional[List[str]] = None,
+                 latency: float = 0.0, quota_per_minute: int = 0):
+        self.path = path
+        self.latency = latency
+        self.quota_per_minute = quota_per_minute
+        self.calls = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._recent = deque()
+        self._rows: List[List[str]] = []
+        if path and os.path.exists(path):
+            with open(path, newline="", encoding="utf-8") as f:
+                self._rows = [row for row in csv.reader(f)]
+        if not self._rows:
+            self._rows = [list(header or ["uuid", "name", "address", "phone", "website", "email"])]
+            self._save()
+
+    def _api_call(self) -> None:
+        # Simulate one round trip: quota check, then network latency
+        with self._lock:
+            now = time.monotonic()
+            while self._recent and now - self._recent[0] > 60:
+                self._recent.popleft()
+            if self.quota_per_minute and len(self._recent) >= self.quota_per_minute:
+                self.rejected += 1
+                raise QuotaExceeded("Quota exceeded for 'Write requests per minute'")
+            self._recent.append(now)
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _save(self) -> None:
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerows(self._rows)
+        os.replace(tmp, self.path)
+
+    def append_row(self, values: List, value_input_option: str = "RAW") -> Dict:
+        return self.append_rows([values], value_input_option=value_input_option)
+
+    def append_rows(self, values: List[List], value_input_option: str = "RAW") -> Dict:
+        self._api_call()
+        with self._lock:
+            self._rows.extend([["" if v is None else str(v) for v in row] for row in values])
+            self._save()
+        return {"updates": {"updatedRows": len(values)}}
+
+    def batch_update(self, data: List[Dict], value_input_option: str = "RAW") -> Dict:
+        """Write each ``{"range": "A5:F5", "values": [[...]]}`` block; ranges start in column A."""
+        self._api_call()
+        updated = 0
+        with self._lock:
+            for block in data:
+                start = int(re.match(r"[A-Z]+(\d+)", block["range"]).group(1))
+                for offset, values in enumerate(block["values"]):
+                    n = start - 1 + offset
+                    while len(self._rows) <= n:
+                        self._rows.append([])
+                    self._rows[n] = ["" if v is None else str(v) for v in values]
+                    updated += 1
+            self._save()
+        return {"totalUpdatedRows": updated}
+
+    def col_values(self, col: int) -> List[str]:
+        self._api_call()
+        with self._lock:
+            values = [row[col - 1] if len(row) >= col else "" for row in self._rows]
+        # Like the Sheets API, trailing empty cells are not returned
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+    def get_all_values(self) -> List[List[str]]:
+        self._api_call()
+        with self._lock:
+            return [list(row) for row in self._rows]
+
+    def get_all_records(self) -> List[Dict]:
+        rows = self.get_all_values()
+        if not rows:
+            return []
+        header = rows[0]
+        return [dict(zip(header, row + [""] * (len(header) - len(row)))) for row in rows[1:]]
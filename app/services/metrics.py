@@ -0,0 +1,271 @@
+# Metrics - counters, gauges and latency histograms in the Prometheus text format
+
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Set to false to turn every metric update into a no-op
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Seconds; wide enough for a cache hit and for a slow Overpass query
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_local = threading.local()
+
+
+def set_job(job_id: Optional[str]) -> None:
+    """Label metrics recorded on this thread with ``job_id`` (None clears it)."""
+    _local.job = job_id or ""
+
+
+def current_job() -> str:
+    return getattr(_local, "job", "")
+
+
+def bound(fn: Callable) -> Callable:
+    """Wrap ``fn`` so it records under the calling thread's job on whichever thread runs it."""
+    job = current_job()
+
+    def run(*args, **kwargs):
+        set_job(job)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            set_job(None)
+
+    return run
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._values: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _key(self, labels: Dict) -> Tuple[str, ...]:
+        # A "job" label left out is taken from the recording thread
+        if "job" in self.labelnames and "job" not in labels:
+            labels["job"] = current_job()
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def forget(self, label: str, value: str) -> None:
+        """Drop every series whose ``label`` equals ``value`` (e.g. a pruned job)."""
+        if label not in self.labelnames:
+            return
+        pos = self.labelnames.index(label)
+        with self._lock:
+            for key in [k for k in self._values if k[pos] == value]:
+                del self._values[key]
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = self.samples()
+        if not lines:
+            return []
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *lines]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, n: float = 1, **labels) -> None:
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + n
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, n: float = 1, **labels) -> None:
+        self.inc(-n, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    @contextmanager
+    def track(self, **labels):
+        """Count the enclosed block as in flight."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    """
+    Fixed-bucket histogram. An observation is one bisect and a few additions
+    under the metric's lock; buckets are made cumulative only when rendered.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labels)
+
+    def observe(self, value: float, **labels) -> None:
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket counts (last one is +Inf), then sum and count
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            state[slot] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe how long the enclosed block took, whether or not it raised."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return state[-1] if state else 0
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        lines = []
+        for key, state in items:
+            cumulative = 0
+            for bound_, n in zip((*self.buckets, float("inf")), state):
+                cumulative += n
+                le = f'le="{_format_value(bound_)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(round(state[-2], 6))}")
+            lines.append(f"{self.name}_count{labels} {state[-1]}")
+        return lines
+
+
+@contextmanager
+def instrument(histogram: Histogram, in_flight: Optional[Gauge] = None,
+               errors: Optional[Counter] = None, **labels):
+    """Time a call into ``histogram``, count it in flight meanwhile, and count it in ``errors`` if it raises."""
+    if "job" not in labels:
+        labels["job"] = current_job()
+    if in_flight is not None:
+        in_flight.inc()
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        if errors is not None:
+            errors.inc(**labels)
+        raise
+    finally:
+        histogram.observe(time.perf_counter() - started, **labels)
+        if in_flight is not None:
+            in_flight.dec()
+
+
+# Families computed when scraped: (name, type, help, [(labels, value), ...])
+Family = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], Iterable[Family]]] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> None:
+        with self._lock:
+            self._metrics.append(metric)
+
+    def add_collector(self, collector: Callable[[], Iterable[Family]]) -> None:
+        """Register a callable producing gauge-like families from existing stats on each scrape."""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def forget(self, label: str, value: str) -> None:
+        for metric in list(self._metrics):
+            metric.forget(label, value)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in list(self._metrics):
+            lines.extend(metric.render())
+        for collector in list(self._collectors):
+            try:
+                families = list(collector())
+            except Exception as e:
+                print(f"⚠️ Metrics collector {getattr(collector, '__name__', collector)} failed: {e}")
+                continue
+            for name, kind, help, samples in families:
+                if not samples:
+                    continue
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(list(labels), list(labels.values()))} "
+                                 f"{_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+def forget_job(job_id: str) -> None:
+    """Drop a job's series once it leaves the job history, so labels stay bounded."""
+    REGISTRY.forget("job", job_id)
@@ -1,44 +1,151 @@
 # Google Sheets service
 
-import gspread
-from google.oauth2.service_account import Credentials
 import os
+import random
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout
+
+from app.services.local_sheet import LocalWorksheet
+from app.services.metrics import Counter, Gauge, Histogram
 
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
 
 SPREADSHEET_ID = "1DBZB2XmLUcYEprwXd0eJaxpIP-CB850jnRNpipZSPR8"
 
-def get_sheet():
+DATA_DIR = os.getenv("DATA_DIR", "data")
+# "google" writes to the real spreadsheet; "local" uses a CSV-backed stand-in
+SHEETS_BACKEND = os.getenv("SHEETS_BACKEND", "google").lower()
+LOCAL_SHEET_PATH = os.getenv("LOCAL_SHEET_PATH", os.path.join(DATA_DIR, "local_sheet.csv"))
+# Simulated per-call latency (seconds) and write quota (calls/minute, 0 = none) of the local sheet
+SHEETS_LOCAL_LATENCY = float(os.getenv("SHEETS_LOCAL_LATENCY", "0"))
+SHEETS_LOCAL_QUOTA = int(os.getenv("SHEETS_LOCAL_QUOTA", "0"))
+# The replicator writes pending leads with one call per this many rows...
+SHEETS_BATCH_SIZE = int(os.getenv("SHEETS_BATCH_SIZE", "50"))
+# ...and wakes at least this often to look for pending leads
+SHEETS_FLUSH_INTERVAL = float(os.getenv("SHEETS_FLUSH_INTERVAL", "5"))
+SHEETS_RETRIES = int(os.getenv("SHEETS_RETRIES", "5"))
+
+# Backoff for quota / server errors: 1s, 2s, 4s ... capped, plus jitter
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 64.0
+
+SHEETS_SECONDS = Histogram("sheets_request_seconds", "Google Sheets API call time, per attempt", ["op"])
+SHEETS_IN_FLIGHT = Gauge("sheets_in_flight", "Google Sheets API calls in progress")
+SHEETS_RETRIES_TOTAL = Counter("sheets_retries_total", "Google Sheets API calls retried after a quota or server error", ["op"])
+SHEETS_ERRORS = Counter("sheets_errors_total", "Google Sheets API calls that failed for good", ["op"])
+
+_sheet = None
+_sheet_lock = threading.Lock()
+
+
+def _open_sheet():
+    if SHEETS_BACKEND == "local":
+        print(f"📄 Using local sheet at {LOCAL_SHEET_PATH}")
+        return LocalWorksheet(
+            LOCAL_SHEET_PATH, latency=SHEETS_LOCAL_LATENCY, quota_per_minute=SHEETS_LOCAL_QUOTA
+        )
+
+    # Imported here: gspread and google-auth are only needed for the real sheet
+    import gspread
+    from google.oauth2.service_account import Credentials
+
     creds_path = os.path.join(os.path.dirname(__file__), "..", "..", "credentials.json")
     if not os.path.exists(creds_path):
         creds_path = "credentials.json"
-    
+
     if not os.path.exists(creds_path):
         raise FileNotFoundError(f"credentials.json not found at {creds_path}")
-    
+
     creds = Credentials.from_service_account_file(
         creds_path,
         scopes=SCOPES
     )
     client = gspread.authorize(creds)
-    sheet = client.open_by_key(SPREADSHEET_ID).sheet1
-    return sheet
+    return client.open_by_key(SPREADSHEET_ID).sheet1
+
+
+def get_sheet():
+    """
+    The worksheet, authorized and opened once per process. gspread refreshes
+    the service-account token itself, so the handle stays valid.
+    """
+    global _sheet
+    if _sheet is None:
+        with _sheet_lock:
+            if _sheet is None:
+                _sheet = _open_sheet()
+    return _sheet
+
+
+def sheet_opened() -> bool:
+    return _sheet is not None
+
+
+def _retryable(err: Exception) -> bool:
+    # gspread.APIError carries the HTTP response; the local sheet sets status_code
+    response = getattr(err, "response", None)
+    status = getattr(response, "status_code", None) or getattr(err, "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    return isinstance(err, (RequestsConnectionError, Timeout))
+
+
+def _with_backoff(call, retries: int = SHEETS_RETRIES, op: str = "call"):
+    attempt = 0
+    while True:
+        try:
+            with SHEETS_IN_FLIGHT.track(), SHEETS_SECONDS.time(op=op):
+                return call()
+        except Exception as e:
+            if attempt >= retries or not _retryable(e):
+                SHEETS_ERRORS.inc(op=op)
+                raise
+            delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)) + random.uniform(0, 1)
+            attempt += 1
+            SHEETS_RETRIES_TOTAL.inc(op=op)
+            print(f"⏳ Sheets API busy ({e}); retry {attempt}/{retries} in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def append_rows(rows: List[List], sheet=None) -> None:
+    """
+    Write rows right away in one call, retrying quota errors; raises on
+    failure. ``sheet`` overrides the shared worksheet (benchmarks, tests).
+    """
+    if rows:
+        sheet = sheet if sheet is not None else get_sheet()
+        _with_backoff(lambda: sheet.append_rows(rows, value_input_option="RAW"), op="append")
+
+
+def read_row_index(sheet=None) -> Tuple[Dict[str, int], int]:
+    """
+    Map lead uuid → 1-based sheet row from a single read of the uuid column.
+    Also returns the number of used rows, so new rows can be numbered.
+    """
+    sheet = sheet if sheet is not None else get_sheet()
+    ids = _with_backoff(lambda: sheet.col_values(1), op="read_index")
+    return {value: n for n, value in enumerate(ids, start=1) if n > 1 and value}, len(ids)
+
+
+def update_rows(rows: Dict[int, List], sheet=None) -> None:
+    """Overwrite whole rows (1-based row number → values) in one batch_update call."""
+    if not rows:
+        return
+    sheet = sheet if sheet is not None else get_sheet()
+    data = [
+        {"range": f"A{n}:{chr(ord('A') + len(row) - 1)}{n}", "values": [row]}
+        for n, row in rows.items()
+    ]
+    _with_backoff(lambda: sheet.batch_update(data, value_input_option="RAW"), op="update")
 
-def append_row(row):
-    try:
-        sheet = get_sheet()
-        sheet.append_row(row)
-        print(f"✅ Successfully appended row to Google Sheets: {row[1] if len(row) > 1 else 'N/A'}")
-        return True
-    except Exception as e:
-        print(f"❌ Error appending row to Google Sheets: {e}")
-        print(f"   Row data: {row}")
-        raise
 
 def read_all():
     try:
         sheet = get_sheet()
-        return sheet.get_all_records()
+        return _with_backoff(sheet.get_all_records, op="read")
     except Exception as e:
         print(f"❌ Error reading from Google Sheets: {e}")
         return []
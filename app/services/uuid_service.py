@@ -1,2 +1,26 @@
 # UUID service
 
+import uuid
+from typing import Dict
+
+# Fixed namespace: the same OSM element always maps to the same lead id
+LEAD_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "https://www.openstreetmap.org/")
+
+
+def osm_lead_id(osm_type: str, osm_id) -> str:
+    """Deterministic UUIDv5 for an OSM element, e.g. ("node", 123)."""
+    return str(uuid.uuid5(LEAD_NAMESPACE, f"{osm_type}/{osm_id}"))
+
+
+def lead_id(lead: Dict) -> str:
+    """
+    Id for an enriched lead: from its OSM identity ("type/id" under ``osm``)
+    when known, otherwise from its normalized name and address so it is still
+    stable across runs.
+    """
+    osm = lead.get("osm")
+    if osm and "/" in osm:
+        osm_type, osm_id = osm.split("/", 1)
+        return osm_lead_id(osm_type, osm_id)
+    key = "|".join(" ".join(str(lead.get(f) or "").lower().split()) for f in ("name", "address"))
+    return str(uuid.uuid5(LEAD_NAMESPACE, f"lead/{key}"))
@@ -0,0 +1,80 @@
+# Background warm-up of the heavy components and readiness reporting
+
+import os
+import sys
+import threading
+import time
+from typing import Dict, Optional
+
+from app.memory.vector_store import get_index, index_loaded, model_loaded
+from app.services.lead_store import SHEETS_SYNC, get_store, store_opened
+from app.services.sheets import get_sheet, sheet_opened
+
+# Load the lead store, embedding model, dedup index and Sheets handle in a
+# background thread at startup instead of on the first run
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+
+_state = {"status": "idle", "started_at": None, "finished_at": None, "errors": {}}
+_thread: Optional[threading.Thread] = None
+_lock = threading.Lock()
+
+
+def _warm() -> None:
+    steps = [("lead_store", get_store), ("dedup_index", get_index)]
+    if SHEETS_SYNC:
+        steps.append(("sheets", get_sheet))
+    for name, load in steps:
+        try:
+            load()
+        except Exception as e:
+            # A component that fails here is retried on first use as before
+            _state["errors"][name] = str(e)
+            print(f"⚠️ Warm-up of {name} failed: {e}")
+    _state["finished_at"] = time.time()
+    _state["status"] = "done"
+    print(f"🔥 Warm-up finished in {_state['finished_at'] - _state['started_at']:.1f}s")
+
+
+def start_warmup() -> bool:
+    """Start the warm-up thread once; False if it already ran or is running."""
+    global _thread
+    with _lock:
+        if _thread is not None:
+            return False
+        _state.update(status="running", started_at=time.time())
+        _thread = threading.Thread(target=_warm, name="warmup", daemon=True)
+        _thread.start()
+    return True
+
+
+def _rss_mb() -> Optional[float]:
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return round(pages * os.sysconf("SC_PAGE_SIZE") / 2 ** 20, 1)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def components() -> Dict[str, bool]:
+    """Which of the lazily loaded components are in memory right now."""
+    return {
+        "lead_store": store_opened(),
+        "embedding_model": model_loaded(),
+        "faiss": "faiss" in sys.modules,
+        "dedup_index": index_loaded(),
+        "sheets": sheet_opened(),
+    }
+
+
+def readiness() -> Dict:
+    """
+    Ready once the warm-up has finished (or right away when it is disabled,
+    in which case components load on first use).
+    """
+    return {
+        "ready": _state["status"] == "done" or not WARMUP_ON_STARTUP,
+        "warmup": {**_state, "errors": dict(_state["errors"])},
+        "components": components(),
+        "rss_mb": _rss_mb(),
+    }
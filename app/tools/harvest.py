@@ -0,0 +1,324 @@
+# Tile-split parallel Overpass harvesting across mirrors
+
+import math
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Tuple
+
+import requests
+from requests.exceptions import RequestException
+
+from app.agent.jobs import RESOURCES, FairLimiter
+from app.services.metrics import bound, current_job
+from app.tools.overpass import (
+    HEADERS,
+    OVERPASS_ERRORS,
+    OVERPASS_IN_FLIGHT,
+    OVERPASS_RETRIES,
+    OVERPASS_SECONDS,
+    OVERPASS_URL,
+    _parse_query,
+    resolve_area,
+    search,
+)
+from app.tools.overpass_cache import response_cache
+
+# Comma-separated Overpass endpoints to spread tiles over
+OVERPASS_MIRRORS = [
+    url.strip() for url in os.getenv("OVERPASS_MIRRORS", OVERPASS_URL).split(",") if url.strip()
+]
+# Per-mirror limits: concurrent requests and minimum seconds between request starts
+OVERPASS_MIRROR_SLOTS = int(os.getenv("OVERPASS_MIRROR_SLOTS", "2"))
+OVERPASS_MIRROR_INTERVAL = float(os.getenv("OVERPASS_MIRROR_INTERVAL", "1.0"))
+# Starting tile edge in degrees; tiles that time out or hit the cap are split in four
+HARVEST_TILE_DEG = float(os.getenv("HARVEST_TILE_DEG", "0.5"))
+HARVEST_TILE_CAP = int(os.getenv("HARVEST_TILE_CAP", "2000"))
+HARVEST_TILE_TIMEOUT = int(os.getenv("HARVEST_TILE_TIMEOUT", "60"))
+HARVEST_MAX_DEPTH = int(os.getenv("HARVEST_MAX_DEPTH", "6"))
+HARVEST_RETRIES = int(os.getenv("HARVEST_RETRIES", "3"))
+
+# Seconds a mirror is left alone after answering 429 Too Many Requests
+THROTTLE_COOLDOWN = 30.0
+
+
+class Mirror:
+    def __init__(self, url: str, slots: int, interval: float):
+        self.url = url
+        self.slots = max(1, slots)
+        self.interval = interval
+        self.in_flight = 0
+        self.next_start = 0.0
+        self.cooldown_until = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+        self.elements = 0
+
+    def ready_at(self) -> float:
+        return max(self.next_start, self.cooldown_until)
+
+    def stats(self) -> Dict:
+        return {
+            "url": self.url,
+            "requests": self.requests,
+            "errors": self.errors,
+            "throttled": self.throttled,
+            "elements": self.elements,
+        }
+
+
+_limiters: Dict[Tuple[str, ...], FairLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def _fair_limiter(urls: List[str], capacity: int) -> FairLimiter:
+    """
+    The slots every job's harvest shares on one set of mirrors, as many as
+    the mirrors take at once and handed to waiting jobs in turn.
+    """
+    key = tuple(urls)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = _limiters[key] = FairLimiter("harvest", capacity)
+            if list(key) == OVERPASS_MIRRORS:
+                # Listed with the other shared resources in /jobs stats
+                RESOURCES["harvest"] = limiter
+        return limiter
+
+
+class MirrorPool:
+    """Hand out the least-loaded mirror that is within its rate limit."""
+
+    def __init__(self, urls: List[str], slots: int = OVERPASS_MIRROR_SLOTS,
+                 interval: float = OVERPASS_MIRROR_INTERVAL):
+        self.mirrors = [Mirror(url, slots, interval) for url in urls]
+        self._cond = threading.Condition()
+        self.fair = _fair_limiter(urls, self.capacity)
+
+    @property
+    def capacity(self) -> int:
+        return sum(m.slots for m in self.mirrors)
+
+    def acquire(self) -> Mirror:
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                free = [m for m in self.mirrors if m.in_flight < m.slots]
+                if not free:
+                    self._cond.wait()
+                    continue
+                mirror = min(free, key=lambda m: (m.ready_at(), m.in_flight))
+                delay = mirror.ready_at() - now
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                mirror.in_flight += 1
+                mirror.requests += 1
+                mirror.next_start = now + mirror.interval
+                return mirror
+
+    def release(self, mirror: Mirror, status: str, elements: int = 0) -> None:
+        with self._cond:
+            mirror.in_flight -= 1
+            mirror.elements += elements
+            if status == "throttled":
+                mirror.throttled += 1
+                mirror.cooldown_until = time.monotonic() + THROTTLE_COOLDOWN
+            elif status != "ok":
+                mirror.errors += 1
+            self._cond.notify_all()
+
+    def stats(self) -> List[Dict]:
+        with self._cond:
+            return [m.stats() for m in self.mirrors]
+
+
+def _post(pool: MirrorPool, query: str, timeout: int) -> Tuple[str, List[Dict]]:
+    """Run one query on the next free mirror; returns (status, elements)."""
+    # The job's turn comes first, so no mirror sits reserved while its
+    # request waits for a shared slot
+    with pool.fair.slot(current_job()):
+        mirror = pool.acquire()
+        status, elements = "error", []
+        try:
+            # Not streamed: the body is read before post() returns
+            with OVERPASS_IN_FLIGHT.track(), OVERPASS_SECONDS.time():
+                resp = requests.post(mirror.url, data={"data": query}, headers=HEADERS,
+                                     timeout=timeout + 30)
+            if resp.status_code == 429:
+                status = "throttled"
+            elif resp.status_code == 504:
+                status = "timeout"
+            else:
+                resp.raise_for_status()
+                data = resp.json()
+                elements = data.get("elements", [])
+                remark = str(data.get("remark", ""))
+                status = "timeout" if ("timed out" in remark or "runtime error" in remark) else "ok"
+        except requests.Timeout:
+            status = "timeout"
+        except (RequestException, ValueError) as e:
+            print(f"❌ Overpass mirror {mirror.url} failed: {e}")
+        finally:
+            if status != "ok":
+                OVERPASS_ERRORS.inc()
+            pool.release(mirror, status, len(elements))
+    return status, elements
+
+
+def _area_bbox(pool: MirrorPool, area_ids: List[int]) -> Optional[Tuple[float, float, float, float]]:
+    """Bounding box (south, west, north, east) of the relations/ways behind area ids."""
+    rels = [i - 3600000000 for i in area_ids if i >= 3600000000]
+    ways = [i - 2400000000 for i in area_ids if 2400000000 <= i < 3600000000]
+    parts = []
+    if rels:
+        parts.append(f"rel(id:{','.join(map(str, rels))});")
+    if ways:
+        parts.append(f"way(id:{','.join(map(str, ways))});")
+    if not parts:
+        return None
+    status, elements = _post(pool, f"[out:json][timeout:60];({''.join(parts)});out bb;", 60)
+    bounds = [e["bounds"] for e in elements if "bounds" in e]
+    if status != "ok" or not bounds:
+        return None
+    return (
+        min(b["minlat"] for b in bounds),
+        min(b["minlon"] for b in bounds),
+        max(b["maxlat"] for b in bounds),
+        max(b["maxlon"] for b in bounds),
+    )
+
+
+def _grid(bbox: Tuple[float, float, float, float], step: float) -> List[Tuple]:
+    south, west, north, east = bbox
+    rows = max(1, math.ceil((north - south) / step - 1e-9))
+    cols = max(1, math.ceil((east - west) / step - 1e-9))
+    lat_step, lon_step = (north - south) / rows, (east - west) / cols
+    return [
+        (south + r * lat_step, west + c * lon_step,
+         south + (r + 1) * lat_step, west + (c + 1) * lon_step, 0, 0)
+        for r in range(rows)
+        for c in range(cols)
+    ]
+
+
+def _split(tile: Tuple) -> List[Tuple]:
+    south, west, north, east, depth, _ = tile
+    mid_lat, mid_lon = (south + north) / 2, (west + east) / 2
+    return [
+        (south, west, mid_lat, mid_lon, depth + 1, 0),
+        (south, mid_lon, mid_lat, east, depth + 1, 0),
+        (mid_lat, west, north, mid_lon, depth + 1, 0),
+        (mid_lat, mid_lon, north, east, depth + 1, 0),
+    ]
+
+
+def _tile_query(amenity: str, area_ids: List[int], tile: Tuple, cap: int, timeout: int) -> str:
+    south, west, north, east = (round(v, 6) for v in tile[:4])
+    bbox = f"({south},{west},{north},{east})"
+    return f"""
+    [out:json][timeout:{timeout}];
+    area(id:{','.join(str(i) for i in area_ids)})->.searchArea;
+    (
+      node["amenity"="{amenity}"](area.searchArea){bbox};
+      way["amenity"="{amenity}"](area.searchArea){bbox};
+    );
+    out center {cap};
+    """
+
+
+def _run_tile(pool: MirrorPool, query: str, timeout: int) -> Tuple[str, List[Dict]]:
+    cache = response_cache()
+    if cache is not None:
+        cached = cache.get(query)
+        if cached is not None:
+            return "ok", cached
+    status, elements = _post(pool, query, timeout)
+    if status == "ok" and cache is not None:
+        cache.put(query, elements, label="harvest tile")
+    return status, elements
+
+
+def harvest(query: str, mirrors: Optional[List[str]] = None,
+            tile_deg: float = HARVEST_TILE_DEG, cap: int = HARVEST_TILE_CAP,
+            timeout: int = HARVEST_TILE_TIMEOUT, max_depth: int = HARVEST_MAX_DEPTH,
+            stats: Optional[Dict] = None,
+            cancelled: Optional[Callable[[], bool]] = None) -> List[Dict]:
+    """
+    Harvest every match for an "X in Y" query by splitting the area into tiles.
+
+    Tiles are queried concurrently across ``mirrors`` within each mirror's
+    rate limit. A tile that times out or returns ``cap`` elements is split in
+    four and re-queued, down to ``max_depth``. Results are merged and
+    deduplicated by OSM type+id. Queries that are not area searches fall back
+    to the regular ``search``.
+
+    Once ``cancelled()`` returns True no further tiles are sent; requests
+    already in flight finish and what was found so far is returned.
+    """
+    stats = stats if stats is not None else {}
+    parsed = _parse_query(query)
+    amenity = parsed.get("amenity")
+    area_ids = resolve_area(parsed["location"]) if parsed["type"] == "amenity_area" and amenity else None
+    pool = MirrorPool(mirrors or OVERPASS_MIRRORS)
+    bbox = _area_bbox(pool, area_ids) if area_ids else None
+    if not bbox:
+        print("⚠️ Harvest needs a resolvable area; using regular search")
+        return search(query, limit=cap)
+
+    tiles = deque(_grid(bbox, tile_deg))
+    stats.update({"tiles": 0, "splits": 0, "retries": 0, "failed_tiles": 0, "capped_tiles": 0})
+    print(f"🧩 Harvesting '{query}' over {len(tiles)} tile(s) on {len(pool.mirrors)} mirror(s)")
+
+    found: Dict[Tuple[str, int], Dict] = {}
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=pool.capacity, thread_name_prefix="harvest") as executor:
+        running = {}
+        while tiles or running:
+            if tiles and cancelled is not None and cancelled():
+                print(f"🛑 Harvest cancelled with {len(tiles)} tile(s) left")
+                stats["cancelled"] = True
+                tiles.clear()
+            while tiles and len(running) < pool.capacity:
+                tile = tiles.popleft()
+                future = executor.submit(
+                    bound(_run_tile), pool, _tile_query(amenity, area_ids, tile, cap, timeout), timeout
+                )
+                running[future] = tile
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                tile = running.pop(future)
+                status, elements = future.result()
+                capped = status == "ok" and len(elements) >= cap
+                if (status == "timeout" or capped) and tile[4] < max_depth:
+                    stats["splits"] += 1
+                    tiles.extend(_split(tile))
+                    continue
+                if status in ("throttled", "error", "timeout") and tile[5] < HARVEST_RETRIES:
+                    stats["retries"] += 1
+                    OVERPASS_RETRIES.inc()
+                    tiles.append(tile[:5] + (tile[5] + 1,))
+                    continue
+                if status != "ok":
+                    stats["failed_tiles"] += 1
+                    print(f"❌ Giving up on tile {tile[:4]} after {tile[5]} retries ({status})")
+                    continue
+                if capped:
+                    stats["capped_tiles"] += 1
+                    print(f"⚠️ Tile {tile[:4]} still hits the {cap} cap at max depth")
+                stats["tiles"] += 1
+                for element in elements:
+                    found[(element.get("type"), element.get("id"))] = element
+
+    stats.update({
+        "elements": len(found),
+        "seconds": round(time.time() - started, 2),
+        "mirrors": pool.stats(),
+    })
+    print(f"🧩 Harvest done: {len(found)} unique elements from {stats['tiles']} tiles "
+          f"({stats['splits']} splits, {stats['failed_tiles']} failed)")
+    return list(found.values())
@@ -4,6 +4,6 @@ Backward-compat shim for code that still imports `app.tools.nominatim`.
 The actual implementation now lives in `app.tools.overpass`.
 """
 
-from app.tools.overpass import search  # noqa: F401
+from app.tools.overpass import iter_search, search  # noqa: F401
 
 
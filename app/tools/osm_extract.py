@@ -0,0 +1,427 @@
+# Offline OSM extract source - an alternative to Overpass for large harvests
+
+import bz2
+import gzip
+import multiprocessing
+import os
+import re
+import struct
+import zlib
+import xml.etree.ElementTree as ET
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from app.tools.overpass import _parse_query
+
+DATA_DIR = os.getenv("DATA_DIR", "data")
+# Extract files (.osm.pbf / .osm[.gz|.bz2]) that /run may refer to by name
+OSM_EXTRACT_DIR = os.getenv("OSM_EXTRACT_DIR", os.path.join(DATA_DIR, "extracts"))
+OSM_EXTRACT_WORKERS = int(os.getenv("OSM_EXTRACT_WORKERS", str(os.cpu_count() or 1)))
+
+# Pool workers start fresh instead of forking: the server process has
+# threads (jobs, replicator, HTTP pools) and a fork copies their locks
+# mid-use, which can deadlock the child
+_MP = multiprocessing.get_context("spawn")
+
+# (south, west, north, east)
+BBox = Tuple[float, float, float, float]
+
+
+def tag_filter(query: str) -> Tuple:
+    """
+    Turn a query into a picklable tag filter using the same parsing as Overpass:
+    ``("tag", "amenity", value)`` for "X in Y" / "X near Y" queries with a known
+    amenity, otherwise ``("name", pattern)`` for a case-insensitive name match.
+    """
+    parsed = _parse_query(query)
+    if parsed["type"] == "amenity_area" and parsed.get("amenity"):
+        return ("tag", "amenity", parsed["amenity"])
+    return ("name", re.escape(parsed.get("query", query).strip()))
+
+
+def _matches(spec: Tuple, tags: Dict) -> bool:
+    if spec[0] == "tag":
+        return tags.get(spec[1]) == spec[2]
+    return re.search(spec[1], tags.get("name", ""), re.IGNORECASE) is not None
+
+
+def _in_bbox(lat: float, lon: float, bbox: Optional[BBox]) -> bool:
+    return bbox is None or (bbox[0] <= lat <= bbox[2] and bbox[1] <= lon <= bbox[3])
+
+
+def _center(coords: List[Tuple[float, float]]) -> Dict:
+    # Same as Overpass "out center": the middle of the bounding box
+    lats = [c[0] for c in coords]
+    lons = [c[1] for c in coords]
+    return {
+        "lat": round((min(lats) + max(lats)) / 2, 7),
+        "lon": round((min(lons) + max(lons)) / 2, 7),
+    }
+
+
+# ── PBF decoding ─────────────────────────────────────────────────────────────
+# A minimal protobuf reader for the OSM PBF format, so the extract can be
+# split into independent blocks and decoded by several processes.
+
+def _varint(buf, pos: int) -> Tuple[int, int]:
+    result = shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _zigzag(n: int) -> int:
+    return (n >> 1) ^ -(n & 1)
+
+
+def _int64(n: int) -> int:
+    # Plain (non-zigzag) int64 fields arrive as unsigned two's complement
+    return n - (1 << 64) if n >= 1 << 63 else n
+
+
+def _fields(buf) -> Iterator[Tuple[int, object]]:
+    pos, end = 0, len(buf)
+    while pos < end:
+        key, pos = _varint(buf, pos)
+        field, wire = key >> 3, key & 7
+        if wire == 0:
+            value, pos = _varint(buf, pos)
+        elif wire == 2:
+            size, pos = _varint(buf, pos)
+            value = buf[pos:pos + size]
+            pos += size
+        elif wire == 1:
+            value, pos = buf[pos:pos + 8], pos + 8
+        elif wire == 5:
+            value, pos = buf[pos:pos + 4], pos + 4
+        else:
+            raise ValueError(f"unsupported protobuf wire type {wire}")
+        yield field, value
+
+
+def _packed(buf) -> List[int]:
+    out, pos, end = [], 0, len(buf)
+    while pos < end:
+        value, pos = _varint(buf, pos)
+        out.append(value)
+    return out
+
+
+def _packed_delta(buf) -> List[int]:
+    out, total = [], 0
+    for value in _packed(buf):
+        total += _zigzag(value)
+        out.append(total)
+    return out
+
+
+def _blob_index(path: str) -> List[Tuple[int, int]]:
+    """(offset, size) of every OSMData blob, read from the headers only."""
+    blobs = []
+    with open(path, "rb") as f:
+        while True:
+            head = f.read(4)
+            if len(head) < 4:
+                break
+            header = memoryview(f.read(struct.unpack(">I", head)[0]))
+            kind, size = b"", 0
+            for field, value in _fields(header):
+                if field == 1:
+                    kind = bytes(value)
+                elif field == 3:
+                    size = value
+            if kind == b"OSMData":
+                blobs.append((f.tell(), size))
+            f.seek(size, 1)
+    return blobs
+
+
+def _read_block(path: str, offset: int, size: int) -> memoryview:
+    with open(path, "rb") as f:
+        f.seek(offset)
+        blob = memoryview(f.read(size))
+    for field, value in _fields(blob):
+        if field == 1:
+            return memoryview(bytes(value))
+        if field == 3:
+            return memoryview(zlib.decompress(value))
+    raise ValueError("unsupported PBF blob compression (only raw and zlib are handled)")
+
+
+def _block_parts(block) -> Tuple[List[bytes], List, int, int, int]:
+    strings: List[bytes] = []
+    groups = []
+    granularity, lat_offset, lon_offset = 100, 0, 0
+    for field, value in _fields(block):
+        if field == 1:
+            strings = [bytes(s) for f, s in _fields(value) if f == 1]
+        elif field == 2:
+            groups.append(value)
+        elif field == 17:
+            granularity = value
+        elif field == 19:
+            lat_offset = _int64(value)
+        elif field == 20:
+            lon_offset = _int64(value)
+    return strings, groups, granularity, lat_offset, lon_offset
+
+
+def _decode_tags(strings: List[bytes], keys: List[int], vals: List[int]) -> Dict:
+    return {
+        strings[k].decode("utf-8", "replace"): strings[v].decode("utf-8", "replace")
+        for k, v in zip(keys, vals)
+    }
+
+
+def _scan_block(args) -> Tuple[List[Dict], List[Dict]]:
+    """Pass 1: matching nodes (complete) and matching ways (with node refs)."""
+    path, offset, size, spec, bbox = args
+    strings, groups, gran, lat_off, lon_off = _block_parts(_read_block(path, offset, size))
+
+    # Cheap pre-check: a block whose string table lacks the filter strings
+    # cannot contain a match, so skip decoding its elements entirely
+    table = set(strings)
+    needed = [b"name"] if spec[0] == "name" else [spec[1].encode(), spec[2].encode()]
+    if not all(s in table for s in needed):
+        return [], []
+
+    nodes: List[Dict] = []
+    ways: List[Dict] = []
+    for group in groups:
+        for field, value in _fields(group):
+            if field == 1:
+                node = {"keys": [], "vals": [], "id": 0, "lat": 0, "lon": 0}
+                for f, v in _fields(value):
+                    if f == 1:
+                        node["id"] = _zigzag(v)
+                    elif f == 2:
+                        node["keys"] = _packed(v)
+                    elif f == 3:
+                        node["vals"] = _packed(v)
+                    elif f == 8:
+                        node["lat"] = _zigzag(v)
+                    elif f == 9:
+                        node["lon"] = _zigzag(v)
+                tags = _decode_tags(strings, node["keys"], node["vals"])
+                lat = 1e-9 * (lat_off + gran * node["lat"])
+                lon = 1e-9 * (lon_off + gran * node["lon"])
+                if _matches(spec, tags) and _in_bbox(lat, lon, bbox):
+                    nodes.append({"type": "node", "id": node["id"], "lat": round(lat, 7),
+                                  "lon": round(lon, 7), "tags": tags})
+            elif field == 2:
+                nodes.extend(_dense_matches(value, strings, gran, lat_off, lon_off, spec, bbox))
+            elif field == 3:
+                way = {"keys": [], "vals": [], "refs": [], "id": 0}
+                for f, v in _fields(value):
+                    if f == 1:
+                        way["id"] = _int64(v)
+                    elif f == 2:
+                        way["keys"] = _packed(v)
+                    elif f == 3:
+                        way["vals"] = _packed(v)
+                    elif f == 8:
+                        way["refs"] = _packed_delta(v)
+                tags = _decode_tags(strings, way["keys"], way["vals"])
+                if _matches(spec, tags):
+                    ways.append({"type": "way", "id": way["id"], "tags": tags, "refs": way["refs"]})
+    return nodes, ways
+
+
+def _dense_matches(dense, strings, gran, lat_off, lon_off, spec, bbox) -> List[Dict]:
+    ids: List[int] = []
+    lats: List[int] = []
+    lons: List[int] = []
+    keys_vals: List[int] = []
+    for f, v in _fields(dense):
+        if f == 1:
+            ids = _packed_delta(v)
+        elif f == 8:
+            lats = _packed_delta(v)
+        elif f == 9:
+            lons = _packed_delta(v)
+        elif f == 10:
+            keys_vals = _packed(v)
+    out = []
+    pos = 0
+    for i, node_id in enumerate(ids):
+        tags = {}
+        while pos < len(keys_vals) and keys_vals[pos] != 0:
+            key, val = keys_vals[pos], keys_vals[pos + 1]
+            tags[strings[key].decode("utf-8", "replace")] = strings[val].decode("utf-8", "replace")
+            pos += 2
+        pos += 1  # skip the 0 delimiter
+        if not tags or not _matches(spec, tags):
+            continue
+        lat = 1e-9 * (lat_off + gran * lats[i])
+        lon = 1e-9 * (lon_off + gran * lons[i])
+        if _in_bbox(lat, lon, bbox):
+            out.append({"type": "node", "id": node_id, "lat": round(lat, 7),
+                        "lon": round(lon, 7), "tags": tags})
+    return out
+
+
+_WANTED: Set[int] = set()
+
+
+def _init_coords_worker(wanted: Set[int]) -> None:
+    global _WANTED
+    _WANTED = wanted
+
+
+def _coords_block(args) -> Dict[int, Tuple[float, float]]:
+    """Pass 2: coordinates of the nodes referenced by matching ways."""
+    path, offset, size = args
+    _, groups, gran, lat_off, lon_off = _block_parts(_read_block(path, offset, size))
+    found = {}
+    for group in groups:
+        for field, value in _fields(group):
+            if field == 1:
+                node_id, lat, lon = 0, 0, 0
+                for f, v in _fields(value):
+                    if f == 1:
+                        node_id = _zigzag(v)
+                    elif f == 8:
+                        lat = _zigzag(v)
+                    elif f == 9:
+                        lon = _zigzag(v)
+                if node_id in _WANTED:
+                    found[node_id] = (1e-9 * (lat_off + gran * lat), 1e-9 * (lon_off + gran * lon))
+            elif field == 2:
+                ids, lats, lons = [], [], []
+                for f, v in _fields(value):
+                    if f == 1:
+                        ids = _packed_delta(v)
+                    elif f == 8:
+                        lats = _packed_delta(v)
+                    elif f == 9:
+                        lons = _packed_delta(v)
+                for i, node_id in enumerate(ids):
+                    if node_id in _WANTED:
+                        found[node_id] = (1e-9 * (lat_off + gran * lats[i]),
+                                          1e-9 * (lon_off + gran * lons[i]))
+    return found
+
+
+def _map(fn, jobs: List, workers: int, initializer=None, initargs=()):
+    """Ordered map over blocks, in a process pool when it is worth it."""
+    if workers <= 1 or len(jobs) <= 1:
+        if initializer:
+            initializer(*initargs)
+        yield from map(fn, jobs)
+        return
+    with _MP.Pool(workers, initializer=initializer, initargs=initargs) as pool:
+        yield from pool.imap(fn, jobs, chunksize=4)
+
+
+def _iter_pbf(path: str, spec: Tuple, bbox: Optional[BBox], workers: int) -> Iterator[Dict]:
+    blobs = _blob_index(path)
+    print(f"📦 {os.path.basename(path)}: {len(blobs)} blocks, {workers} worker(s)")
+
+    ways: List[Dict] = []
+    for nodes, block_ways in _map(_scan_block, [(path, o, s, spec, bbox) for o, s in blobs], workers):
+        # Matching nodes are complete already - hand them downstream right away
+        yield from nodes
+        ways.extend(block_ways)
+    if not ways:
+        return
+
+    wanted = {ref for way in ways for ref in way["refs"]}
+    coords: Dict[int, Tuple[float, float]] = {}
+    for found in _map(_coords_block, [(path, o, s) for o, s in blobs], workers,
+                      initializer=_init_coords_worker, initargs=(wanted,)):
+        coords.update(found)
+    yield from _finish_ways(ways, coords, bbox)
+
+
+def _finish_ways(ways: List[Dict], coords: Dict, bbox: Optional[BBox]) -> Iterator[Dict]:
+    missing = 0
+    for way in ways:
+        points = [coords[ref] for ref in way["refs"] if ref in coords]
+        if not points:
+            missing += 1
+            continue
+        center = _center(points)
+        if _in_bbox(center["lat"], center["lon"], bbox):
+            yield {"type": "way", "id": way["id"], "center": center, "tags": way["tags"]}
+    if missing:
+        print(f"⚠️ {missing} matching ways have no node coordinates in this extract")
+
+
+# ── OSM XML ──────────────────────────────────────────────────────────────────
+
+def _open_xml(path: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rb")
+    return open(path, "rb")
+
+
+def _iter_xml_elements(path: str) -> Iterator[ET.Element]:
+    with _open_xml(path) as f:
+        context = ET.iterparse(f, events=("start", "end"))
+        _, root = next(context)
+        for event, elem in context:
+            if event == "end" and elem.tag in ("node", "way", "relation"):
+                yield elem
+                # Drop finished elements so memory stays flat
+                root.clear()
+
+
+def _iter_xml(path: str, spec: Tuple, bbox: Optional[BBox]) -> Iterator[Dict]:
+    # XML can't be split into independent blocks, so it is read in one process
+    ways: List[Dict] = []
+    for elem in _iter_xml_elements(path):
+        tags = {t.get("k"): t.get("v") for t in elem.findall("tag")}
+        if not tags or not _matches(spec, tags):
+            continue
+        if elem.tag == "node":
+            lat, lon = float(elem.get("lat")), float(elem.get("lon"))
+            if _in_bbox(lat, lon, bbox):
+                yield {"type": "node", "id": int(elem.get("id")), "lat": lat, "lon": lon, "tags": tags}
+        elif elem.tag == "way":
+            refs = [int(nd.get("ref")) for nd in elem.findall("nd")]
+            ways.append({"type": "way", "id": int(elem.get("id")), "tags": tags, "refs": refs})
+    if not ways:
+        return
+
+    wanted = {ref for way in ways for ref in way["refs"]}
+    coords = {}
+    for elem in _iter_xml_elements(path):
+        if elem.tag == "node" and int(elem.get("id")) in wanted:
+            coords[int(elem.get("id"))] = (float(elem.get("lat")), float(elem.get("lon")))
+    yield from _finish_ways(ways, coords, bbox)
+
+
+def resolve_extract(name: str) -> str:
+    """Map a file name from the API onto OSM_EXTRACT_DIR (no path traversal)."""
+    path = os.path.join(OSM_EXTRACT_DIR, os.path.basename(name))
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"OSM extract not found: {path}")
+    return path
+
+
+def iter_extract(path: str, query: str, bbox: Optional[BBox] = None,
+                 workers: Optional[int] = None) -> Iterator[Dict]:
+    """
+    Yield elements matching ``query`` from a local ``.osm.pbf`` or ``.osm``
+    extract, in the same shape Overpass returns with ``out center``: nodes
+    carry ``lat``/``lon`` and ways carry a ``center``.
+
+    The location part of "X in Y" is not resolved offline - the extract
+    itself defines the area; pass ``bbox`` to narrow it further.
+    """
+    spec = tag_filter(query)
+    print(f"📂 Reading OSM extract {path} with filter {spec}")
+    if path.endswith(".pbf"):
+        yield from _iter_pbf(path, spec, bbox, workers or OSM_EXTRACT_WORKERS)
+    else:
+        yield from _iter_xml(path, spec, bbox)
+
+
+def extract(path: str, query: str, bbox: Optional[BBox] = None,
+            workers: Optional[int] = None) -> List[Dict]:
+    return list(iter_extract(path, query, bbox=bbox, workers=workers))
@@ -1,11 +1,21 @@
 # Overpass logic - smart query parsing for "X in Y" patterns
 
+import codecs
+import json
 import os
+import queue
+import re
 import requests
+import threading
 import time
+from typing import Dict, Iterable, Iterator, List, Optional
 from requests.exceptions import RequestException
 from dotenv import load_dotenv
 
+from app.agent.jobs import resource
+from app.services.metrics import Counter, Gauge, Histogram, bound, current_job
+from app.tools.overpass_cache import OVERPASS_CACHE_MAX_ELEMENTS, area_cache, response_cache
+
 load_dotenv()
 
 HEADERS = {
@@ -16,6 +26,10 @@ OVERPASS_URL = os.getenv(
     "OVERPASS_URL",
     "https://overpass-api.de/api/interpreter",
 )
+# Bytes of a streamed response downloaded ahead of the consumer; past that
+# the download waits (and keeps its Overpass slot) until elements are taken
+OVERPASS_READ_AHEAD = int(os.getenv("OVERPASS_READ_AHEAD", str(4 * 1024 * 1024)))
+READ_CHUNK = 16384
 
 # Common amenity mappings for better search
 AMENITY_MAP = {
@@ -43,6 +57,24 @@ AMENITY_MAP = {
     "parking": "parking",
 }
 
+OVERPASS_SECONDS = Histogram("overpass_request_seconds",
+                             "Overpass request time until the response starts", ["job"])
+OVERPASS_IN_FLIGHT = Gauge("overpass_in_flight", "Overpass requests currently open")
+OVERPASS_RETRIES = Counter("overpass_retries_total", "Overpass requests retried after a failure", ["job"])
+OVERPASS_ERRORS = Counter("overpass_errors_total", "Overpass requests that failed", ["job"])
+
+_END = object()
+
+
+def overpass_slot():
+    """
+    One of the Overpass slots shared fairly by all running jobs, taken for
+    the calling thread's job. Held only while a request is open, never while
+    the caller works through the results.
+    """
+    return resource("overpass").slot(current_job())
+
+
 def _parse_query(query: str):
     """Parse query to extract amenity type and location."""
     query_lower = query.lower().strip()
@@ -79,7 +111,48 @@ def _parse_query(query: str):
     # Fallback: treat as name search
     return {"type": "name_search", "query": query}
 
-def _build_overpass_query(query: str, limit: int) -> str:
+def _area_key(location: str) -> str:
+    return " ".join(location.lower().split())
+
+
+def resolve_area(location: str) -> Optional[List[int]]:
+    """
+    Resolve a location name to Overpass area ids, cached for a long time.
+
+    Matching areas by name regex is one of the most expensive things to ask
+    Overpass for, so it is done once per location and later queries use
+    ``area(id:...)`` directly. Returns None if the lookup itself failed.
+    """
+    key = _area_key(location)
+    cache = area_cache()
+    if cache is not None:
+        ids = cache.get(key)
+        if ids is not None:
+            return ids
+
+    location_safe = location.replace('"', r'\"')
+    area_query = f"""
+    [out:json][timeout:60];
+    area["name"~"{location_safe}", i]["admin_level"~"[2-8]"];
+    out ids;
+    """
+    try:
+        with overpass_slot():
+            resp = requests.post(OVERPASS_URL, data={"data": area_query}, headers=HEADERS, timeout=90)
+        resp.raise_for_status()
+        ids = [e["id"] for e in resp.json().get("elements", []) if e.get("type") == "area"]
+    except (RequestException, ValueError) as e:
+        print(f"⚠️ Area lookup for '{location}' failed: {e}")
+        return None
+
+    print(f"📍 Resolved '{location}' to {len(ids)} area(s)")
+    # An empty match may just be a typo; don't pin it for a month
+    if ids and cache is not None:
+        cache.put(key, ids, label=key)
+    return ids
+
+
+def _build_overpass_query(query: str, limit: int, area_ids: Optional[List[int]] = None) -> str:
     """Build Overpass QL query based on parsed query structure."""
     parsed = _parse_query(query)
     
@@ -87,12 +160,16 @@ def _build_overpass_query(query: str, limit: int) -> str:
         # Use area-based search - find the area first, then search within it
         amenity = parsed["amenity"]
         location_safe = parsed["location"].replace('"', r'\"')
+        if area_ids:
+            area_filter = f"area(id:{','.join(str(i) for i in area_ids)})->.searchArea;"
+        else:
+            area_filter = f'area["name"~"{location_safe}", i]["admin_level"~"[2-8]"]->.searchArea;'
         
         return f"""
         [out:json][timeout:60];
         (
-          // First, find the area (city/region) by name
-          area["name"~"{location_safe}", i]["admin_level"~"[2-8]"]->.searchArea;
+          // First, select the area (city/region) - by resolved id or by name
+          {area_filter}
           
           // Then find amenities within that area
           (
@@ -115,37 +192,210 @@ def _build_overpass_query(query: str, limit: int) -> str:
     out center {limit};
     """
 
-def search(query: str, limit: int = 50, retries: int = 3):
-    """Search OSM via Overpass API with retry logic."""
-    query_str = _build_overpass_query(query, limit)
+def _build_cached_query(query: str, limit: int) -> str:
+    parsed = _parse_query(query)
+    area_ids = None
+    if parsed["type"] == "amenity_area" and parsed.get("amenity"):
+        area_ids = resolve_area(parsed["location"])
+    return _build_overpass_query(query, limit, area_ids)
+
+
+def invalidate(query: str, limit: int = 50, area: bool = False) -> bool:
+    """Drop the cached response for a search (and optionally its resolved area)."""
+    parsed = _parse_query(query)
+    if area and parsed["type"] == "amenity_area" and area_cache() is not None:
+        area_cache().invalidate(_area_key(parsed["location"]))
+    cache = response_cache()
+    return cache.invalidate(_build_cached_query(query, limit)) if cache is not None else False
+
+
+def _iter_elements(chunks: Iterable[bytes], meta: Dict) -> Iterator[Dict]:
+    """
+    Incrementally decode the ``elements`` array of an Overpass JSON response.
+
+    Each element is yielded as soon as its closing brace arrives; only the
+    element currently being received is buffered. ``meta["complete"]`` is set
+    once the array is closed and ``meta["remark"]`` holds any trailing remark.
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    buf = ""
+    state = "seek"
+    tail = ""
+    for chunk in chunks:
+        buf += text.decode(chunk)
+        if state == "seek":
+            key = buf.find('"elements"')
+            start = buf.find("[", key) if key != -1 else -1
+            if start == -1:
+                # Keep enough to catch a key split across chunks
+                buf = buf[key:] if key != -1 else buf[-16:]
+                continue
+            buf = buf[start + 1:]
+            state = "items"
+        if state == "items":
+            while True:
+                buf = buf.lstrip(" \t\r\n,")
+                if not buf:
+                    break
+                if buf[0] == "]":
+                    state = "tail"
+                    buf = buf[1:]
+                    break
+                try:
+                    element, end = decoder.raw_decode(buf)
+                except json.JSONDecodeError:
+                    break  # element not complete yet
+                buf = buf[end:]
+                yield element
+        if state == "tail":
+            tail = (tail + buf)[-4096:]
+            buf = ""
+    meta["complete"] = state == "tail"
+    remark = re.search(r'"remark"\s*:\s*"((?:[^"\\]|\\.)*)"', tail)
+    if remark:
+        meta["remark"] = json.loads(f'"{remark.group(1)}"')
+
+
+def _read_ahead(payload: Dict) -> Iterator[bytes]:
+    """
+    POST an Overpass query and hand over the body chunk by chunk.
+
+    A helper thread downloads the body while holding an Overpass slot, up
+    to OVERPASS_READ_AHEAD bytes ahead of the consumer, so for most
+    responses the slot and the connection are released at network speed
+    instead of at the pace of whoever consumes the elements. A larger body
+    is read only as fast as it is consumed, keeping memory flat.
+    """
+    limiter = resource("overpass")
+    limiter.acquire(current_job())
+    OVERPASS_IN_FLIGHT.inc()
+    try:
+        with OVERPASS_SECONDS.time():
+            resp = requests.post(OVERPASS_URL, data=payload, headers=HEADERS, timeout=90, stream=True)
+        resp.raise_for_status()
+    except Exception:
+        OVERPASS_IN_FLIGHT.dec()
+        limiter.release()
+        raise
+
+    chunks: "queue.Queue" = queue.Queue(maxsize=max(1, OVERPASS_READ_AHEAD // READ_CHUNK))
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        # Wait for room, but give up once the consumer has gone away
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read():
+        try:
+            with resp:
+                for chunk in resp.iter_content(chunk_size=READ_CHUNK):
+                    if not put(chunk):
+                        return
+        except Exception as e:
+            put(e)
+        finally:
+            OVERPASS_IN_FLIGHT.dec()
+            limiter.release()
+            put(_END)
+
+    threading.Thread(target=bound(read), name="overpass-read", daemon=True).start()
+
+    def drain() -> Iterator[bytes]:
+        try:
+            while True:
+                item = chunks.get()
+                if item is _END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # The consumer stopped early (cancelled job, error downstream)
+            stop.set()
+
+    return drain()
+
+
+def iter_search(query: str, limit: int = 50, retries: int = 3, refresh: bool = False
+                ) -> Iterator[Dict]:
+    """
+    Search OSM via Overpass and yield elements while the response streams in.
+
+    Downstream work can start on the first element instead of waiting for the
+    whole body, while the download itself runs ahead (see ``_read_ahead``).
+    Same caching, retry and fallback behaviour as ``search``; on a retry
+    after a broken stream, elements that were already yielded are skipped.
+    """
+    query_str = _build_cached_query(query, limit)
     payload = {"data": query_str}
+    cache = response_cache()
+    if cache is not None and not refresh:
+        cached = cache.get(query_str)
+        if cached is not None:
+            print(f"💾 Overpass cache hit: {len(cached)} elements")
+            yield from cached
+            return
     
     # Debug: print the query (first 200 chars)
     print(f"🔍 Overpass query: {query_str[:200]}...")
     
+    yielded = 0
     for attempt in range(retries):
+        # Keep a copy for the cache only while the response is small enough
+        kept: Optional[List[Dict]] = [] if cache is not None else None
         try:
-            resp = requests.post(OVERPASS_URL, data=payload, headers=HEADERS, timeout=90)
-            resp.raise_for_status()
-            data = resp.json()
-            elements = data.get("elements", [])
+            meta: Dict = {}
+            for n, element in enumerate(_iter_elements(_read_ahead(payload), meta)):
+                if kept is not None:
+                    kept.append(element)
+                    if len(kept) > OVERPASS_CACHE_MAX_ELEMENTS:
+                        kept = None
+                if n < yielded:
+                    continue
+                yielded += 1
+                yield element
+            if not meta.get("complete"):
+                raise RequestException("Overpass response ended before the elements array closed")
             
             # Check for Overpass errors in response
-            if "remark" in data:
-                print(f"⚠️ Overpass remark: {data['remark']}")
-            
-            return elements
+            if "remark" in meta:
+                # Remarks flag timeouts/partial results - don't cache those
+                print(f"⚠️ Overpass remark: {meta['remark']}")
+            elif kept is not None:
+                cache.put(query_str, kept, label=query)
+            return
         except RequestException as e:
             print(f"❌ Overpass attempt {attempt+1} failed: {e}")
+            OVERPASS_ERRORS.inc()
             if attempt < retries - 1:
+                OVERPASS_RETRIES.inc()
                 wait_time = 2 ** attempt
                 print(f"⏳ Retrying in {wait_time} seconds...")
                 time.sleep(wait_time)
                 continue
+            if yielded:
+                # Partial results already went downstream; a name search would mix semantics
+                return
             # On final failure, try a simpler query as fallback
             print("⚠️ Trying fallback name-based search...")
-            return _fallback_search(query, limit)
-    return []
+            yield from _fallback_search(query, limit)
+
+
+def search(query: str, limit: int = 50, retries: int = 3, refresh: bool = False):
+    """
+    Search OSM via Overpass API with retry logic.
+
+    Responses are cached on disk by the built query for OVERPASS_CACHE_TTL;
+    ``refresh=True`` skips the cached copy and stores a fresh one.
+    """
+    return list(iter_search(query, limit=limit, retries=retries, refresh=refresh))
 
 def _fallback_search(query: str, limit: int) -> list:
     """Fallback to simple name-based search if area search fails."""
@@ -159,9 +409,11 @@ def _fallback_search(query: str, limit: int) -> list:
     out center {limit};
     """
     try:
-        resp = requests.post(OVERPASS_URL, data={"data": fallback_query}, headers=HEADERS, timeout=60)
-        resp.raise_for_status()
-        return resp.json().get("elements", [])
+        with overpass_slot(), OVERPASS_IN_FLIGHT.track(), OVERPASS_SECONDS.time():
+            resp = requests.post(OVERPASS_URL, data={"data": fallback_query}, headers=HEADERS, timeout=60)
+            resp.raise_for_status()
+            return resp.json().get("elements", [])
     except Exception as e:
         print(f"❌ Fallback search also failed: {e}")
+        OVERPASS_ERRORS.inc()
         return []
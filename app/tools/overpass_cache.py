@@ -0,0 +1,149 @@
+# Disk-backed TTL caches for Overpass responses and resolved search areas
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Dict, Optional
+
+DATA_DIR = os.getenv("DATA_DIR", "data")
+OVERPASS_CACHE_PATH = os.getenv(
+    "OVERPASS_CACHE_PATH", os.path.join(DATA_DIR, "overpass_cache.sqlite3")
+)
+# Responses go stale as OSM is edited; resolved areas almost never change
+OVERPASS_CACHE_TTL = float(os.getenv("OVERPASS_CACHE_TTL", str(24 * 3600)))
+OVERPASS_AREA_TTL = float(os.getenv("OVERPASS_AREA_TTL", str(30 * 24 * 3600)))
+# Streamed responses larger than this are not kept in memory just to be cached
+OVERPASS_CACHE_MAX_ELEMENTS = int(os.getenv("OVERPASS_CACHE_MAX_ELEMENTS", "20000"))
+
+
+class TTLCache:
+    """
+    A table of zlib-compressed JSON values that expire ``ttl`` seconds after
+    being stored. Keys are hashed, so arbitrarily long queries are fine.
+    """
+
+    def __init__(self, path: str, table: str, ttl: float):
+        self.path = path
+        self.table = table
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.writes = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            " key TEXT PRIMARY KEY,"
+            " label TEXT,"
+            " value BLOB NOT NULL,"
+            " stored_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def _hash(key: str) -> str:
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, stored_at FROM {self.table} WHERE key = ?", (self._hash(key),)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            if time.time() - row[1] > self.ttl:
+                self.expired += 1
+                self.misses += 1
+                self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (self._hash(key),))
+                self._conn.commit()
+                return None
+            self.hits += 1
+        return json.loads(zlib.decompress(row[0]).decode("utf-8"))
+
+    def put(self, key: str, value: Any, label: str = "") -> None:
+        blob = zlib.compress(json.dumps(value, ensure_ascii=False).encode("utf-8"), 6)
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, label, value, stored_at) VALUES (?, ?, ?, ?)",
+                (self._hash(key), label[:200], blob, time.time()),
+            )
+            self._conn.commit()
+            self.writes += 1
+
+    def invalidate(self, key: str) -> bool:
+        with self._lock:
+            cur = self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (self._hash(key),))
+            self._conn.commit()
+        return cur.rowcount > 0
+
+    def clear(self) -> int:
+        with self._lock:
+            cur = self._conn.execute(f"DELETE FROM {self.table}")
+            self._conn.commit()
+        return cur.rowcount
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            cur = self._conn.execute(
+                f"DELETE FROM {self.table} WHERE stored_at < ?", (time.time() - self.ttl,)
+            )
+            self._conn.commit()
+        return cur.rowcount
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries, size = self._conn.execute(
+                f"SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM {self.table}"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "compressed_bytes": size,
+            "ttl_s": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "writes": self.writes,
+        }
+
+
+_caches: Dict[str, TTLCache] = {}
+_caches_lock = threading.Lock()
+
+
+def _get(table: str, ttl: float) -> Optional[TTLCache]:
+    if not OVERPASS_CACHE_PATH:
+        return None
+    if table not in _caches:
+        with _caches_lock:
+            if table not in _caches:
+                _caches[table] = TTLCache(OVERPASS_CACHE_PATH, table, ttl)
+    return _caches[table]
+
+
+def response_cache() -> Optional[TTLCache]:
+    """Built Overpass QL query → list of elements; None if caching is disabled."""
+    return _get("responses", OVERPASS_CACHE_TTL)
+
+
+def area_cache() -> Optional[TTLCache]:
+    """Normalized location string → resolved Overpass area ids."""
+    return _get("areas", OVERPASS_AREA_TTL)
+
+
+def cache_stats() -> Optional[Dict]:
+    responses, areas = response_cache(), area_cache()
+    if responses is None or areas is None:
+        return None
+    return {"responses": responses.stats(), "areas": areas.stats()}
@@ -1,11 +1,299 @@
 # Web scraping tool
 
-import requests
+import asyncio
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+from urllib.parse import urlsplit
+
+import httpx
 from bs4 import BeautifulSoup
 
-def fetch_text(url):
+from app.memory.blocking import SHARED_HOSTS
+from app.services.metrics import Counter, Gauge, Histogram, current_job
+from app.tools.email import extract as extract_email
+
+SCRAPE_TIMEOUT = float(os.getenv("SCRAPE_TIMEOUT", "8"))
+# A page is read up to this many bytes; contact details sit in the header or footer
+SCRAPE_MAX_BYTES = int(os.getenv("SCRAPE_MAX_BYTES", "1000000"))
+# Open connections in total, and concurrent fetches per host
+SCRAPE_CONCURRENCY = int(os.getenv("SCRAPE_CONCURRENCY", "32"))
+SCRAPE_PER_HOST = int(os.getenv("SCRAPE_PER_HOST", "2"))
+# Results are cached per domain, so a chain's site is fetched once, not per branch
+SCRAPE_CACHE_TTL = float(os.getenv("SCRAPE_CACHE_TTL", "86400"))
+SCRAPE_CACHE_MAX_ENTRIES = int(os.getenv("SCRAPE_CACHE_MAX_ENTRIES", "10000"))
+USER_AGENT = os.getenv("USER_AGENT", "OSMAgenticAI/1.0")
+
+# Failed fetches are retried after this long rather than after SCRAPE_CACHE_TTL
+ERROR_TTL = 600.0
+# Carried between chunks so an address split across two chunks is still found
+OVERLAP = 256
+
+# Also matches the address inside mailto: links
+EMAIL_RE = re.compile(rb"\b([A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,})\b")
+# "name@2x.png" and friends are asset names, not addresses
+ASSET_TLDS = {"png", "jpg", "jpeg", "gif", "svg", "webp", "ico", "css", "js"}
+# Addresses written with entities or split by tags only show up in the parsed text
+OBFUSCATED_RE = re.compile(rb"&#0*64;|&#x0*40;|&commat;|@\s*<", re.I)
+
+_MISS = object()
+
+SCRAPE_SECONDS = Histogram("scraper_fetch_seconds", "Website fetch and scan time", ["job"])
+SCRAPE_IN_FLIGHT = Gauge("scraper_in_flight", "Website fetches in progress")
+SCRAPE_ERRORS = Counter("scraper_errors_total", "Website fetches that failed", ["job"])
+SCRAPE_LOOKUPS = Counter("scraper_lookups_total", "Websites looked up, by cache result", ["job", "result"])
+
+
+def cache_key(url: str) -> str:
+    """The site's domain, or the full URL on hosts shared by unrelated businesses."""
     try:
-        soup = BeautifulSoup(requests.get(url, timeout=8).text, "lxml")
-        return soup.get_text()
-    except:
+        host = (urlsplit(url).hostname or "").lower()
+    except ValueError:
         return ""
+    host = host[4:] if host.startswith("www.") else host
+    if any(host == h or host.endswith("." + h) for h in SHARED_HOSTS):
+        return url
+    return host
+
+
+def scan_bytes(data: bytes, final: bool = True) -> Optional[str]:
+    """First plausible address in raw page bytes; a match touching the end waits for more data."""
+    for m in EMAIL_RE.finditer(data):
+        if not final and m.end() == len(data):
+            break
+        email = m.group(1).decode("ascii")
+        if email.rsplit(".", 1)[-1].lower() not in ASSET_TLDS:
+            return email
+    return None
+
+
+def _page_text(body: bytes) -> str:
+    return BeautifulSoup(body, "lxml").get_text()
+
+
+def _parse_email(body: bytes) -> Optional[str]:
+    email = extract_email(BeautifulSoup(body, "lxml").get_text(" "))
+    return None if email == "N/A" else email
+
+
+class EmailScraper:
+    """
+    Finds a contact email on business websites, many at a time.
+
+    Fetches run on a private asyncio loop with one pooled HTTP client,
+    capped by SCRAPE_CONCURRENCY in total and SCRAPE_PER_HOST per host.
+    Each response is streamed and scanned as raw bytes, stopping at the
+    first address or at ``max_bytes``; the page is only parsed into a DOM
+    when the bytes hint at an obfuscated address. Results (including "no
+    email") are cached per domain, and concurrent requests for the same
+    domain share one fetch.
+    """
+
+    def __init__(self, concurrency: int = SCRAPE_CONCURRENCY, per_host: int = SCRAPE_PER_HOST,
+                 max_bytes: int = SCRAPE_MAX_BYTES, timeout: float = SCRAPE_TIMEOUT,
+                 cache_ttl: float = SCRAPE_CACHE_TTL,
+                 cache_max_entries: int = SCRAPE_CACHE_MAX_ENTRIES):
+        self.concurrency = max(1, concurrency)
+        self.per_host = max(1, per_host)
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.cache_max_entries = max(1, cache_max_entries)
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._hosts: Dict[str, asyncio.Semaphore] = {}
+        self._stats = {
+            "requests": 0,
+            "cache_hits": 0,
+            "pages_fetched": 0,
+            "bytes_read": 0,
+            "early_exits": 0,
+            "truncated": 0,
+            "skipped_non_html": 0,
+            "dom_parses": 0,
+            "emails_found": 0,
+            "errors": 0,
+        }
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="scraper", daemon=True)
+        self._thread.start()
+
+    # ── public API (any thread) ─────────────────────────────────────────
+
+    def find_emails(self, urls: Sequence[str]) -> List[Optional[str]]:
+        """One email (or None) per URL, fetched concurrently."""
+        # Fetches run on the loop thread, so the caller's job label travels along
+        coro = self._find_all(list(urls), current_job())
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def fetch_text(self, url: str) -> str:
+        """Visible text of one page (first ``max_bytes``), or "" if it cannot be fetched."""
+        return asyncio.run_coroutine_threadsafe(self._fetch_text(url), self._loop).result()
+
+    def close(self) -> None:
+        if self._client is not None:
+            asyncio.run_coroutine_threadsafe(self._client.aclose(), self._loop).result()
+            self._client = None
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def stats(self) -> Dict:
+        return {**self._stats, "cache_entries": len(self._cache)}
+
+    # ── loop side ───────────────────────────────────────────────────────
+
+    def _open_client(self) -> None:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                follow_redirects=True,
+                headers={"User-Agent": USER_AGENT},
+                limits=httpx.Limits(max_connections=self.concurrency,
+                                    max_keepalive_connections=self.concurrency),
+            )
+
+    async def _find_all(self, urls: List[str], job: str = "") -> List[Optional[str]]:
+        self._open_client()
+        results = await asyncio.gather(*(self._find(url, job) for url in urls), return_exceptions=True)
+        return [None if isinstance(r, BaseException) else r for r in results]
+
+    def _cached(self, key: str):
+        entry = self._cache.get(key)
+        if entry is None:
+            return _MISS
+        expires, email = entry
+        if expires < time.time():
+            del self._cache[key]
+            return _MISS
+        self._cache.move_to_end(key)
+        return email
+
+    def _remember(self, key: str, email: Optional[str], ttl: float) -> None:
+        self._cache[key] = (time.time() + ttl, email)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_max_entries:
+            self._cache.popitem(last=False)
+
+    async def _find(self, url: str, job: str = "") -> Optional[str]:
+        self._stats["requests"] += 1
+        key = cache_key(url)
+        if not key:
+            return None
+        email = self._cached(key)
+        if email is not _MISS:
+            self._stats["cache_hits"] += 1
+            SCRAPE_LOOKUPS.inc(job=job, result="hit")
+            return email
+        task = self._inflight.get(key)
+        if task is None:
+            SCRAPE_LOOKUPS.inc(job=job, result="miss")
+            task = asyncio.ensure_future(self._fetch(key, url, job))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self._stats["cache_hits"] += 1
+            SCRAPE_LOOKUPS.inc(job=job, result="hit")
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key: str, url: str, job: str = "") -> Optional[str]:
+        host = (urlsplit(url).hostname or "").lower()
+        limit = self._hosts.setdefault(host, asyncio.Semaphore(self.per_host))
+        async with limit:
+            started = time.perf_counter()
+            SCRAPE_IN_FLIGHT.inc()
+            try:
+                email, ttl = await self._scan(url), self.cache_ttl
+            except (httpx.HTTPError, httpx.InvalidURL, UnicodeError, ValueError) as e:
+                self._stats["errors"] += 1
+                SCRAPE_ERRORS.inc(job=job)
+                print(f"  ⚠️ Could not scrape {url}: {type(e).__name__}")
+                email, ttl = None, ERROR_TTL
+            finally:
+                SCRAPE_IN_FLIGHT.dec()
+                SCRAPE_SECONDS.observe(time.perf_counter() - started, job=job)
+        if email:
+            self._stats["emails_found"] += 1
+        self._remember(key, email, ttl)
+        return email
+
+    async def _fetch_text(self, url: str) -> str:
+        self._open_client()
+        host = (urlsplit(url).hostname or "").lower()
+        body = bytearray()
+        async with self._hosts.setdefault(host, asyncio.Semaphore(self.per_host)):
+            try:
+                async with self._client.stream("GET", url) as resp:
+                    async for chunk in resp.aiter_bytes():
+                        body += chunk[:self.max_bytes - len(body)]
+                        if len(body) >= self.max_bytes:
+                            break
+            except (httpx.HTTPError, httpx.InvalidURL, UnicodeError, ValueError):
+                return ""
+        return await asyncio.get_running_loop().run_in_executor(None, _page_text, bytes(body))
+
+    async def _scan(self, url: str) -> Optional[str]:
+        body = bytearray()
+        tail = b""
+        async with self._client.stream("GET", url) as resp:
+            resp.raise_for_status()
+            self._stats["pages_fetched"] += 1
+            ctype = resp.headers.get("content-type", "").lower()
+            if ctype and "html" not in ctype and not ctype.startswith("text/"):
+                self._stats["skipped_non_html"] += 1
+                return None
+            async for chunk in resp.aiter_bytes():
+                chunk = chunk[:self.max_bytes - len(body)]
+                body += chunk
+                self._stats["bytes_read"] += len(chunk)
+                window = tail + chunk
+                email = scan_bytes(window, final=False)
+                if email:
+                    self._stats["early_exits"] += 1
+                    return email
+                tail = window[-OVERLAP:]
+                if len(body) >= self.max_bytes:
+                    self._stats["truncated"] += 1
+                    break
+        email = scan_bytes(tail)
+        if email or not OBFUSCATED_RE.search(body):
+            return email
+        self._stats["dom_parses"] += 1
+        return await asyncio.get_running_loop().run_in_executor(None, _parse_email, bytes(body))
+
+
+_scraper: Optional[EmailScraper] = None
+_scraper_lock = threading.Lock()
+
+
+def get_scraper() -> EmailScraper:
+    """Shared scraper so every pipeline worker uses one loop, pool and cache."""
+    global _scraper
+    if _scraper is None:
+        with _scraper_lock:
+            if _scraper is None:
+                _scraper = EmailScraper()
+    return _scraper
+
+
+def find_emails(urls: Sequence[str]) -> List[Optional[str]]:
+    return get_scraper().find_emails(urls)
+
+
+def fetch_text(url: str) -> str:
+    """Page text through the shared scraper; "" when the page cannot be fetched."""
+    return get_scraper().fetch_text(url)
+
+
+def scraper_stats() -> Optional[Dict]:
+    return _scraper.stats() if _scraper is not None else None
+
+
+def close_scraper() -> None:
+    global _scraper
+    with _scraper_lock:
+        if _scraper is not None:
+            _scraper.close()
+            _scraper = None
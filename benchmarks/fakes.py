@@ -0,0 +1,251 @@
+"""
+Local stand-ins for the external services, for offline benchmarks.
+
+Each fake is a small HTTP server started in its own process, so it does not
+compete with the process being measured for the GIL or count towards its
+memory:
+
+- Overpass replays a recorded response, scaled to any number of elements,
+  and answers area lookups with a fixed area id.
+- Ollama answers /api/generate after a fixed latency plus a token rate, in
+  streaming or one-shot mode, echoing the ids of batch prompts.
+- Websites serve pages of a given size, with an email address in the footer
+  for a given share of the sites.
+
+Sheets needs no server: ``SHEETS_BACKEND=local`` already swaps in
+``LocalWorksheet`` with simulated latency and quota.
+
+Record a real Overpass response to replay later:
+
+    python -m benchmarks.fakes record "dentists in Berlin" benchmarks/fixtures/berlin.json
+"""
+
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs
+
+RECORDED = os.path.join(os.path.dirname(__file__), "fixtures", "elements.json")
+
+# Area id answered to every area lookup (3600000000 + relation id)
+AREA_ID = 3600062422
+
+_BATCH_IDS_RE = re.compile(r'(?:"id":\s*"|\bid=)((?:node|way|relation)/\d+)')
+
+
+def load_recorded(path: str = RECORDED) -> List[Dict]:
+    """Elements of a recorded Overpass response (a full response or a bare list)."""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    return data["elements"] if isinstance(data, dict) else data
+
+
+def site_url(n: int, port: int) -> str:
+    # Every loopback address is a separate host, so per-host limits and the
+    # per-domain scrape cache behave as they would on the internet
+    return f"http://127.0.{n // 250}.{n % 250 + 1}:{port}/"
+
+
+def scale_elements(recorded: List[Dict], count: int, site_port: Optional[int] = None,
+                   website_ratio: float = 0.5) -> List[Dict]:
+    """
+    ``count`` distinct elements cycled from ``recorded``: unique ids, names
+    and positions, so dedup does not collapse the copies. With ``site_port``
+    a ``website_ratio`` share of them point at the fake websites (and lose
+    any email tag, so the scraper has work to do).
+    """
+    elements = []
+    for n in range(count):
+        base = recorded[n % len(recorded)]
+        tags = dict(base.get("tags", {}))
+        if tags.get("name"):
+            tags["name"] = f"{tags['name']} {n}"
+        if site_port is not None and (n * 7919) % 100 < website_ratio * 100:
+            for key in ("website", "contact:website", "url", "email", "contact:email"):
+                tags.pop(key, None)
+            tags["website"] = site_url(n, site_port)
+        element = {"type": base.get("type", "node"), "id": 10 ** 9 + n, "tags": tags}
+        # Spread the copies ~1km apart so they land in different dedup cells
+        lat = 48.0 + (n // 100) * 0.01
+        lon = 11.0 + (n % 100) * 0.01
+        if element["type"] == "node":
+            element["lat"], element["lon"] = lat, lon
+        else:
+            element["center"] = {"lat": lat, "lon": lon}
+        elements.append(element)
+    return elements
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config: Dict = {}
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, body: bytes, ctype: str = "application/json", status: int = 200) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+
+class OverpassHandler(_Handler):
+    def do_POST(self):
+        query = parse_qs(self._body().decode("utf-8")).get("data", [""])[0]
+        time.sleep(self.config["latency"])
+        if "out ids" in query:
+            self._send(json.dumps({"elements": [{"type": "area", "id": AREA_ID}]}).encode())
+            return
+        body = self.config["body"]
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        chunk = self.config["chunk_bytes"]
+        try:
+            for start in range(0, len(body), chunk):
+                self.wfile.write(body[start:start + chunk])
+                if self.config["chunk_delay"]:
+                    time.sleep(self.config["chunk_delay"])
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class OllamaHandler(_Handler):
+    def do_POST(self):
+        body = json.loads(self._body())
+        prompt = body.get("prompt", "")
+        ids = list(dict.fromkeys(_BATCH_IDS_RE.findall(prompt)))
+        fields = {"name": "", "address": "", "phone": "", "website": "", "email": ""}
+        # Empty fields keep what the rules already extracted from the tags. Like
+        # Ollama's JSON mode, the root is always an object: batches are keyed by id
+        reply = json.dumps({i: fields for i in ids} if ids else fields)
+        pieces = [reply[i:i + 4] for i in range(0, len(reply), 4)]
+        per_token = 1.0 / self.config["tokens_per_s"] if self.config["tokens_per_s"] else 0.0
+        counts = {"prompt_eval_count": (len(prompt) + 3) // 4, "eval_count": len(pieces)}
+        time.sleep(self.config["latency"])
+        if not body.get("stream"):
+            time.sleep(per_token * len(pieces))
+            self._send(json.dumps({"response": reply, "done": True, **counts}).encode())
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        lines = [{"response": p, "done": False} for p in pieces] + [{"response": "", "done": True, **counts}]
+        try:
+            for line in lines:
+                data = (json.dumps(line) + "\n").encode()
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+                time.sleep(per_token)
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stops reading once the JSON value is complete
+            self.close_connection = True
+
+
+class WebsiteHandler(_Handler):
+    def do_GET(self):
+        time.sleep(self.config["latency"])
+        host = self.headers.get("Host", "")
+        filler = b"<p>" + b"lorem ipsum dolor sit amet " * 40 + b"</p>\n"
+        size = self.config["page_bytes"]
+        page = b"<html><body>" + filler * max(1, size // len(filler))
+        if zlib.crc32(host.encode()) % 100 < self.config["email_ratio"] * 100:
+            page += f"<footer><a href='mailto:info@{host.split(':')[0]}.example'>Contact</a></footer>".encode()
+        self._send(page + b"</body></html>", ctype="text/html; charset=utf-8")
+
+
+def _serve(handler: type, config: Dict, ready, host: str) -> None:
+    handler.config = config
+    server = ThreadingHTTPServer((host, 0), handler)
+    server.daemon_threads = True
+    ready.send(server.server_address[1])
+    server.serve_forever()
+
+
+class FakeServer:
+    """One fake service in a child process; ``url`` is set once it listens."""
+
+    def __init__(self, handler: type, host: str = "127.0.0.1", **config):
+        self.handler = handler
+        self.host = host
+        self.config = config
+        self.port: Optional[int] = None
+        self._process: Optional[multiprocessing.Process] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self) -> "FakeServer":
+        parent, child = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(
+            target=_serve, args=(self.handler, self.config, child, self.host), daemon=True
+        )
+        self._process.start()
+        self.port = parent.recv()
+        return self
+
+    def stop(self) -> None:
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join(5)
+            self._process = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def fake_overpass(elements: List[Dict], latency: float = 0.5, chunk_bytes: int = 16384,
+                  chunk_delay: float = 0.0) -> FakeServer:
+    """Replays ``elements`` as one Overpass response after ``latency`` seconds."""
+    body = json.dumps({"version": 0.6, "elements": elements}).encode("utf-8")
+    return FakeServer(OverpassHandler, body=body, latency=latency,
+                      chunk_bytes=chunk_bytes, chunk_delay=chunk_delay)
+
+
+def fake_ollama(latency: float = 0.2, tokens_per_s: float = 200.0) -> FakeServer:
+    return FakeServer(OllamaHandler, latency=latency, tokens_per_s=tokens_per_s)
+
+
+def fake_websites(latency: float = 0.1, page_bytes: int = 30000, email_ratio: float = 0.6) -> FakeServer:
+    # Bound to every address so the whole 127.0.0.0/8 range from site_url reaches it
+    return FakeServer(WebsiteHandler, host="0.0.0.0", latency=latency, page_bytes=page_bytes,
+                      email_ratio=email_ratio)
+
+
+def record(query: str, path: str, limit: int = 200) -> int:
+    """Save a live Overpass response for ``query`` so benchmarks can replay it."""
+    from app.tools.overpass import search
+
+    elements = search(query, limit=limit, refresh=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"elements": elements}, f, ensure_ascii=False)
+    print(f"💾 Recorded {len(elements)} elements to {path}")
+    return len(elements)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] != "record":
+        print(__doc__.strip().splitlines()[-1].strip())
+        sys.exit(2)
+    record(sys.argv[2], sys.argv[3])
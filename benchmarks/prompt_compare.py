@@ -0,0 +1,102 @@
+"""
+Compare the compact enrichment prompt against the full one on a fixture set.
+
+Reports prompt size for both styles and, unless ``--dry-run`` is given, runs
+each fixture through Ollama with both prompts and checks how often the
+compact prompt yields the same lead fields as the full prompt.
+
+    python -m benchmarks.prompt_compare [--fixtures PATH] [--dry-run] [--out result.json]
+"""
+
+import argparse
+import json
+import os
+import sys
+from typing import Dict
+
+from app.agent.prompt import build_prompt, estimate_tokens
+from app.llm.ollama_client import OllamaClient
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "elements.json")
+FIELDS = ("name", "address", "phone", "website", "email")
+
+
+def _norm(value) -> str:
+    return " ".join(str(value or "").lower().split())
+
+
+def _ask(client: OllamaClient, prompt: str) -> Dict:
+    before = client.stats()["prompt_tokens"]
+    try:
+        parsed = json.loads(client.generate(prompt, stream=False))
+    except Exception as e:
+        print(f"⚠️ LLM call failed: {e}")
+        parsed = {}
+    tokens = client.stats()["prompt_tokens"] - before
+    return {"lead": parsed if isinstance(parsed, dict) else {}, "prompt_tokens": tokens}
+
+
+def compare(fixtures_path: str = FIXTURES, dry_run: bool = False) -> Dict:
+    with open(fixtures_path, encoding="utf-8") as f:
+        elements = json.load(f)
+
+    client = None if dry_run else OllamaClient(stream=False)
+    rows = []
+    for raw in elements:
+        full = build_prompt(raw, style="full")
+        compact = build_prompt(raw, style="compact")
+        row = {
+            "id": f"{raw.get('type')}/{raw.get('id')}",
+            "full_chars": len(full),
+            "compact_chars": len(compact),
+            "est_full_tokens": estimate_tokens(full),
+            "est_compact_tokens": estimate_tokens(compact),
+        }
+        if client is not None:
+            full_out = _ask(client, full)
+            compact_out = _ask(client, compact)
+            row["full_prompt_tokens"] = full_out["prompt_tokens"]
+            row["compact_prompt_tokens"] = compact_out["prompt_tokens"]
+            row["field_agreement"] = {
+                field: _norm(full_out["lead"].get(field)) == _norm(compact_out["lead"].get(field))
+                for field in FIELDS
+            }
+        rows.append(row)
+
+    full_tokens = sum(r.get("full_prompt_tokens") or r["est_full_tokens"] for r in rows)
+    compact_tokens = sum(r.get("compact_prompt_tokens") or r["est_compact_tokens"] for r in rows)
+    summary = {
+        "fixtures": len(rows),
+        "measured": client is not None,
+        "full_prompt_tokens": full_tokens,
+        "compact_prompt_tokens": compact_tokens,
+        "reduction": round(1 - compact_tokens / full_tokens, 4) if full_tokens else 0.0,
+    }
+    if client is not None:
+        checks = [ok for r in rows for ok in r["field_agreement"].values()]
+        summary["field_agreement"] = round(sum(checks) / len(checks), 4) if checks else 0.0
+        summary["llm"] = client.stats()
+    return {"summary": summary, "rows": rows}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--fixtures", default=FIXTURES)
+    parser.add_argument("--dry-run", action="store_true", help="only measure prompt sizes")
+    parser.add_argument("--out", help="write the full report as JSON")
+    args = parser.parse_args(argv)
+
+    report = compare(args.fixtures, dry_run=args.dry_run)
+    for row in report["rows"]:
+        agreement = row.get("field_agreement")
+        agreed = f"  agree {sum(agreement.values())}/{len(agreement)}" if agreement else ""
+        print(f"{row['id']:>18}  {row['est_full_tokens']:>5} → {row['est_compact_tokens']:>4} tokens{agreed}")
+    print(json.dumps(report["summary"], indent=2))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
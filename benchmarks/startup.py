@@ -0,0 +1,74 @@
+"""
+Measure API cold start: import time and memory of app.main, and of the warm-up.
+
+Each measurement runs in a fresh interpreter so nothing is already imported.
+The report lists which heavy modules (torch, sentence_transformers, faiss,
+gspread) the import pulled in; after the lazy-loading change there should be
+none until the warm-up runs.
+
+    python -m benchmarks.startup [--warmup] [--repeat 3] [--out report.json]
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from typing import Dict
+
+HEAVY_MODULES = ("torch", "sentence_transformers", "faiss", "gspread", "google.oauth2")
+
+# Runs in the child interpreter; prints one JSON line
+_PROBE = """
+import json, sys, time
+from app.services.warmup import _rss_mb
+started = time.perf_counter()
+import app.main
+report = {{"import_s": time.perf_counter() - started, "import_rss_mb": _rss_mb()}}
+report["heavy_modules"] = [m for m in {heavy!r} if m in sys.modules]
+if {warmup!r}:
+    from app.services import warmup
+    started = time.perf_counter()
+    warmup.start_warmup()
+    warmup._thread.join()
+    report["warmup_s"] = time.perf_counter() - started
+    report["warmup_rss_mb"] = _rss_mb()
+    report["warmup_errors"] = warmup.readiness()["warmup"]["errors"]
+print(json.dumps(report))
+"""
+
+
+def probe(warmup: bool) -> Dict:
+    """Import app.main (and optionally warm up) in a fresh interpreter."""
+    code = _PROBE.format(heavy=HEAVY_MODULES, warmup=warmup)
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--warmup", action="store_true", help="also time the background warm-up")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--out", help="write the report as JSON")
+    args = parser.parse_args(argv)
+
+    runs = [probe(args.warmup) for _ in range(max(1, args.repeat))]
+    report = {
+        "runs": len(runs),
+        "import_s_median": round(statistics.median(r["import_s"] for r in runs), 3),
+        "import_rss_mb": runs[-1]["import_rss_mb"],
+        "heavy_modules_after_import": runs[-1]["heavy_modules"],
+    }
+    if args.warmup:
+        report["warmup_s_median"] = round(statistics.median(r["warmup_s"] for r in runs), 3)
+        report["warmup_rss_mb"] = runs[-1]["warmup_rss_mb"]
+        report["warmup_errors"] = runs[-1]["warmup_errors"]
+    print(json.dumps(report, indent=2))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,371 @@
+"""
+Offline end-to-end benchmark: the agent and each tool against local fakes.
+
+Starts fake Overpass, Ollama and website servers (see benchmarks.fakes),
+points the app at them and at the local Sheets stand-in, then measures:
+
+- startup: import time and RSS of app.main in a fresh interpreter
+- tools: Overpass search, LLM calls, website scraping, dedup and Sheets
+  writes, each with p50/p95 latency and throughput
+- agent: ``run_agent`` end to end, first cold and then again with warm
+  caches, with leads/s and p50/p95 per pipeline stage and per service
+- peak RSS of the benchmark process
+
+Latencies come from the app's own metrics histograms, recorded raw while
+the benchmark runs. The report is JSON; pass ``--baseline`` with an
+earlier report to print how every figure changed between commits.
+
+    python -m benchmarks.suite [--elements 200] [--runs 2] [--out report.json] [--baseline old.json]
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence
+
+from benchmarks.fakes import fake_ollama, fake_overpass, fake_websites, load_recorded, scale_elements, site_url
+
+QUERY = "cafes in Berlin"
+
+# Counters of a job reported next to the timings
+JOB_COUNTERS = ("elements", "leads_written", "leads_updated", "leads_unchanged",
+                "skipped_duplicates", "llm_calls_avoided", "errors")
+
+
+def _percentile(values: Sequence[float], q: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def summarize(values: Sequence[float]) -> Dict:
+    """Count, p50, p95, max and total of a list of latencies (seconds)."""
+    return {
+        "n": len(values),
+        "p50_s": round(_percentile(values, 0.50), 4),
+        "p95_s": round(_percentile(values, 0.95), 4),
+        "max_s": round(max(values), 4) if values else 0.0,
+        "total_s": round(sum(values), 4),
+    }
+
+
+@contextlib.contextmanager
+def recording(histograms: Dict[str, tuple]):
+    """
+    Collect every observation of the given histograms while active.
+
+    ``histograms`` maps a name to ``(histogram, label)``; samples are grouped
+    as ``name`` or, with a label, ``name.<label value>`` (e.g. per stage).
+    """
+    samples: Dict[str, List[float]] = defaultdict(list)
+    for name, (hist, label) in histograms.items():
+        def observe(value, _orig=hist.observe, _name=name, _label=label, **labels):
+            samples[f"{_name}.{labels.get(_label, '')}" if _label else _name].append(value)
+            _orig(value, **labels)
+        hist.observe = observe
+    try:
+        yield samples
+    finally:
+        for hist, _ in histograms.values():
+            del hist.observe
+
+
+def _histograms() -> Dict[str, tuple]:
+    from app.agent.agent import STAGE_SECONDS
+    from app.llm.ollama_client import LLM_SECONDS
+    from app.memory.vector_store import DEDUP_SECONDS, EMBED_SECONDS
+    from app.services.sheets import SHEETS_SECONDS
+    from app.tools.overpass import OVERPASS_SECONDS
+    from app.tools.scraper import SCRAPE_SECONDS
+
+    return {
+        "stage": (STAGE_SECONDS, "stage"),
+        "overpass": (OVERPASS_SECONDS, None),
+        "llm": (LLM_SECONDS, None),
+        "scraper": (SCRAPE_SECONDS, None),
+        "dedup": (DEDUP_SECONDS, None),
+        "embed": (EMBED_SECONDS, None),
+        "sheets": (SHEETS_SECONDS, "op"),
+    }
+
+
+def _quiet(verbose: bool):
+    return contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+
+
+def _configure(data_dir: str, overpass_url: str, ollama_url: str, args) -> None:
+    # Read by the app at import time, so set before anything from app is imported
+    os.environ.update({
+        "DATA_DIR": data_dir,
+        "OVERPASS_URL": overpass_url + "/api/interpreter",
+        "OLLAMA_BASE_URL": ollama_url,
+        "OLLAMA_MODEL": os.getenv("OLLAMA_MODEL") or "bench",
+        "SHEETS_BACKEND": "local",
+        "SHEETS_SYNC": "true",
+        "SHEETS_LOCAL_LATENCY": str(args.sheets_latency),
+        "LOCAL_SHEET_PATH": os.path.join(data_dir, "local_sheet.csv"),
+        "WARMUP_ON_STARTUP": "false",
+    })
+
+
+def bench_startup() -> Dict:
+    from benchmarks.startup import probe
+
+    return {k: round(v, 3) if isinstance(v, float) else v for k, v in probe(False).items()}
+
+
+def bench_overpass(repeat: int) -> Dict:
+    from app.tools.overpass import search
+
+    times, elements = [], 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        elements = len(search(QUERY, limit=50, refresh=True))
+        times.append(time.perf_counter() - started)
+    started = time.perf_counter()
+    search(QUERY, limit=50)
+    cached = time.perf_counter() - started
+    return {
+        **summarize(times),
+        "elements": elements,
+        "elements_per_s": round(elements / _percentile(times, 0.5), 1) if times else 0.0,
+        "cached_s": round(cached, 4),
+    }
+
+
+def bench_llm(elements: List[Dict], calls: int, batch: int) -> Dict:
+    from app.agent.planner import osm_key
+    from app.agent.prompt import build_batch_prompt
+    from app.llm.ollama_client import OLLAMA_NUM_PREDICT, call_llm, get_client
+
+    before = get_client().stats()
+    times = []
+    for n in range(calls):
+        chunk = elements[n * batch % len(elements):][:batch]
+        prompt = build_batch_prompt([(osm_key(raw), raw) for raw in chunk])
+        started = time.perf_counter()
+        call_llm(prompt, num_predict=OLLAMA_NUM_PREDICT * len(chunk))
+        times.append(time.perf_counter() - started)
+    after = get_client().stats()
+    tokens = after["completion_tokens"] - before["completion_tokens"]
+    return {
+        **summarize(times),
+        "batch_size": batch,
+        "completion_tokens_per_s": round(tokens / sum(times), 1) if times else 0.0,
+    }
+
+
+def bench_scraper(urls: List[str]) -> Dict:
+    from app.tools.scraper import EmailScraper
+
+    scraper = EmailScraper()
+    try:
+        started = time.perf_counter()
+        found = scraper.find_emails(urls)
+        cold = time.perf_counter() - started
+        started = time.perf_counter()
+        scraper.find_emails(urls)
+        warm = time.perf_counter() - started
+        stats = scraper.stats()
+    finally:
+        scraper.close()
+    return {
+        "urls": len(urls),
+        "cold_s": round(cold, 3),
+        "urls_per_s": round(len(urls) / cold, 1) if cold else 0.0,
+        "warm_s": round(warm, 4),
+        "emails_found": sum(1 for e in found if e),
+        "bytes_read": stats["bytes_read"],
+        "early_exits": stats["early_exits"],
+    }
+
+
+def bench_dedup(count: int, batch: int) -> Dict:
+    if importlib.util.find_spec("sentence_transformers") is None:
+        return {"skipped": "sentence_transformers is not installed"}
+    from app.memory.vector_store import dedupe_batch, get_model
+
+    started = time.perf_counter()
+    get_model()
+    load = time.perf_counter() - started
+    # Far from the agent's leads, so the agent run does not see them as duplicates
+    leads = [{"osm": f"node/{n}", "name": f"Bench Bakery {n}", "address": f"{n} Bench Road",
+              "lat": -40.0 + (n // 100) * 0.01, "lon": -70.0 + (n % 100) * 0.01}
+             for n in range(count)]
+    times = []
+    for start in range(0, count, batch):
+        started = time.perf_counter()
+        dedupe_batch(leads[start:start + batch])
+        times.append(time.perf_counter() - started)
+    return {
+        **summarize(times),
+        "batch_size": batch,
+        "leads_per_s": round(count / sum(times), 1) if times else 0.0,
+        "model_load_s": round(load, 3),
+    }
+
+
+def bench_sheets(rows: int, latency: float, batch: int) -> Dict:
+    from benchmarks.sheets_throughput import run
+
+    return {"batch_size": batch, **run(rows, latency, 0, batch)}
+
+
+def bench_agent(runs: int, verbose: bool) -> List[Dict]:
+    from app.agent.agent import run_agent
+    from app.services.lead_store import get_replicator
+
+    results = []
+    for n in range(runs):
+        with recording(_histograms()) as samples:
+            started = time.perf_counter()
+            with _quiet(verbose):
+                job = run_agent(QUERY)
+            seconds = time.perf_counter() - started
+            replicator = get_replicator()
+            started = time.perf_counter()
+            with _quiet(verbose):
+                synced = replicator.sync() if replicator is not None else 0
+            sync_seconds = time.perf_counter() - started
+        stats = job.stats
+        leads = stats["leads_written"] + stats["leads_updated"] + stats["leads_unchanged"]
+        results.append({
+            "run": n + 1,
+            "caches": "cold" if n == 0 else "warm",
+            "status": stats["status"],
+            "seconds": round(seconds, 3),
+            "leads": leads,
+            "leads_per_s": round(leads / seconds, 2) if seconds else 0.0,
+            "elements_per_s": round(stats["elements"] / seconds, 2) if seconds else 0.0,
+            "sheets_sync_s": round(sync_seconds, 3),
+            "rows_synced": synced,
+            "counters": {k: stats[k] for k in JOB_COUNTERS},
+            "latency": {name: summarize(values) for name, values in sorted(samples.items())},
+        })
+    return results
+
+
+def _flatten(value, prefix: str = "") -> Dict[str, float]:
+    if isinstance(value, dict):
+        items = value.items()
+    elif isinstance(value, list):
+        items = ((str(i), v) for i, v in enumerate(value))
+    else:
+        is_number = isinstance(value, (int, float)) and not isinstance(value, bool)
+        return {prefix: value} if is_number else {}
+    flat = {}
+    for key, item in items:
+        flat.update(_flatten(item, f"{prefix}.{key}" if prefix else str(key)))
+    return flat
+
+
+def compare(baseline: Dict, report: Dict, threshold: float = 0.05) -> Dict[str, Dict]:
+    """Figures present in both reports that moved by more than ``threshold`` (relative)."""
+    old, new = _flatten(baseline), _flatten(report)
+    changes = {}
+    for key in sorted(old.keys() & new.keys()):
+        if key.startswith(("meta.", "changes.")):
+            continue
+        before, after = old[key], new[key]
+        if before == after:
+            continue
+        change = (after - before) / abs(before) if before else float("inf")
+        if abs(change) >= threshold:
+            changes[key] = {"baseline": before, "current": after,
+                            "change": round(change, 4) if before else None}
+    return changes
+
+
+def _commit() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--elements", type=int, default=200, help="elements in the replayed Overpass response")
+    parser.add_argument("--recorded", help="recorded Overpass response to replay (default: the fixture set)")
+    parser.add_argument("--runs", type=int, default=2, help="agent runs; the first has cold caches")
+    parser.add_argument("--website-ratio", type=float, default=0.5, help="share of elements with a website to scrape")
+    parser.add_argument("--overpass-latency", type=float, default=0.5)
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="seconds before the first token")
+    parser.add_argument("--llm-tokens-per-s", type=float, default=50.0)
+    parser.add_argument("--site-latency", type=float, default=0.1)
+    parser.add_argument("--page-bytes", type=int, default=30000)
+    parser.add_argument("--email-ratio", type=float, default=0.6, help="share of websites showing an email")
+    parser.add_argument("--sheets-latency", type=float, default=0.05, help="simulated seconds per Sheets call")
+    parser.add_argument("--tool-calls", type=int, default=10, help="calls per tool benchmark")
+    parser.add_argument("--skip-tools", action="store_true", help="only measure startup and the agent")
+    parser.add_argument("--data-dir", help="state directory (default: a fresh temporary one)")
+    parser.add_argument("--verbose", action="store_true", help="show the agent's log output")
+    parser.add_argument("--out", help="write the report as JSON")
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    args = parser.parse_args(argv)
+
+    recorded = load_recorded(args.recorded) if args.recorded else load_recorded()
+    sites = fake_websites(args.site_latency, args.page_bytes, args.email_ratio).start()
+    elements = scale_elements(recorded, args.elements, sites.port, args.website_ratio)
+    overpass = fake_overpass(elements, latency=args.overpass_latency).start()
+    ollama = fake_ollama(args.llm_latency, args.llm_tokens_per_s).start()
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="osm-bench-")
+    _configure(data_dir, overpass.url, ollama.url, args)
+
+    report: Dict = {
+        "meta": {
+            "commit": _commit(),
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "data_dir": data_dir,
+            "config": {k: v for k, v in vars(args).items() if k not in ("out", "baseline", "verbose")},
+        },
+    }
+    try:
+        print("⏱️ Startup...")
+        report["startup"] = bench_startup()
+        if not args.skip_tools:
+            calls = max(1, args.tool_calls)
+            print("🔧 Tools...")
+            with _quiet(args.verbose):
+                report["tools"] = {
+                    "overpass": bench_overpass(calls),
+                    "llm": bench_llm(elements, calls, int(os.getenv("ENRICH_BATCH_SIZE", "8"))),
+                    "scraper": bench_scraper([site_url(n, sites.port) for n in range(calls * 10)]),
+                    "dedup": bench_dedup(calls * 32, int(os.getenv("DEDUP_BATCH_SIZE", "32"))),
+                    "sheets": bench_sheets(calls * 20, args.sheets_latency,
+                                           int(os.getenv("SHEETS_BATCH_SIZE", "50"))),
+                }
+        print(f"🤖 Agent: {args.runs} run(s) over {args.elements} elements...")
+        report["agent"] = bench_agent(max(1, args.runs), args.verbose)
+    finally:
+        for server in (overpass, ollama, sites):
+            server.stop()
+    # ru_maxrss is in KiB on Linux
+    report["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            report["changes"] = compare(json.load(f), report)
+
+    print(json.dumps(report, indent=2))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,13 @@
-from app.services.sheets import append_row, read_all
+from app.services.sheets import append_rows, read_all
 
-append_row([
+append_rows([[
     "uuid-1",
     "Test Company",
     "Test Address",
     "9999999999",
     "https://example.com",
     "test@example.com"
-])
+]])
 
 data = read_all()
 print("Rows in sheet:")
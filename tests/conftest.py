@@ -0,0 +1,32 @@
+# Test setup - point every on-disk store at a throwaway directory before the app is imported
+
+import os
+import tempfile
+
+import pytest
+
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="osm-agent-tests-")
+os.environ.setdefault("SHEETS_BACKEND", "local")
+os.environ.setdefault("SHEETS_SYNC", "false")
+os.environ.setdefault("WARMUP_ON_STARTUP", "false")
+
+
+@pytest.fixture
+def agent_env(tmp_path, monkeypatch):
+    """
+    run_job wired to fresh stores and offline stand-ins: ``source`` replaces
+    Overpass, dedup keeps every lead and nothing is scraped or embedded.
+    Returns the list the test fills with the elements to serve.
+    """
+    from app.agent import agent
+    from app.services import checkpoints, lead_store
+
+    monkeypatch.setattr(lead_store, "_store", lead_store.LeadStore(str(tmp_path / "leads.sqlite3")))
+    monkeypatch.setattr(checkpoints, "_store", checkpoints.CheckpointStore(str(tmp_path / "checkpoints.sqlite3")))
+    source = []
+    monkeypatch.setattr(agent, "iter_search", lambda query, limit=50: iter(source))
+    monkeypatch.setattr(agent, "dedupe_batch", lambda leads: [False] * len(leads))
+    monkeypatch.setattr(agent, "save_index", lambda: None)
+    monkeypatch.setattr(agent, "index_stats", lambda: None)
+    return source
+
@@ -0,0 +1,127 @@
+import time
+
+from app.agent import agent
+from app.agent.jobs import DONE, ERROR, JOB_MAX_ATTEMPTS, Job, JobManager
+from app.services.checkpoints import get_checkpoints
+
+
+def _element(n, street="Main St"):
+    # Settled by the rule fast path, so no LLM is needed
+    return {"type": "node", "id": n, "lat": 52.0 + n * 0.01, "lon": 13.0,
+            "tags": {"name": f"Shop {n}", "shop": "bakery", "addr:street": street,
+                     "addr:housenumber": str(n)}}
+
+
+def _run(query="bakeries in Berlin", **kwargs):
+    job = Job(query, **kwargs)
+    agent.run_job(job)
+    assert job.status == DONE
+    return job
+
+
+def _wait(predicate, timeout=5.0):
+    deadline = time.time() + timeout
+    while not predicate():
+        if time.time() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+def test_rerun_skips_settled_elements(agent_env):
+    agent_env.extend(_element(n) for n in range(1, 11))
+    first = _run()
+    assert first.stats["leads_written"] == 10
+
+    second = _run()
+    assert second.stats["skipped_processed"] == 10
+    assert second.stats["leads_written"] == 0
+    assert get_checkpoints().outcomes(first.id) == {"inserted": 10}
+
+
+def test_changed_element_is_processed_again(agent_env):
+    agent_env.extend(_element(n) for n in range(1, 11))
+    _run()
+
+    agent_env[2] = _element(3, street="Side St")
+    again = _run()
+    assert again.stats["skipped_processed"] == 9
+    assert again.stats["leads_updated"] == 1
+    assert get_checkpoints().outcomes(again.id) == {"updated": 1}
+
+
+def test_reprocess_redoes_other_jobs_elements(agent_env):
+    agent_env.extend(_element(n) for n in range(1, 6))
+    _run()
+
+    redo = _run(reprocess=True)
+    assert redo.stats["skipped_processed"] == 0
+    assert redo.stats["leads_unchanged"] == 5
+
+
+def test_resume_picks_up_after_the_last_settled_element(agent_env):
+    store = get_checkpoints()
+    agent_env.extend(_element(n) for n in range(1, 6))
+    crashed = _run()
+    # As if the process died mid-run: the job row is still marked running
+    store.save_job(crashed)
+    store.started(crashed.id)
+    agent_env.extend(_element(n) for n in range(6, 11))
+
+    manager = JobManager(agent.run_job, workers=1, checkpoints=store)
+    [job] = manager.resume(store.interrupted())
+    _wait(lambda: job.status == DONE)
+    assert job.id == crashed.id and job.resumed
+    assert job.stats["skipped_processed"] == 5
+    assert job.stats["leads_written"] == 5
+    assert store.interrupted() == []
+
+
+def test_resume_gives_up_after_max_attempts(agent_env):
+    store = get_checkpoints()
+    job = Job("bakeries in Berlin")
+    store.save_job(job)
+    for _ in range(JOB_MAX_ATTEMPTS):
+        store.started(job.id)
+
+    manager = JobManager(agent.run_job, workers=1, checkpoints=store)
+    assert manager.resume(store.interrupted()) == []
+    assert manager.get(job.id) is None
+    assert store.interrupted() == []
+    assert store.interrupted(statuses=(ERROR,))[0]["id"] == job.id
+
+
+def test_failed_elements_are_not_kept_open(agent_env, monkeypatch):
+    agent_env.extend(_element(n) for n in range(1, 21))
+    enrich_leads = agent.enrich_leads
+
+    def flaky(raws, **kwargs):
+        if any(raw["id"] % 2 for raw in raws):
+            raise RuntimeError("LLM unavailable")
+        return enrich_leads(raws, **kwargs)
+
+    monkeypatch.setattr(agent, "ENRICH_BATCH_SIZE", 1)
+    monkeypatch.setattr(agent, "enrich_leads", flaky)
+    job = _run()
+    assert job.stats["errors"] == 10
+    assert job.checkpoint.pending() == 0
+    assert get_checkpoints().outcomes(job.id) == {"inserted": 10, "error": 10}
+
+    # Errors are not settled, so the next run retries exactly those
+    monkeypatch.setattr(agent, "enrich_leads", enrich_leads)
+    retry = _run()
+    assert retry.stats["skipped_processed"] == 10
+    assert retry.stats["leads_written"] == 10
+
+
+def test_cancelled_job_leaves_nothing_open(agent_env, monkeypatch):
+    job = Job("bakeries in Berlin")
+
+    def source(query, limit=50):
+        for n in range(1, 200):
+            if n == 30:
+                job.cancel()
+            yield _element(n)
+
+    monkeypatch.setattr(agent, "iter_search", source)
+    agent.run_job(job)
+    assert job.checkpoint.pending() == 0
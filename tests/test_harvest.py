@@ -0,0 +1,84 @@
+import threading
+import time
+
+from app.agent import agent
+from app.agent.jobs import CANCELLED, Job
+from app.tools import harvest
+
+
+class _Response:
+    status_code = 200
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {"elements": []}
+
+
+def _wait(predicate, timeout=5.0):
+    deadline = time.time() + timeout
+    while not predicate():
+        if time.time() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+def test_requests_use_every_mirror_slot(monkeypatch):
+    lock = threading.Lock()
+    open_now, peak = [0], [0]
+
+    def post(url, **kwargs):
+        with lock:
+            open_now[0] += 1
+            peak[0] = max(peak[0], open_now[0])
+        time.sleep(0.1)
+        with lock:
+            open_now[0] -= 1
+        return _Response()
+
+    monkeypatch.setattr(harvest.requests, "post", post)
+    pool = harvest.MirrorPool(["http://a.test", "http://b.test", "http://c.test"], slots=2, interval=0)
+    threads = [threading.Thread(target=harvest._post, args=(pool, "q", 10)) for _ in range(12)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    assert peak[0] == pool.capacity == 6
+
+
+def test_waiting_for_a_turn_reserves_no_mirror(monkeypatch):
+    monkeypatch.setattr(harvest.requests, "post", lambda url, **kwargs: _Response())
+    pool = harvest.MirrorPool(["http://d.test"], slots=2, interval=0)
+    for _ in range(pool.capacity):
+        pool.fair.acquire("other-job")
+    t = threading.Thread(target=harvest._post, args=(pool, "q", 10))
+    t.start()
+    _wait(lambda: pool.fair.stats()["waiting"] == 1)
+    assert [m.in_flight for m in pool.mirrors] == [0]
+    for _ in range(pool.capacity):
+        pool.fair.release()
+    t.join(5)
+    assert pool.stats()[0]["requests"] == 1
+
+
+def test_cancel_stops_sending_tiles(agent_env, monkeypatch):
+    job = Job("restaurants in Germany", harvest=True)
+    sent = []
+
+    def run_tile(pool, query, timeout):
+        sent.append(query)
+        if len(sent) == 10:
+            job.cancel()
+        time.sleep(0.01)
+        n = len(sent)
+        return "ok", [{"type": "node", "id": n, "lat": 52.0, "lon": 13.0, "tags": {"name": f"R {n}"}}]
+
+    monkeypatch.setattr(harvest, "resolve_area", lambda location: [3600051477])
+    monkeypatch.setattr(harvest, "_area_bbox", lambda pool, area_ids: (47.0, 5.0, 55.0, 15.0))
+    monkeypatch.setattr(harvest, "_run_tile", run_tile)
+    agent.run_job(job)
+    assert job.status == CANCELLED
+    # 320 tiles in the area; only those already in flight finish after the cancel
+    assert 10 <= len(sent) <= 10 + len(harvest.OVERPASS_MIRRORS) * harvest.OVERPASS_MIRROR_SLOTS
+    assert job.stats["elements"] == 0
@@ -0,0 +1,118 @@
+import threading
+import time
+
+from app.agent import agent
+from app.agent.jobs import CANCELLED, DONE, FairLimiter, Job, JobManager
+
+
+def _wait(predicate, timeout=5.0):
+    deadline = time.time() + timeout
+    while not predicate():
+        if time.time() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+def _element(n):
+    # Settled by the rule fast path, so no LLM is needed
+    return {"type": "node", "id": n, "lat": 52.0 + n * 0.01, "lon": 13.0,
+            "tags": {"name": f"Shop {n}", "shop": "bakery", "addr:street": "Main St",
+                     "addr:housenumber": str(n)}}
+
+
+def test_fair_limiter_takes_turns_between_owners():
+    limiter = FairLimiter("test", 1)
+    limiter.acquire("x")
+    order = []
+    threads = []
+
+    def use(owner, name):
+        with limiter.slot(owner):
+            order.append(name)
+
+    for owner, name in [("a", "a1"), ("a", "a2"), ("a", "a3"), ("b", "b1")]:
+        t = threading.Thread(target=use, args=(owner, name))
+        t.start()
+        threads.append(t)
+        _wait(lambda: limiter.stats()["waiting"] == len(threads))
+    limiter.release()
+    for t in threads:
+        t.join(5)
+    assert order == ["a1", "b1", "a2", "a3"]
+    assert limiter.stats()["in_use"] == 0
+
+
+def test_jobs_run_by_priority_and_queued_cancel_never_runs():
+    gate = threading.Event()
+    ran = []
+
+    def runner(job):
+        if job.query == "first":
+            gate.wait(5)
+        ran.append(job.query)
+        job.update(status=DONE)
+
+    manager = JobManager(runner, workers=1)
+    manager.submit("first")
+    _wait(lambda: manager.stats()["running"] == 1)
+    low = manager.submit("low", priority=0)
+    high = manager.submit("high", priority=5)
+    dropped = manager.submit("dropped", priority=9)
+    assert manager.queue_position(dropped) == 1
+    assert manager.queue_position(low) == 3
+    manager.cancel(dropped.id)
+    assert dropped.status == CANCELLED
+    gate.set()
+    _wait(lambda: low.status == DONE and high.status == DONE)
+    assert ran == ["first", "high", "low"]
+
+
+def test_cancel_stops_reading_and_finishes_cancelled(agent_env, monkeypatch):
+    job = Job("bakeries in Berlin")
+
+    def source(query, limit=50):
+        for n in range(1, 200):
+            if n == 20:
+                job.cancel()
+            yield _element(n)
+
+    monkeypatch.setattr(agent, "iter_search", source)
+    agent.run_job(job)
+    assert job.status == CANCELLED
+    assert job.stats["elements"] == 19
+    # Leads enriched before the cancel are still stored, nothing after it
+    assert job.stats["leads_written"] <= 19
+    assert not job.stats["source_done"]
+
+
+def test_dedup_sees_leads_in_source_order(agent_env, monkeypatch):
+    from app.services.lead_store import get_store
+
+    seen = []
+
+    def dedupe(leads):
+        seen.extend(lead["name"] for lead in leads)
+        return [False] * len(leads)
+
+    monkeypatch.setattr(agent, "dedupe_batch", dedupe)
+    agent_env.extend(_element(n) for n in range(1, 61))
+    job = Job("bakeries in Berlin")
+    agent.run_job(job)
+    assert job.status == DONE
+    assert seen == [f"Shop {n}" for n in range(1, 61)]
+    assert job.stats["elements"] == 60
+    assert job.stats["leads_written"] == 60
+    assert len(get_store().all()) == 60
+    outcomes = [data["outcome"] for _, kind, data in job.events_since(0) if kind == "lead"]
+    assert outcomes == ["inserted"] * 60
+
+
+def test_single_lead_enrichment(agent_env, monkeypatch):
+    # ENRICH_BATCH_SIZE=1 hands the enrich stage one element, not a list
+    monkeypatch.setattr(agent, "ENRICH_BATCH_SIZE", 1)
+    agent_env.extend(_element(n) for n in range(1, 6))
+    job = Job("bakeries in Berlin")
+    agent.run_job(job)
+    assert job.status == DONE
+    assert job.stats["errors"] == 0
+    assert job.stats["leads_written"] == 5
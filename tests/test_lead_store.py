@@ -0,0 +1,139 @@
+import sqlite3
+
+import pytest
+
+from app.services.lead_store import INSERTED, SYNCED, UNCHANGED, UPDATED, LeadStore, SheetsReplicator
+from app.services.local_sheet import LocalWorksheet
+
+
+class FlakySheet(LocalWorksheet):
+    """In-memory sheet that can fail its writes or run a hook during one."""
+
+    def __init__(self):
+        super().__init__()
+        self.fail = False
+        self.on_write = None
+
+    @property
+    def rows(self):
+        return self._rows[1:]
+
+    def append_rows(self, values, value_input_option="RAW"):
+        if self.fail:
+            raise RuntimeError("sheet unavailable")
+        result = super().append_rows(values, value_input_option)
+        if self.on_write:
+            hook, self.on_write = self.on_write, None
+            hook()
+        return result
+
+
+@pytest.fixture
+def store(tmp_path):
+    return LeadStore(str(tmp_path / "leads.sqlite3"))
+
+
+@pytest.fixture
+def sheet():
+    return FlakySheet()
+
+
+def _row(uuid, name="Cafe", email=""):
+    return [uuid, name, "1 Main St", "+491234567", "https://cafe.example", email]
+
+
+def test_upsert_outcomes(store):
+    assert store.upsert(_row("a")) == INSERTED
+    assert store.upsert(_row("a")) == UNCHANGED
+    assert store.upsert(_row("a", email="x@cafe.example")) == UPDATED
+    assert store.stats()["pending"] == 1
+
+
+def test_sync_writes_pending_and_marks_synced(store, sheet):
+    for uuid in "abc":
+        store.upsert(_row(uuid))
+    replicator = SheetsReplicator(store, batch_size=2, sheet=sheet)
+    assert replicator.sync() == 3
+    assert [r[0] for r in sheet.rows] == ["a", "b", "c"]
+    assert store.pending(10) == []
+    assert store.stats()["synced"] == 3
+
+    # An unchanged re-upsert costs nothing; a change is written in place
+    store.upsert(_row("b"))
+    store.upsert(_row("c", name="Cafe Two"))
+    assert replicator.sync() == 1
+    assert replicator.rows_updated == 1
+    assert sheet.rows[2][1] == "Cafe Two"
+    assert len(sheet.rows) == 3
+
+
+def test_failed_sync_keeps_rows_pending(store, sheet):
+    store.upsert(_row("a"))
+    sheet.fail = True
+    replicator = SheetsReplicator(store, sheet=sheet)
+    assert replicator.sync() == 0
+    assert replicator.failures == 1
+    assert len(store.pending(10)) == 1
+
+    sheet.fail = False
+    assert replicator.sync() == 1
+    assert store.pending(10) == []
+
+
+def test_change_during_write_stays_pending(store, sheet):
+    store.upsert(_row("a"))
+    # The agent updates the lead while its old values are being written
+    sheet.on_write = lambda: store.upsert(_row("a", email="new@cafe.example"))
+    replicator = SheetsReplicator(store, sheet=sheet)
+    replicator.sync()
+    assert sheet.rows[0][5] == "new@cafe.example"
+    assert store.pending(10) == []
+    assert len(sheet.rows) == 1
+
+
+def test_mark_synced_ignores_stale_revision(store):
+    store.upsert(_row("a"))
+    [(row, revision)] = store.pending(10)
+    store.upsert(_row("a", name="Renamed"))
+    assert store.mark_synced([(row[0], revision)]) == 0
+    [(row, newer)] = store.pending(10)
+    assert row[1] == "Renamed"
+    assert store.mark_synced([(row[0], newer)]) == 1
+
+
+def test_existing_store_gains_revision_column(tmp_path):
+    path = str(tmp_path / "old.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE leads (uuid TEXT PRIMARY KEY, name TEXT NOT NULL DEFAULT '',"
+        " address TEXT NOT NULL DEFAULT '', phone TEXT NOT NULL DEFAULT '',"
+        " website TEXT NOT NULL DEFAULT '', email TEXT NOT NULL DEFAULT '',"
+        " created_at REAL NOT NULL, sync_state TEXT NOT NULL DEFAULT 'pending',"
+        " sync_attempts INTEGER NOT NULL DEFAULT 0, sync_error TEXT, synced_at REAL)"
+    )
+    conn.execute("INSERT INTO leads (uuid, name, created_at) VALUES ('a', 'Old', 0)")
+    conn.commit()
+    conn.close()
+
+    store = LeadStore(path)
+    [(row, revision)] = store.pending(10)
+    assert (row[1], revision) == ("Old", 0)
+    assert store.mark_synced([("a", revision)]) == 1
+    assert store.stats()[SYNCED] == 1
+
+
+def test_summary_counts_in_sql(store):
+    store.upsert(_row("a", name="Cafe", email="hi@cafe.example"))
+    store.upsert(_row("b", name="Cafe", email="hi@cafe.example"))
+    store.upsert(_row("c", name="Bakery", email="hi@cafe.example"))
+    store.upsert(_row("d", name="Bakery", email="x@bakery.example"))
+    store.upsert(_row("e", name="Florist"))
+
+    summary = store.summary()
+
+    assert summary["leads"] == 5
+    assert summary["unique_names"] == 3
+    assert summary["unique_emails"] == 2
+    assert summary["duplicate_groups"] == 1
+    assert summary["duplicate_rows"] == 2
+    assert summary["duplicate_emails"] == [{"email": "hi@cafe.example", "count": 3}]
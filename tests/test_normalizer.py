@@ -0,0 +1,33 @@
+import pytest
+
+from app.agent.normalizer import classify, format_address, normalize_element
+
+
+def test_address_keeps_stored_format():
+    tags = {
+        "addr:housenumber": "42", "addr:street": "Unter den Linden",
+        "addr:postcode": "10117", "addr:city": "Berlin",
+    }
+    # Same line the baseline planner built, so existing leads stay unchanged
+    assert format_address(tags) == "42 Unter den Linden Berlin 10117"
+
+
+def test_address_falls_back_to_full():
+    assert format_address({"addr:full": "12 Rue de Rivoli, 75004 Paris"}) == "12 Rue de Rivoli, 75004 Paris"
+    assert format_address({"addr:full": "ignored", "addr:street": "Strand"}) == "Strand"
+    assert format_address({}) == ""
+
+
+@pytest.mark.parametrize("tags, expected", [
+    ({"amenity": "parking"}, False),
+    ({"amenity": "parking", "shop": "car_repair"}, True),
+    ({"amenity": "cafe"}, True),
+    ({"leisure": "park"}, False),
+    ({"building": "yes"}, None),
+])
+def test_classify(tags, expected):
+    assert classify(tags) is expected
+
+
+def test_parking_is_not_a_lead():
+    assert normalize_element({"tags": {"name": "P1", "amenity": "parking"}}) == (None, True)
@@ -0,0 +1,84 @@
+import json
+
+from app.llm.ollama_client import OllamaClient, _JsonScanner
+
+
+def _scan(pieces):
+    scanner = _JsonScanner()
+    for n, piece in enumerate(pieces):
+        if scanner.feed(piece):
+            return scanner, n
+    return scanner, None
+
+
+def test_scanner_stops_when_root_object_closes():
+    reply = '{"node/1": {"name": "A [x] {y}"}, "node/2": {"tags": ["a", "b"]}}'
+    pieces = [reply[i:i + 3] for i in range(0, len(reply), 3)] + ["  trailing"]
+    scanner, at = _scan(pieces)
+    assert at == len(pieces) - 2
+    assert scanner.end == len(reply)
+
+
+def test_scanner_does_not_stop_at_a_nested_value():
+    scanner, at = _scan(['{"a": {"b": 1}', ', "c": [1, 2]', "}"])
+    assert at == 2
+
+
+def test_scanner_handles_escaped_quotes():
+    scanner, at = _scan(['{"a": "quote \\" } still a string"', "}"])
+    assert at == 1
+
+
+def test_scanner_gives_up_on_prose_before_the_root():
+    scanner, at = _scan(["Here you go: ", '{"a": 1}', ' and {"b": 2}'])
+    assert at is None
+    assert scanner.gave_up
+
+
+class _StreamResponse:
+    def __init__(self, lines):
+        self.lines = lines
+        self.read = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_lines(self):
+        for line in self.lines:
+            self.read += 1
+            yield line
+
+
+def _client(monkeypatch, pieces):
+    lines = [json.dumps({"response": p, "done": False}).encode() for p in pieces]
+    lines.append(json.dumps({"response": "", "done": True, "eval_count": len(pieces)}).encode())
+    response = _StreamResponse(lines)
+    client = OllamaClient(base_url="http://ollama.invalid", model="test")
+    monkeypatch.setattr(client.session, "post", lambda *args, **kwargs: response)
+    return client, response
+
+
+def test_stream_stops_early_at_root_close(monkeypatch):
+    client, response = _client(monkeypatch, ['{"node/1": ', '{"name": "A"}', "}", "\n\n", "more"])
+    text = client.generate("prompt", stream=True)
+    assert json.loads(text) == {"node/1": {"name": "A"}}
+    assert response.read == 3
+    assert client.stats()["early_stops"] == 1
+
+
+def test_stream_with_prefix_runs_to_the_end(monkeypatch):
+    client, response = _client(monkeypatch, ["Sure! ", '{"a": 1}', " then ", '{"b": 2}'])
+    text = client.generate("prompt", stream=True)
+    assert text == 'Sure! {"a": 1} then {"b": 2}'
+    assert client.stats()["early_stops"] == 0
+
+
+def test_stream_without_json_mode_is_not_cut(monkeypatch):
+    client, _ = _client(monkeypatch, ['{"a": 1}', " tail"])
+    assert client.generate("prompt", json_mode=False, stream=True) == '{"a": 1} tail'
@@ -0,0 +1,29 @@
+import pytest
+
+from app.tools.osm_extract import extract
+
+osmium = pytest.importorskip("osmium")
+
+
+@pytest.fixture
+def pbf(tmp_path):
+    """An extract with enough nodes for several PBF blocks, plus one way."""
+    path = str(tmp_path / "town.osm.pbf")
+    writer = osmium.SimpleWriter(path)
+    for n in range(1, 20001):
+        tags = {"shop": "bakery", "name": f"Bakery {n}"} if n % 1000 == 0 else {}
+        writer.add_node(osmium.osm.mutable.Node(id=n, location=(13.0 + n * 1e-5, 52.0), tags=tags))
+    writer.add_way(osmium.osm.mutable.Way(id=1, nodes=[1, 2, 19999], tags={"shop": "bakery", "name": "Bakery Mall"}))
+    writer.close()
+    return path
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_pbf_extract_matches_in_any_worker_count(pbf, workers):
+    elements = extract(pbf, "bakery", workers=workers)
+
+    nodes = [e for e in elements if e["type"] == "node"]
+    ways = [e for e in elements if e["type"] == "way"]
+    assert [e["id"] for e in nodes] == list(range(1000, 20001, 1000))
+    assert [w["id"] for w in ways] == [1]
+    assert ways[0]["center"]["lat"] == pytest.approx(52.0)
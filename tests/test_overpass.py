@@ -0,0 +1,70 @@
+import queue
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app.agent.jobs import resource
+from app.tools import overpass
+from benchmarks.fakes import fake_overpass
+
+
+def _elements(n):
+    return [{"type": "node", "id": i, "lat": 52.0, "lon": 13.0, "tags": {"name": f"Cafe {i}"}}
+            for i in range(n)]
+
+
+@pytest.fixture
+def server(monkeypatch):
+    with fake_overpass(_elements(500), latency=0.0, chunk_bytes=2048) as fake:
+        monkeypatch.setattr(overpass, "OVERPASS_URL", f"{fake.url}/api/interpreter")
+        yield fake
+
+
+def _released(timeout=5.0):
+    limiter = resource("overpass")
+    deadline = time.time() + timeout
+    while limiter.stats()["in_use"]:
+        if time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_slot_is_freed_once_the_body_is_read_not_consumed(server):
+    results = overpass.iter_search("cafe in Berlin", limit=500, refresh=True)
+    first = next(results)
+    assert first["id"] == 0
+    # The consumer is still on the first element; the download is not
+    assert _released()
+    assert len(list(results)) == 499
+
+
+def test_abandoned_stream_frees_the_slot(server):
+    results = overpass.iter_search("cafe in Berlin", limit=500, refresh=True)
+    next(results)
+    results.close()
+    assert _released()
+
+
+def test_slow_consumer_keeps_the_read_ahead_bounded(monkeypatch):
+    buffers = []
+
+    class Recording(queue.Queue):
+        def __init__(self, maxsize=0):
+            super().__init__(maxsize)
+            buffers.append(self)
+
+    monkeypatch.setattr(overpass, "OVERPASS_READ_AHEAD", 4 * overpass.READ_CHUNK)
+    monkeypatch.setattr(overpass, "queue", SimpleNamespace(Queue=Recording, Full=queue.Full))
+    with fake_overpass(_elements(5000), latency=0.0, chunk_bytes=2048) as fake:
+        monkeypatch.setattr(overpass, "OVERPASS_URL", f"{fake.url}/api/interpreter")
+        results = overpass.iter_search("cafe in Berlin", limit=5000, refresh=True)
+        next(results)
+        time.sleep(0.3)
+        [buffer] = buffers
+        assert buffer.maxsize == 4 and buffer.qsize() <= 4
+        # The body is far larger than the buffer, so the download is waiting
+        assert resource("overpass").stats()["in_use"] == 1
+        assert len(list(results)) == 4999
+    assert _released()
@@ -0,0 +1,105 @@
+import random
+import threading
+import time
+
+from app.agent.pipeline import Pipeline
+
+
+def _jitter(x):
+    time.sleep(random.random() * 0.002)
+    return x
+
+
+def test_ordered_stage_sees_serial_order():
+    seen = []
+    pipe = (Pipeline(maxsize=8)
+            .add_stage("work", _jitter, workers=4)
+            .add_stage("collect", lambda x: seen.append(x) or x, ordered=True))
+    assert pipe.run(range(200)) == 200
+    assert seen == list(range(200))
+    assert pipe.completed == 200
+
+
+def test_ordered_batches_are_consecutive():
+    batches = []
+
+    def collect(items):
+        batches.append(list(items))
+        return items
+
+    pipe = (Pipeline(maxsize=8)
+            .add_stage("work", _jitter, workers=4)
+            .add_stage("collect", collect, ordered=True, batch_size=7))
+    pipe.run(range(100))
+    assert [x for batch in batches for x in batch] == list(range(100))
+    assert all(len(batch) <= 7 for batch in batches)
+
+
+def test_dropped_and_failed_items_do_not_stall_ordered_stage():
+    errors = []
+    seen = []
+
+    def work(x):
+        if x % 5 == 0:
+            raise ValueError(x)
+        return None if x % 3 == 0 else x
+
+    pipe = (Pipeline(maxsize=4, on_error=lambda stage, idx, e: errors.append((stage, idx)))
+            .add_stage("work", work, workers=3)
+            .add_stage("collect", lambda x: seen.append(x) or x, ordered=True))
+    pipe.run(range(60))
+    assert seen == [x for x in range(60) if x % 5 and x % 3]
+    assert sorted(idx for _, idx in errors) == list(range(0, 60, 5))
+    work_stats = pipe.stats()[0]
+    assert work_stats["errors"] == 12
+    assert work_stats["processed"] == 48
+    assert pipe.completed == 60
+
+
+def test_failed_batch_drops_only_that_batch():
+    def batch(items):
+        if 13 in items:
+            raise RuntimeError("boom")
+        return [x * 2 for x in items]
+
+    out = []
+    pipe = (Pipeline(maxsize=16)
+            .add_stage("batch", batch, batch_size=4)
+            .add_stage("collect", lambda x: out.append(x) or x, ordered=True))
+    pipe.run(range(40))
+    assert 26 not in out
+    assert len(out) == 40 - pipe.stats()[0]["errors"]
+    assert out == sorted(out)
+
+
+def test_stages_run_concurrently():
+    active = []
+    peak = [0]
+    lock = threading.Lock()
+
+    def slow(x):
+        with lock:
+            active.append(x)
+            peak[0] = max(peak[0], len(active))
+        time.sleep(0.01)
+        with lock:
+            active.remove(x)
+        return x
+
+    Pipeline(maxsize=8).add_stage("slow", slow, workers=4).run(range(20))
+    assert peak[0] > 1
+
+
+def test_source_error_still_releases_workers():
+    def source():
+        yield 1
+        yield 2
+        raise RuntimeError("source failed")
+
+    seen = []
+    pipe = Pipeline().add_stage("collect", lambda x: seen.append(x) or x, ordered=True)
+    try:
+        pipe.run(source())
+    except RuntimeError:
+        pass
+    assert seen == [1, 2]
@@ -0,0 +1,84 @@
+import json
+
+import pytest
+
+from app.agent import planner
+
+
+def _element(n, **tags):
+    # No street and no business tag, so the rules are unsure and the LLM is asked
+    return {"type": "node", "id": n, "tags": {"name": f"Place {n}", **tags}}
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    """Replace the LLM with a scripted one; records every prompt it gets."""
+    calls = []
+    replies = []
+
+    def fake(prompt, json_mode=True, num_predict=None):
+        calls.append(prompt)
+        return replies.pop(0) if replies else "{}"
+
+    monkeypatch.setattr(planner, "call_llm", fake)
+    monkeypatch.setattr(planner, "get_cache", lambda: None)
+    return calls, replies
+
+
+def test_parse_batch_response_object_keyed_by_id():
+    text = 'Sure:\n{"node/1": {"name": "A"}, "way/2": {"name": "B"}}\n'
+    assert planner._parse_batch_response(text) == {"node/1": {"name": "A"}, "way/2": {"name": "B"}}
+
+
+@pytest.mark.parametrize("text", ["", "no json here", "[1, 2]"])
+def test_parse_batch_response_rejects_non_objects(text):
+    with pytest.raises(ValueError):
+        planner._parse_batch_response(text)
+
+
+def test_batch_is_one_call(llm):
+    calls, replies = llm
+    raws = [_element(n) for n in range(3)]
+    replies.append(json.dumps({
+        f"node/{n}": {"name": f"Clean {n}", "address": "", "phone": "", "website": "", "email": ""}
+        for n in range(3)
+    }))
+    leads = planner.enrich_leads(raws, batch_size=8)
+    assert len(calls) == 1
+    assert "node/2" in calls[0]
+    assert [lead["name"] for lead in leads] == ["Clean 0", "Clean 1", "Clean 2"]
+
+
+def test_missing_and_invalid_entries_fall_back_per_lead(llm):
+    calls, replies = llm
+    raws = [_element(n) for n in range(3)]
+    replies.append(json.dumps({
+        "node/0": {"name": "Clean 0"},
+        "node/1": {"name": ["not", "a", "string"]},
+        "node/99": {"name": "Unknown id"},
+    }))
+    replies.extend([json.dumps({"name": "Single 1"}), json.dumps({"name": "Single 2"})])
+    leads = planner.enrich_leads(raws, batch_size=8)
+    assert len(calls) == 3
+    assert [lead["name"] for lead in leads] == ["Clean 0", "Single 1", "Single 2"]
+
+
+def test_unparseable_batch_keeps_rule_drafts(llm):
+    calls, replies = llm
+    raws = [_element(n, phone="12") for n in range(2)]
+    replies.extend(["not json", "not json", "not json"])
+    leads = planner.enrich_leads(raws, batch_size=8)
+    assert len(calls) == 3
+    assert [lead["name"] for lead in leads] == ["Place 0", "Place 1"]
+
+
+def test_confident_elements_skip_the_llm(llm):
+    calls, _ = llm
+    raw = {"type": "node", "id": 5, "tags": {"name": "Bakery", "shop": "bakery", "addr:street": "Main St"}}
+    avoided = []
+    leads = planner.enrich_leads([raw, {"type": "node", "id": 6, "tags": {}}], batch_size=8,
+                                 count_avoided=avoided.append)
+    assert calls == []
+    assert leads[0]["name"] == "Bakery"
+    assert leads[1] is None
+    assert avoided == [1]
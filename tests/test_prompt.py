@@ -0,0 +1,21 @@
+from app.agent import prompt
+
+
+def _fail(*args):
+    raise AssertionError("full prompt built for a compact request")
+
+
+def test_compact_prompts_skip_the_full_prompt(monkeypatch):
+    monkeypatch.setattr(prompt, "_full_prompt", _fail)
+    monkeypatch.setattr(prompt, "_full_batch_prompt", _fail)
+    raw = {"type": "node", "id": 1, "tags": {"name": "Bakery", "shop": "bakery", "wheelchair": "yes"}}
+    before = prompt.prompt_stats()
+
+    single = prompt.build_prompt(raw, style="compact")
+    batch = prompt.build_batch_prompt([("node/1", raw)], style="compact")
+
+    assert "name=Bakery" in single and "wheelchair" not in single
+    assert "id=node/1" in batch
+    after = prompt.prompt_stats()
+    assert after["prompts"] == before["prompts"] + 2
+    assert after["sent_chars"] == before["sent_chars"] + len(single) + len(batch)
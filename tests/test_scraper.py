@@ -0,0 +1,31 @@
+import pytest
+
+from app.tools.scraper import EmailScraper
+from benchmarks.fakes import fake_websites
+
+
+@pytest.fixture
+def scraper():
+    scraper = EmailScraper(max_bytes=4000)
+    yield scraper
+    scraper.close()
+
+
+def test_fetch_text_returns_visible_text(scraper):
+    with fake_websites(latency=0.0, page_bytes=500, email_ratio=1.0) as site:
+        text = scraper.fetch_text(f"{site.url}/")
+
+    assert "lorem ipsum" in text
+    assert "<p>" not in text
+
+
+def test_fetch_text_reads_at_most_max_bytes(scraper):
+    with fake_websites(latency=0.0, page_bytes=50000) as site:
+        text = scraper.fetch_text(f"{site.url}/")
+
+    assert 0 < len(text) <= 4000
+
+
+def test_fetch_text_is_empty_when_unreachable(scraper):
+    assert scraper.fetch_text("http://127.0.0.1:9/") == ""
+    assert scraper.fetch_text("not a url") == ""
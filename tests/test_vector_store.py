@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+
+from app.memory import vector_store
+from app.memory.blocking import Blocker
+from app.memory.vector_store import DedupIndex
+
+DIM = 16
+
+
+def _vectors(n, seed):
+    rng = np.random.default_rng(seed)
+    v = rng.standard_normal((n, DIM)).astype("float32")
+    return v / np.linalg.norm(v, axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize("kind", ["flat", "hnsw", "ivf"])
+def test_reloaded_index_accepts_adds(tmp_path, kind):
+    path = str(tmp_path / "dedup.faiss")
+    index = DedupIndex(DIM, path, kind=kind)
+    first = _vectors(400, 0)
+    if kind == "ivf":
+        index.reset("ivf", train=first)
+    index.add(first, list(range(400)))
+    index.save()
+
+    reloaded = DedupIndex(DIM, path, kind=kind)
+    assert reloaded.kind == kind
+    assert len(reloaded) == 400
+    assert 399 in reloaded
+
+    more = _vectors(5, 1)
+    reloaded.add(more, [1000 + i for i in range(5)])
+    assert len(reloaded) == 405
+    sims, ids = reloaded.search(more[:1], 1)
+    assert ids[0][0] == 1000
+    assert sims[0][0] == pytest.approx(1.0, abs=1e-4)
+
+    # And it survives a second round trip with the new vectors in it
+    reloaded.save()
+    again = DedupIndex(DIM, path, kind=kind)
+    assert len(again) == 405
+    again.add(_vectors(1, 2), [2000])
+    assert np.allclose(again.vectors([1000])[0], more[0], atol=1e-5)
+
+
+def test_mismatched_meta_starts_fresh(tmp_path, monkeypatch):
+    path = str(tmp_path / "dedup.faiss")
+    index = DedupIndex(DIM, path, kind="flat")
+    index.add(_vectors(3, 0), [1, 2, 3])
+    index.save()
+    monkeypatch.setattr("app.memory.vector_store.TEXT_VERSION", "other")
+    assert len(DedupIndex(DIM, path, kind="flat")) == 0
+
+
+@pytest.fixture
+def dedup(monkeypatch):
+    """A fresh, empty in-memory index and blocker (no model is loaded)."""
+    monkeypatch.setattr(vector_store, "_index", DedupIndex(DIM))
+    monkeypatch.setattr(vector_store, "_blocker", Blocker())
+
+
+def _lead(n, phone="+49301234567"):
+    return {"osm": f"node/{n}", "name": f"Cafe {n}", "address": f"{n} Main St", "phone": phone,
+            "website": "", "email": "", "lat": 52.0 + n, "lon": 13.0}
+
+
+def test_retried_lead_is_not_its_own_duplicate(dedup):
+    assert vector_store.dedupe_batch([_lead(1)]) == [False]
+    # Same lead again, as when its write failed and a later run retries it
+    assert vector_store.dedupe_batch([_lead(1)]) == [False]
+    assert vector_store.get_blocker().stats()["leads"] == 1
+    # A different lead sharing its phone nearby is still caught
+    other = {**_lead(2), "lat": _lead(1)["lat"]}
+    assert vector_store.dedupe_batch([other]) == [True]
+
+
+def test_lead_whose_write_failed_is_stored_on_retry(dedup, agent_env, monkeypatch):
+    from app.agent import agent
+    from app.agent.jobs import DONE, Job
+    from app.services.lead_store import get_store
+
+    monkeypatch.setattr(agent, "dedupe_batch", vector_store.dedupe_batch)
+    agent_env.append({"type": "node", "id": 7, "lat": 52.0, "lon": 13.0,
+                      "tags": {"name": "Bakery", "shop": "bakery", "addr:street": "Main St",
+                               "phone": "+49301234567"}})
+    save_lead = agent.save_lead
+
+    def failing(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(agent, "save_lead", failing)
+    first = Job("bakeries")
+    agent.run_job(first)
+    assert first.stats["errors"] == 1
+
+    monkeypatch.setattr(agent, "save_lead", save_lead)
+    retry = Job("bakeries")
+    agent.run_job(retry)
+    assert retry.status == DONE
+    assert retry.stats["skipped_duplicates"] == 0
+    assert retry.stats["leads_written"] == 1
+    assert len(get_store().all()) == 1
@@ -1,7 +1,8 @@
-import io
+import json
 import os
 import time
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlencode
 
 import pandas as pd
 import requests
@@ -21,47 +22,94 @@ def get_backend_url() -> str:
     return os.getenv("BACKEND_URL", "http://localhost:8000")
 
 
-def trigger_agent(query: str) -> bool:
+def get_public_backend_url() -> str:
+    # Export links are opened by the browser, which may not reach BACKEND_URL
+    # (e.g. http://api:8000 inside Docker)
+    return os.getenv("PUBLIC_BACKEND_URL") or get_backend_url()
+
+
+def trigger_agent(query: str) -> Optional[str]:
+    """Queue a run; returns its job id, or None if the backend is unreachable."""
     try:
         resp = requests.post(
             f"{get_backend_url().rstrip('/')}/run",
             params={"query": query},
             timeout=5,
         )
-        return resp.ok
+        if not resp.ok:
+            return None
+        return resp.json().get("job_id")
     except Exception:
-        return False
-
-
-def fetch_leads() -> List[Dict]:
+        return None
+
+
+LEAD_COLUMNS = ["uuid", "name", "address", "phone", "website", "email"]
+# Distinct /leads queries whose last response is kept for If-None-Match
+MAX_CACHED_QUERIES = 20
+
+
+def fetch_leads(
+    offset: int = 0,
+    limit: Optional[int] = None,
+    fields: Optional[List[str]] = None,
+    filters: Optional[Dict[str, str]] = None,
+) -> Tuple[List[Dict], int]:
+    """
+    Fetch one page of leads and the total number matching ``filters``.
+    Responses are kept per query in the session and revalidated with
+    If-None-Match, so an unchanged page costs a 304 and no payload.
+    """
+    params: Dict[str, Any] = {"offset": offset}
+    if limit:
+        params["limit"] = limit
+    if fields:
+        params["fields"] = ",".join(fields)
+    params.update({k: v for k, v in (filters or {}).items() if v})
+
+    cache = st.session_state.setdefault("leads_cache", {})
+    key = json.dumps(params, sort_keys=True)
+    cached = cache.get(key)
+    headers = {"If-None-Match": cached["etag"]} if cached else {}
     try:
         resp = requests.get(
             f"{get_backend_url().rstrip('/')}/leads",
+            params=params,
+            headers=headers,
             timeout=8,
         )
-        if not resp.ok:
-            return []
-        data = resp.json()
-        if isinstance(data, list):
-            return data
-        return []
     except Exception:
-        return []
-
-
-def get_leads_df() -> pd.DataFrame:
-    leads = fetch_leads()
+        return (cached["data"], cached["total"]) if cached else ([], 0)
+
+    if resp.status_code == 304 and cached:
+        return cached["data"], cached["total"]
+    if not resp.ok:
+        return [], 0
+    data = resp.json()
+    if not isinstance(data, list):
+        return [], 0
+    total = int(resp.headers.get("X-Total-Count", len(data)))
+    if resp.headers.get("ETag"):
+        cache.pop(key, None)
+        cache[key] = {"etag": resp.headers["ETag"], "data": data, "total": total}
+        while len(cache) > MAX_CACHED_QUERIES:
+            cache.pop(next(iter(cache)))
+    return data, total
+
+
+def get_leads_df(**kwargs) -> Tuple[pd.DataFrame, int]:
+    leads, total = fetch_leads(**kwargs)
+    columns = kwargs.get("fields") or LEAD_COLUMNS
     if not leads:
-        return pd.DataFrame(
-            columns=["uuid", "name", "address", "phone", "website", "email"]
-        )
-    return pd.DataFrame(leads)
+        return pd.DataFrame(columns=columns), total
+    return pd.DataFrame(leads), total
 
 
-def fetch_stats() -> Dict[str, Any]:
+def fetch_stats(job_id: Optional[str] = None) -> Dict[str, Any]:
+    # Our own job when we started one, so other users' runs don't show up here
+    path = f"/jobs/{job_id}" if job_id else "/stats"
     try:
         resp = requests.get(
-            f"{get_backend_url().rstrip('/')}/stats",
+            f"{get_backend_url().rstrip('/')}{path}",
             timeout=5,
         )
         if not resp.ok:
@@ -74,12 +122,99 @@ def fetch_stats() -> Dict[str, Any]:
         return {}
 
 
+def fetch_summary() -> Dict[str, Any]:
+    """Lead totals computed by the backend, so the metrics never pull every lead."""
+    try:
+        resp = requests.get(
+            f"{get_backend_url().rstrip('/')}/leads/summary",
+            timeout=5,
+        )
+        if not resp.ok:
+            return {}
+        data = resp.json()
+        return data if isinstance(data, dict) else {}
+    except Exception:
+        return {}
+
+
+def iter_job_events(job_id: str):
+    """(event, data) pairs from the job's server-sent event stream, until it ends."""
+    url = f"{get_backend_url().rstrip('/')}/jobs/{job_id}/events"
+    try:
+        with requests.get(url, stream=True, timeout=(5, 60)) as resp:
+            if not resp.ok:
+                return
+            event = "message"
+            for line in resp.iter_lines(decode_unicode=True):
+                if line.startswith("event: "):
+                    event = line[len("event: "):]
+                elif line.startswith("data: "):
+                    yield event, json.loads(line[len("data: "):])
+                    event = "message"
+    except Exception:
+        return
+
+
+OUTCOME_ICONS = {
+    "inserted": "✅", "updated": "♻️", "unchanged": "⏸️",
+    "duplicate": "🔄", "skipped": "⏭️", "error": "❌", "already_processed": "💾",
+}
+
+
+def render_progress(progress_placeholder, status_placeholder, stats: Dict[str, Any]) -> None:
+    status = stats.get("status") or "idle"
+    elements = int(stats.get("elements") or 0)
+    processed = int(stats.get("processed") or 0)
+    pct = stats.get("percent")
+    if status == "queued":
+        progress_placeholder.progress(0, text="Agent queued...")
+    elif status == "running":
+        if pct is None:
+            # Elements are still streaming in, so the total is a lower bound
+            pct = min(100.0 * processed / elements, 95.0) if elements else 0.0
+            text = f"Agent running... {processed} of {elements}+ elements"
+        else:
+            text = f"Agent running... {processed} of {elements} elements ({pct:.0f}%)"
+        progress_placeholder.progress(int(pct), text=text)
+    else:
+        progress_placeholder.progress(
+            100 if status in {"done", "cancelled"} else 0,
+            text={"done": "Agent finished", "cancelled": "Agent cancelled",
+                  "error": "Agent failed"}.get(status, "Agent idle"),
+        )
+    lines = [
+        f"Status: **{status}**  ·  Elements: **{elements}**  ·  Processed: **{processed}**  ·  "
+        f"Written: **{int(stats.get('leads_written') or 0)}**  ·  "
+        f"Duplicates: **{int(stats.get('skipped_duplicates') or 0)}**  ·  "
+        f"Errors: **{int(stats.get('errors') or 0)}**"
+    ]
+    stages = [f"{s['name']} {s['per_s']}/s" for s in stats.get("stages") or [] if "per_s" in s]
+    if stages:
+        lines.append("Throughput: " + "  ·  ".join(stages))
+    status_placeholder.info("  \n".join(lines))
+
+
+def follow_job(job_id: str, progress_placeholder, status_placeholder, log_placeholder) -> None:
+    """Update the progress widgets from pushed events until the job ends."""
+    recent: List[str] = []
+    for event, data in iter_job_events(job_id):
+        if event == "lead":
+            icon = OUTCOME_ICONS.get(data.get("outcome"), "•")
+            recent = (recent + [f"{icon} {data.get('outcome')}: {data.get('name') or data.get('osm') or ''}"])[-8:]
+            log_placeholder.caption("  \n".join(reversed(recent)))
+        elif event in ("progress", "end"):
+            render_progress(progress_placeholder, status_placeholder, data)
+        if event == "end":
+            break
+    st.session_state["is_running"] = False
+
+
 def ensure_session_state() -> None:
     defaults = {
         "last_query": "",
         "is_running": False,
         "run_started_at": None,
-        "baseline_count": None,
+        "job_id": None,
     }
     for k, v in defaults.items():
         if k not in st.session_state:
@@ -143,12 +278,11 @@ def main() -> None:
             st.session_state["last_query"] = ""
             st.session_state["is_running"] = False
             st.session_state["run_started_at"] = None
-            st.session_state["baseline_count"] = None
+            st.session_state["job_id"] = None
             st.experimental_rerun()
 
-        # Initial data load for metrics and table
-        leads_df = get_leads_df()
-        total_leads = len(leads_df)
+        # A one-row page is enough: the total comes from X-Total-Count
+        _, total_leads = fetch_leads(limit=1, fields=["uuid"])
 
         if run_clicked:
             if not query.strip():
@@ -157,12 +291,12 @@ def main() -> None:
                 st.session_state["last_query"] = query.strip()
                 st.session_state["is_running"] = True
                 st.session_state["run_started_at"] = time.time()
-                st.session_state["baseline_count"] = total_leads
 
                 with st.spinner("Starting agent in the background..."):
-                    ok = trigger_agent(query.strip())
+                    job_id = trigger_agent(query.strip())
+                st.session_state["job_id"] = job_id
 
-                if ok:
+                if job_id:
                     st.success(
                         "✅ Agent started successfully.\n\n"
                         "You can continue using this UI while the agent enriches "
@@ -181,46 +315,47 @@ def main() -> None:
         progress_placeholder = st.empty()
         status_placeholder = st.empty()
 
-        stats = fetch_stats()
-        status = stats.get("status") or ("running" if st.session_state.get("is_running") else "idle")
-
-        if status == "running" and st.session_state.get("run_started_at"):
-            # Use pages_processed as a simple proxy for progress (no strict upper bound).
-            pages = int(stats.get("pages_processed") or 0)
-            pct = max(5, min(pages * 10, 95))  # 10% per page, cap at 95%
-            progress_placeholder.progress(pct, text=f"Agent running... ~{pct}%")
-
-            # Re-fetch leads to detect growth since run started
-            leads_df = get_leads_df()
-            current_count = len(leads_df)
-            baseline = st.session_state.get("baseline_count") or 0
-            new_since_start = max(current_count - baseline, 0)
-
-            status_placeholder.info(
-                f"Status: **{status}**  ·  "
-                f"Pages processed: **{int(stats.get('pages_processed') or 0)}**  ·  "
-                f"New leads this run: **{new_since_start}**"
-            )
-        else:
-            # Mark run as finished in UI if backend reports done or error.
-            if status in {"done", "error"}:
-                st.session_state["is_running"] = False
+        log_placeholder = st.empty()
 
-            progress_placeholder.progress(
-                100 if status == "done" else 0,
-                text="Agent finished" if status == "done" else "Agent idle",
-            )
+        job_id = st.session_state.get("job_id")
+        stats = fetch_stats(job_id)
+        status = stats.get("status") or "idle"
+        # Our job is followed over its event stream once the page has rendered
+        following = bool(job_id) and status in {"queued", "running"}
+        if status in {"done", "error", "cancelled"}:
+            st.session_state["is_running"] = False
+        render_progress(progress_placeholder, status_placeholder, stats)
+        if not following:
             status_placeholder.info(
                 f"Status: **{status}**  ·  "
-                f"Current total leads in Google Sheets: **{total_leads}**"
+                f"Current total leads: **{total_leads}**"
             )
 
         st.markdown("### 📋 Results")
-        st.caption("Preview of leads currently stored in Google Sheets.")
+        st.caption("Leads in the lead store (replicated to Google Sheets).")
+
+        f_name, f_address, f_email = st.columns(3)
+        filters = {
+            "name": f_name.text_input("Name contains", key="filter_name"),
+            "address": f_address.text_input("Address contains", key="filter_address"),
+            "email": f_email.text_input("Email contains", key="filter_email"),
+        }
+        p_size, p_num = st.columns(2)
+        page_size = p_size.selectbox("Rows per page", [25, 50, 100, 250], index=1)
+        page = p_num.number_input("Page", min_value=1, value=1, step=1)
+
+        leads_df, matched = get_leads_df(
+            offset=(int(page) - 1) * page_size, limit=page_size, filters=filters
+        )
 
         if leads_df.empty:
-            st.warning("No leads found yet. Run the agent to start collecting data.")
+            if total_leads:
+                st.warning("No leads on this page match the filters.")
+            else:
+                st.warning("No leads found yet. Run the agent to start collecting data.")
         else:
+            first = (int(page) - 1) * page_size + 1
+            st.caption(f"Showing {first}–{first + len(leads_df) - 1} of {matched} matching leads.")
             # Ensure standard column order if these fields exist
             preferred_cols = ["uuid", "name", "address", "phone", "website", "email"]
             cols = [c for c in preferred_cols if c in leads_df.columns] + [
@@ -234,35 +369,23 @@ def main() -> None:
                 hide_index=True,
             )
 
-            # Export options
+            # Export options: links to the streaming export endpoints, so
+            # nothing is serialized here and the browser downloads directly
             st.markdown("#### 📤 Export")
-
-            csv_buf = io.StringIO()
-            leads_df.to_csv(csv_buf, index=False)
-            st.download_button(
-                "⬇️ Download CSV",
-                data=csv_buf.getvalue(),
-                file_name="osm_agentic_leads.csv",
-                mime="text/csv",
-            )
-
-            json_buf = io.StringIO()
-            json_buf.write(leads_df.to_json(orient="records", force_ascii=False))
-            st.download_button(
-                "⬇️ Download JSON",
-                data=json_buf.getvalue(),
-                file_name="osm_agentic_leads.json",
-                mime="application/json",
-            )
+            st.caption("Exports contain all leads matching the filters, not just this page.")
+            query_string = urlencode({k: v for k, v in filters.items() if v})
+            base = f"{get_public_backend_url().rstrip('/')}/leads/export"
+            e_csv, e_jsonl, e_parquet = st.columns(3)
+            e_csv.link_button("⬇️ Download CSV", f"{base}.csv?{query_string}")
+            e_jsonl.link_button("⬇️ Download JSONL", f"{base}.jsonl?{query_string}")
+            e_parquet.link_button("⬇️ Download Parquet", f"{base}.parquet?{query_string}")
 
     # ── Side column: metrics, dedup stats, tips ───────────────────────────
     with col_side:
         st.subheader("📊 Metrics")
-        if "leads_df" not in locals():
-            leads_df = get_leads_df()
-        total_leads = len(leads_df)
-        unique_names = leads_df["name"].nunique() if "name" in leads_df else 0
-        unique_emails = leads_df["email"].nunique() if "email" in leads_df else 0
+        summary = fetch_summary()
+        unique_names = int(summary.get("unique_names") or 0)
+        unique_emails = int(summary.get("unique_emails") or 0)
 
         c1, c2 = st.columns(2)
         with c1:
@@ -278,26 +401,22 @@ def main() -> None:
             st.metric("Avg leads / name", avg_per_name)
 
         st.markdown("### 🧠 Dedup stats")
-        if not leads_df.empty and "email" in leads_df:
-            dup_counts = leads_df["email"].value_counts()
-            duplicate_emails = dup_counts[dup_counts > 1]
-            num_dup_groups = len(duplicate_emails)
-            num_dup_rows = int(duplicate_emails.sum() - num_dup_groups)
-
+        if unique_emails:
             st.write(
-                f"- Duplicate groups by email: **{num_dup_groups}**  \n"
-                f"- Extra rows beyond first occurrence: **{num_dup_rows}**"
+                f"- Duplicate groups by email: **{int(summary.get('duplicate_groups') or 0)}**  \n"
+                f"- Extra rows beyond first occurrence: **{int(summary.get('duplicate_rows') or 0)}**"
             )
 
-            with st.expander("Show duplicate email groups"):
-                dup_df = leads_df[leads_df["email"].isin(duplicate_emails.index)]
-                st.dataframe(
-                    dup_df.sort_values("email"),
-                    use_container_width=True,
-                    hide_index=True,
-                )
+            duplicates = summary.get("duplicate_emails") or []
+            if duplicates:
+                with st.expander("Show duplicate email groups"):
+                    st.dataframe(
+                        pd.DataFrame(duplicates),
+                        use_container_width=True,
+                        hide_index=True,
+                    )
         else:
-            st.info("No deduplication stats yet (need at least one `email` column).")
+            st.info("No deduplication stats yet (no leads with an email).")
 
         st.markdown("### 💡 Tips")
         st.markdown(
@@ -306,6 +425,11 @@ def main() -> None:
             "- Keep your Google Sheet open to watch new rows appear in real‑time"
         )
 
+    if following:
+        follow_job(job_id, progress_placeholder, status_placeholder, log_placeholder)
+        # Reload once so the results table and metrics include this run's leads
+        st.experimental_rerun()
+
 
 if __name__ == "__main__":
     main()